@@ -0,0 +1,16 @@
+'''
+asv (airspeed velocity) benchmarks for pygridtools.
+
+The grids, islands, and soundings are synthetic (see `synthetic`), so
+nothing here needs gridgen. Each benchmark is parametrized over grid
+sizes that it can handle in a reasonable time: from 100x100 up to
+4000x4000 nodes for the array operations, and fewer for the writers,
+shapefiles, and plots, which touch every node or cell in Python.
+
+Results are stored per commit (and machine) in ``.asv/results``:
+
+    asv run                      # benchmark the latest commit
+    asv continuous master HEAD   # compare two commits, flag regressions
+    asv compare master HEAD      # tabulate stored results
+    asv publish && asv preview   # browse the history
+'''
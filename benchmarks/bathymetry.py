@@ -0,0 +1,32 @@
+from pygridtools import core, misc
+
+from .synthetic import makeBathymetry, makeCurvilinearNodes
+
+
+class TimeInterpolateBathymetry(object):
+    '''
+    Interpolating 100,000 scattered soundings onto the cell centers
+    with each engine.
+    '''
+
+    params = ([100, 1000], list(misc.INTERPOLATION_ENGINES))
+    param_names = ['n', 'engine']
+    timeout = 300
+
+    def setup(self, n, engine):
+        x, y = makeCurvilinearNodes(n)
+        mg = core.ModelGrid(x, y)
+        self.xc, self.yc = mg.xc, mg.yc
+        self.bathy = makeBathymetry(100000)
+
+        # `csa` comes from a compiled part of pygridgen that might not
+        # be available (a missing shared library raises OSError)
+        if engine == 'csa':
+            try:
+                from pygridgen import csa
+            except (ImportError, OSError):
+                raise NotImplementedError('csa is not available')
+
+    def time_interpolate(self, n, engine):
+        misc.interpolateBathymetry(self.bathy, self.xc, self.yc,
+                                   engine=engine)
@@ -0,0 +1,37 @@
+import shutil
+import tempfile
+
+from pygridtools import core
+
+from .synthetic import makeCurvilinearNodes, makeIslands
+
+
+class TimeGEFDCWriters(object):
+    '''
+    Each of the GEFDC input files written by a ModelGrid.
+    '''
+
+    params = [100, 1000]
+    param_names = ['n']
+    timeout = 300
+
+    def setup(self, n):
+        self.tmpdir = tempfile.mkdtemp()
+        x, y = makeCurvilinearNodes(n)
+        self.mg = core.ModelGrid(x, y)
+        self.mg.mask_cells_with_polygons(makeIslands(20))
+
+    def teardown(self, n):
+        shutil.rmtree(self.tmpdir)
+
+    def time_control_file(self, n):
+        self.mg.writeGEFDCControlFile(outputdir=self.tmpdir)
+
+    def time_cell_file(self, n):
+        self.mg.writeGEFDCCellFile(outputdir=self.tmpdir)
+
+    def time_grid_file(self, n):
+        self.mg.writeGEFDCGridFile(outputdir=self.tmpdir)
+
+    def time_gridext_file(self, n):
+        self.mg.writeGEFDCGridextFile(self.tmpdir)
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas
+
+from pygridtools import io
+
+
+def _pandas_gridout(xcoords, ycoords, outfile):
+    # the DataFrame/to_csv writer that `io._write_gridout_file` replaced
+    ny, nx = xcoords.shape
+    df = pandas.DataFrame({'x': xcoords.flatten(), 'y': ycoords.flatten()})
+    with open(outfile, 'w') as f:
+        f.write('## {:d} x {:d}\n'.format(nx, ny))
+        df.to_csv(f, sep=' ', na_rep='NaN', index=False,
+                  header=False, float_format='%.3f')
+
+
+def _pandas_gridext(xcoords, ycoords, outfile, shift=2):
+    # the stacked-DataFrame writer that `io._write_gridext_nodes` replaced
+    df = pandas.DataFrame({'easting': xcoords.flatten(),
+                           'northing': ycoords.flatten()})
+    jj, ii = np.indices(xcoords.shape)
+    df['i'] = ii.flatten() + shift
+    df['j'] = jj.flatten() + shift
+    df = df.dropna(how='all', subset=['easting', 'northing'])
+    io._write_gridext_file(df, outfile)
+
+
+class TimeGridout(object):
+    '''
+    Writing and reading grid.out (and writing gridext.inp) files,
+    compared to the pandas path.
+    '''
+
+    params = [100, 1000]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outfile = os.path.join(self.tmpdir, 'grid.out')
+        self.extfile = os.path.join(self.tmpdir, 'gridext.inp')
+        x, y = np.meshgrid(np.linspace(0, 1e5, n), np.linspace(0, 1e5, n))
+        x[::7, ::3] = np.nan
+        y[::7, ::3] = np.nan
+        self.x, self.y = x, y
+        io._write_gridout_file(x, y, self.outfile)
+
+    def teardown(self, n):
+        shutil.rmtree(self.tmpdir)
+
+    def time_write(self, n):
+        io._write_gridout_file(self.x, self.y, self.outfile)
+
+    def time_write_pandas(self, n):
+        _pandas_gridout(self.x, self.y, self.outfile)
+
+    def time_read(self, n):
+        io.readGridout(self.outfile)
+
+    def time_write_gridext(self, n):
+        io._write_gridext_nodes(self.x, self.y, self.extfile)
+
+    def time_write_gridext_pandas(self, n):
+        _pandas_gridext(self.x, self.y, self.extfile)
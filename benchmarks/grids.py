@@ -0,0 +1,57 @@
+from pygridtools import core, misc
+
+from .synthetic import makeCurvilinearNodes, makeIslands
+
+
+class TimeModelGrid(object):
+    '''
+    Array operations on a ModelGrid, from 100x100 to 4000x4000 nodes.
+    A new ModelGrid is made for each measurement so that nothing is
+    served from its cache.
+    '''
+
+    params = [100, 1000, 4000]
+    param_names = ['n']
+    timeout = 300
+
+    def setup(self, n):
+        self.x, self.y = makeCurvilinearNodes(n)
+        self.island = makeIslands(1, size=1000.)[0]
+        self.islands = makeIslands(20)
+
+        # the lower half of the grid, to be merged below the upper half
+        half = n // 2
+        self.upper = core.ModelGrid(self.x[:half], self.y[:half])
+        self.lower = core.ModelGrid(self.x[half:], self.y[half:])
+
+        mg = core.ModelGrid(self.x, self.y)
+        mg.mask_cells_with_polygons(self.islands)
+        self.node_mask = mg.valid_nodes
+        self.cell_mask = mg.cell_mask
+
+    def grid(self):
+        return core.ModelGrid(self.x, self.y)
+
+    def time_cell_centers(self, n):
+        self.grid().xc
+
+    def time_mask_cells_with_polygon(self, n):
+        self.grid().mask_cells_with_polygon(self.island)
+
+    def time_mask_cells_with_polygons(self, n):
+        self.grid().mask_cells_with_polygons(self.islands)
+
+    def time_mask_cells_with_polygons_chunked(self, n):
+        mg = self.grid()
+        mg.chunksize = 100000
+        mg.mask_cells_with_polygons(self.islands)
+
+    def time_merge(self, n):
+        upper = core.ModelGrid(self.upper.xn, self.upper.yn)
+        upper.merge(self.lower, how='vert', where='+')
+
+    def time_make_gefdc_cells(self, n):
+        misc.make_gefdc_cells(self.node_mask, self.cell_mask)
+
+    def peakmem_cell_centers(self, n):
+        self.grid().xc
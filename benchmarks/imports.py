@@ -0,0 +1,18 @@
+class TimeImports(object):
+    '''
+    Import times, each measured in a fresh interpreter. Importing the
+    package itself should not pull in the plotting (matplotlib,
+    seaborn, bokeh) or GIS (fiona) stacks.
+    '''
+
+    def timeraw_import_pygridtools(self):
+        return "import pygridtools"
+
+    def timeraw_import_pygridtools_io(self):
+        return "import pygridtools.io"
+
+    def timeraw_import_pygridtools_viz(self):
+        return "import pygridtools.viz"
+
+    def timeraw_import_fiona(self):
+        return "import fiona"
@@ -0,0 +1,35 @@
+import matplotlib
+matplotlib.use('agg')
+import matplotlib.pyplot as plt
+
+from pygridtools import misc, viz
+
+from .synthetic import makeCurvilinearNodes, makeIslands
+
+
+class TimePlotting(object):
+    '''
+    Drawing the cells (one patch each) and boundaries with matplotlib.
+    '''
+
+    params = [25, 50, 100]
+    param_names = ['n']
+    timeout = 300
+
+    def setup(self, n):
+        self.x, self.y = makeCurvilinearNodes(n)
+        self.river = makeIslands(1, nverts=4 * n, size=1000.)[0]
+        self.islands = makeIslands(n)
+        self.ragged = misc.RaggedPolygons.from_polygons(self.islands)
+
+    def teardown(self, n):
+        plt.close('all')
+
+    def time_plot_cells(self, n):
+        viz.plotCells(self.x, self.y, engine='mpl')
+
+    def time_plot_boundaries(self, n):
+        viz.plotBoundaries(river=self.river, islands=self.islands)
+
+    def time_plot_boundaries_ragged(self, n):
+        viz.plotBoundaries(river=self.river, islands=self.ragged)
@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+
+from pygridtools import core, io
+
+from .synthetic import TEMPLATE, makeCurvilinearNodes, makeIslands
+
+
+class TimeShapefiles(object):
+    '''
+    The point and polygon shapefile exporters (and reading the cells
+    back). Every node or cell is a fiona record, so the grids are kept
+    small.
+    '''
+
+    params = [30, 100, 300]
+    param_names = ['n']
+    timeout = 300
+
+    def setup(self, n):
+        self.tmpdir = tempfile.mkdtemp()
+        x, y = makeCurvilinearNodes(n)
+        self.mg = core.ModelGrid(x, y)
+        self.mg.template = TEMPLATE
+        self.mg.mask_cells_with_polygons(makeIslands(20))
+        self.cellfile = os.path.join(self.tmpdir, 'cells.shp')
+        self.mg.to_shapefile(self.cellfile, which='nodes', geom='polygon')
+
+    def teardown(self, n):
+        shutil.rmtree(self.tmpdir)
+
+    def time_save_point_shapefile(self, n):
+        io.savePointShapefile(self.mg.xn, self.mg.yn, TEMPLATE,
+                              os.path.join(self.tmpdir, 'points.shp'))
+
+    def time_save_grid_shapefile(self, n):
+        io.saveGridShapefile(self.mg.xn, self.mg.yn, self.mg.cell_mask,
+                             TEMPLATE, os.path.join(self.tmpdir, 'grid.shp'),
+                             'w')
+
+    def time_read_grid_shapefile(self, n):
+        core.ModelGrid.from_shapefile(self.cellfile)
@@ -0,0 +1,83 @@
+'''
+Synthetic inputs for the benchmarks, built with numpy alone so that
+grids of any size can be made without gridgen.
+'''
+
+import os
+
+import numpy as np
+import pandas
+
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'tests', 'test_data',
+                        'schema_template.shp')
+
+
+def makeCurvilinearNodes(nx, ny=None, radius=10000., width=2000.):
+    '''
+    Nodes of a smooth, nearly orthogonal grid along a 90-degree bend
+    of a channel with slightly wavy banks.
+
+    Returns
+    -------
+    nodes_x, nodes_y : numpy arrays
+        (ny, nx) arrays of the node coordinates.
+
+    '''
+
+    if ny is None:
+        ny = nx
+
+    S, T = np.meshgrid(np.linspace(0, 1, nx), np.linspace(0, 1, ny))
+    theta = 0.5 * np.pi * S
+    r = radius + width * (T - 0.5) * (1 + 0.1 * np.sin(4 * np.pi * S))
+    return r * np.cos(theta), r * np.sin(theta)
+
+
+def makeIslands(count=1, nverts=64, radius=10000., size=300., seed=0):
+    '''
+    Elliptical islands scattered along the middle of the channel made
+    by `makeCurvilinearNodes`.
+
+    Returns
+    -------
+    islands : list of numpy arrays
+        (nverts x 2) vertices of each island.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    t = np.linspace(0, 2 * np.pi, nverts)
+    islands = []
+    for angle in np.linspace(0.1, 0.5 * np.pi - 0.1, count):
+        cx = radius * np.cos(angle) + rng.uniform(-size, size)
+        cy = radius * np.sin(angle) + rng.uniform(-size, size)
+        islands.append(np.column_stack([
+            cx + size * np.cos(t),
+            cy + 0.5 * size * np.sin(t),
+        ]))
+    return islands
+
+
+def makeBathymetry(npoints, radius=10000., width=2000., seed=0):
+    '''
+    Scattered x-y-z soundings over the channel made by
+    `makeCurvilinearNodes`, deepest along its centerline.
+
+    Returns
+    -------
+    bathy : pandas.DataFrame
+        Columns "x", "y", and "z".
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    theta = rng.uniform(0, 0.5 * np.pi, npoints)
+    offset = rng.uniform(-0.6, 0.6, npoints)
+    r = radius + width * offset
+    return pandas.DataFrame({
+        'x': r * np.cos(theta),
+        'y': r * np.sin(theta),
+        'z': -10 * (1 - (2 * offset) ** 2) + np.sin(8 * theta),
+    })
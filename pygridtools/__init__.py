@@ -1,4 +1,23 @@
+import sys
+import importlib
+
 from .core import *
 from .misc import *
 from . import io
-from . import viz
+from . import profiling
+
+
+def __getattr__(name):
+    # the plotting stack (matplotlib, seaborn, bokeh) is only imported
+    # the first time `pygridtools.viz` is used
+    if name == 'viz':
+        return importlib.import_module('.viz', __name__)
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name)
+    )
+
+
+if sys.version_info < (3, 7):
+    # module-level __getattr__ is ignored before python 3.7, so keep
+    # `pygridtools.viz` working by importing it up front
+    from . import viz
@@ -1,6 +1,10 @@
 from __future__ import division
 
+import os
+import json
+import time
 import warnings
+import multiprocessing
 
 import numpy as np
 import pandas
@@ -8,19 +12,27 @@ import pygridgen
 
 from . import misc
 from . import io
-from . import viz
+from . import profiling
+
+
+def _readonly(array):
+    '''Read-only view of an array, so that the nodes of a grid can't
+    be changed behind the back of its cache of derived arrays'''
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
 
 
 class _PointSet(object):
     def __init__(self, array):
-        self._points = np.asarray(array)
+        self._points = _readonly(array)
 
     @property
     def points(self):
         return self._points
     @points.setter
     def points(self, value):
-        self._points = np.asarray(value)
+        self._points = _readonly(value)
 
     @property
     def shape(self):
@@ -38,15 +50,157 @@ class _PointSet(object):
                               where=where, shift=shift)
 
 
+def _cell_centers(nodes, out=None):
+    '''Averages the four corners of each cell, building the result in a
+    single output array (optionally `out`) instead of a chain of
+    temporaries. `nodes` can be 2D or an interleaved (ny, nx, 2) array.
+    '''
+    dtype = np.result_type(nodes, 0.25)
+    centers = np.add(nodes[1:, 1:], nodes[1:, :-1], out=out, dtype=dtype)
+    centers += nodes[:-1, 1:]
+    centers += nodes[:-1, :-1]
+    centers *= 0.25
+    return centers
+
+
+def _row_blocks(nrows, ncols, chunksize):
+    '''Slices of whole rows with about `chunksize` elements each'''
+    step = max(1, chunksize // max(1, ncols))
+    return [slice(start, min(start + step, nrows))
+            for start in range(0, nrows, step)]
+
+
+def _check_polyverts(polyverts):
+    polyverts = np.asarray(polyverts)
+    if polyverts.ndim != 2:
+        raise ValueError('polyverts must be a 2D array, or a '
+                         'similar sequence')
+
+    if polyverts.shape[1] != 2:
+        raise ValueError('polyverts must be two columns of points')
+
+    if polyverts.shape[0] < 3:
+        raise ValueError('polyverts must contain at least 3 points')
+
+    return polyverts
+
+
 class ModelGrid(object):
-    def __init__(self, nodes_x, nodes_y):
+    '''
+    Nodes and cells of a curvilinear grid.
+
+    Parameters
+    ----------
+    nodes_x, nodes_y : numpy arrays
+        The x- and y-coordinates of the nodes. Must be the same shape.
+    interleaved : optional bool (default = False)
+        If True, the nodes are kept in a single contiguous (ny, nx, 2)
+        array (see `nodes`) and `xn` and `yn` are views into it, so
+        that `as_coord_pairs` can return x-y pairs without copying.
+        The array is rebuilt after the grid is transformed or merged.
+
+    Notes
+    -----
+    Derived arrays (cell centers, spatial indices, etc.) are cached
+    until the nodes change. The grid's views of the nodes are
+    read-only, so change them through `transform`, `merge`, or by
+    assigning new `nodes_x`/`nodes_y`, never by writing into `xn` or
+    `yn` (or into the arrays the grid was built from).
+
+    Attributes
+    ----------
+    elev : numpy array or None
+        Elevation of each cell (e.g., as interpolated by `makeGrid`).
+        Used by `to_shapefile` and `to_gridfile` when no other
+        elevation is given. Flipping or transposing the grid does the
+        same to `elev`; other transforms and merges reset it to None.
+    chunksize : int or None
+        When set (e.g., by `open_mmap`), masking works through the
+        cells or nodes in blocks of about this many points instead of
+        building a spatial index over the whole grid.
+
+    '''
+    def __init__(self, nodes_x, nodes_y, interleaved=False):
         if not np.all(nodes_x.shape == nodes_y.shape):
             raise ValueError('input arrays must have the same shape')
 
         self._nodes_x = _PointSet(nodes_x)
         self._nodes_y = _PointSet(nodes_y)
+        self._cache = {}
+        self._interleaved = interleaved
         self._template = None
         self._cell_mask = np.zeros(self.cell_shape, dtype=bool)
+        self.elev = None
+        self.chunksize = None
+        if interleaved:
+            self._interleave()
+
+    def _cached(self, key, fxn):
+        '''Returns the derived value stored under ``key``, computing
+        it with ``fxn()`` the first time it is requested. Cached arrays
+        are read-only, and everything is discarded by `_clear_cache`
+        whenever the nodes change.
+        '''
+        if key not in self._cache:
+            value = fxn()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self._cache[key] = value
+        return self._cache[key]
+
+    def _clear_cache(self):
+        '''Drops all of the derived arrays (e.g., cell centers)'''
+        self._cache = {}
+
+    def _interleaved_nodes(self):
+        '''Zero-copy (ny, nx, 2) view of the nodes if `xn` and `yn` are
+        the two halves of a single C-ordered array, otherwise None.
+        '''
+        x, y = self.xn, self.yn
+        size = x.itemsize
+        if (x.ndim == 2 and x.dtype == y.dtype and x.strides == y.strides
+                and x.strides == (2 * size * x.shape[1], 2 * size)
+                and y.ctypes.data - x.ctypes.data == size):
+            return np.lib.stride_tricks.as_strided(
+                x, shape=x.shape + (2,), strides=x.strides + (size,)
+            )
+        return None
+
+    def _interleave(self):
+        '''Moves the nodes into a single (ny, nx, 2) array'''
+        if self._interleaved_nodes() is None:
+            dtype = np.result_type(self.xn, self.yn)
+            nodes = np.empty(self.shape + (2,), dtype=dtype)
+            nodes[..., 0] = self.xn
+            nodes[..., 1] = self.yn
+            self._nodes_x = _PointSet(nodes[..., 0])
+            self._nodes_y = _PointSet(nodes[..., 1])
+            self._clear_cache()
+
+    def _cells(self):
+        '''(ny-1, nx-1, 2) array of the cell centers'''
+        def compute():
+            nodes = self._interleaved_nodes()
+            if nodes is not None:
+                return _cell_centers(nodes)
+
+            dtype = np.result_type(self.xn, self.yn, 0.25)
+            cells = np.empty(self.cell_shape + (2,), dtype=dtype)
+            _cell_centers(self.xn, out=cells[..., 0])
+            _cell_centers(self.yn, out=cells[..., 1])
+            return cells
+
+        return self._cached('cells', compute)
+
+    @property
+    def nodes(self):
+        '''(ny, nx, 2) array of the x-y coordinates of the nodes. This
+        is a view when the grid is interleaved and a copy otherwise.
+        '''
+        nodes = self._interleaved_nodes()
+        if nodes is None:
+            nodes = np.dstack([self.xn, self.yn])
+        return nodes
 
     @property
     def nodes_x(self):
@@ -55,31 +209,43 @@ class ModelGrid(object):
     @nodes_x.setter
     def nodes_x(self, value):
         self._nodes_x = value
+        self._clear_cache()
 
     @property
     def nodes_y(self):
+        '''_PointSet object of y-nodes'''
         return self._nodes_y
     @nodes_y.setter
     def nodes_y(self, value):
-        '''_PointSet object of y-nodes'''
         self._nodes_y = value
+        self._clear_cache()
 
     @property
     def cells_x(self):
-        '''_PointSet object of x-cells'''
-        xc = 0.25 * (
-            self.xn[1:,1:] + self.xn[1:,:-1] +
-            self.xn[:-1,1:] + self.xn[:-1,:-1]
-        )
-        return xc
+        '''array of x-coords of the cell centers'''
+        return self._cached('cells_x', lambda: self._cells()[..., 0])
 
     @property
     def cells_y(self):
-        yc = 0.25 * (
-            self.yn[1:,1:] + self.yn[1:,:-1] +
-            self.yn[:-1,1:] + self.yn[:-1,:-1]
-        )
-        return yc
+        '''array of y-coords of the cell centers'''
+        return self._cached('cells_y', lambda: self._cells()[..., 1])
+
+    @property
+    def valid_nodes(self):
+        '''bool array that is True where a node is defined (not NaN)'''
+        return self._cached('valid_nodes', lambda: ~np.isnan(self.xn))
+
+    @property
+    def cell_index(self):
+        '''misc.BucketIndex of the cell centers'''
+        return self._cached('cell_index',
+                            lambda: misc.BucketIndex(self.xc, self.yc))
+
+    @property
+    def node_index(self):
+        '''misc.BucketIndex of the nodes'''
+        return self._cached('node_index',
+                            lambda: misc.BucketIndex(self.xn, self.yn))
 
     @property
     def shape(self):
@@ -87,7 +253,7 @@ class ModelGrid(object):
 
     @property
     def cell_shape(self):
-        return self.cells_x.shape
+        return tuple(n - 1 for n in self.shape)
 
     @property
     def xn(self):
@@ -101,12 +267,12 @@ class ModelGrid(object):
 
     @property
     def xc(self):
-        '''shortcut to x-coords of nodes'''
+        '''shortcut to x-coords of cells'''
         return self.cells_x
 
     @property
     def yc(self):
-        '''shortcut to y-coords of nodes'''
+        '''shortcut to y-coords of cells'''
         return self.cells_y
 
     @property
@@ -147,18 +313,30 @@ class ModelGrid(object):
     def transform(self, fxn, *args, **kwargs):
         self.nodes_x = self.nodes_x.transform(fxn, *args, **kwargs)
         self.nodes_y = self.nodes_y.transform(fxn, *args, **kwargs)
+        if self._interleaved:
+            self._interleave()
+        # an arbitrary function can't be applied to the cells
+        self.elev = None
+        return self
+
+    def _rearrange(self, fxn):
+        # transforms that move the cells exactly like the nodes
+        elev = self.elev
+        self.transform(fxn)
+        if elev is not None:
+            self.elev = fxn(elev)
         return self
 
     def transpose(self):
-        return self.transform(np.transpose)
+        return self._rearrange(np.transpose)
 
     def fliplr(self):
         '''reverses the columns'''
-        return self.transform(np.fliplr)
+        return self._rearrange(np.fliplr)
 
     def flipud(self):
         '''reverses the rows'''
-        return self.transform(np.flipud)
+        return self._rearrange(np.flipud)
 
     def merge(self, other, how='vert', where='+', shift=0):
         '''Merge with another grid
@@ -172,46 +350,188 @@ class ModelGrid(object):
                                           where=where, shift=shift)
         self.nodes_y = self.nodes_y.merge(other.nodes_y, how=how,
                                           where=where, shift=shift)
+        if self._interleaved:
+            self._interleave()
+        self.elev = None
         return self
 
     def mask_cells_with_polygon(self, polyverts, use_cells=True,
                                 inside=True, triangles=False,
                                 min_nodes=3, inplace=True):
-        polyverts = np.asarray(polyverts)
-        if polyverts.ndim != 2:
-            raise ValueError('polyverts must be a 2D array, or a '
-                             'similar sequence')
+        return self.mask_cells_with_polygons(
+            [polyverts], use_cells=use_cells, inside=inside,
+            triangles=triangles, min_nodes=min_nodes, inplace=inplace
+        )
 
-        if polyverts.shape[1] != 2:
-            raise ValueError('polyverts must be two columns of points')
+    @profiling.traced('core.ModelGrid.mask_cells_with_polygons',
+                      count=lambda self, *args, **kwargs: self._cell_mask.size)
+    def mask_cells_with_polygons(self, polygons, use_cells=True,
+                                 inside=True, triangles=False,
+                                 min_nodes=3, inplace=True):
+        '''Mask the cells inside (or outside) of several polygons
 
-        if polyverts.shape[0] < 3:
-            raise ValueError('polyverts must contain at least 3 points')
+        Parameters
+        ----------
+        polygons : list of arrays or misc.RaggedPolygons
+            Each array (N x 2) defines the vertices of a polygon, e.g.,
+            islands loaded with `io.loadPolygonFromShapefile`. Polygons
+            loaded with `io.loadRaggedPolygons` can also have holes
+            (which are outside) and multiple parts.
+        use_cells : optional bool (default = True)
+            If True, a cell is considered inside a polygon when its
+            center is. Otherwise, at least `min_nodes` of its nodes
+            must be inside.
+        inside : optional bool (default = True)
+            Toggles masking the cells inside of any of the polygons
+            (True) or the cells outside of all of them (False).
+        min_nodes : optional int (default = 3)
+            Number of nodes inside a polygon required to consider a cell
+            inside of it when `use_cells` is False.
+        inplace : optional bool (default = True)
+            If True, the new mask is combined with `cell_mask`.
+            Otherwise, it is returned.
+
+        Notes
+        -----
+        Points are looked up in `cell_index` (or `node_index`), so
+        each polygon is only tested against the cells or nodes inside
+        its bounding box. If `chunksize` is set, the points are instead
+        read in blocks of rows, which keeps memory-mapped grids on
+        disk.
+
+        '''
+
+        if not isinstance(polygons, misc.RaggedPolygons):
+            polygons = misc.RaggedPolygons.from_polygons(
+                [_check_polyverts(polyverts) for polyverts in polygons]
+            )
+
+        if self.chunksize is not None:
+            in_polygons = self._points_inside_polygons(polygons, use_cells)
 
-        if use_cells:
-            cells = self.as_coord_pairs(which='cells')
-            cell_mask = misc.points_inside_poly(
-                cells, polyverts
-            ).reshape(self.cell_shape)
         else:
-            nodes = self.as_coord_pairs(which='nodes')
-            _node_mask = misc.points_inside_poly(
-                nodes, polyverts
-            ).reshape(self.shape)
+            if use_cells:
+                index = self.cell_index
+            else:
+                index = self.node_index
+
+            in_polygons = np.zeros(index.x.shape, dtype=bool)
+            for n, bbox in enumerate(polygons.bboxes):
+                ids = index.query_bbox(*bbox)
+                if ids.shape[0] > 0:
+                    points = np.column_stack([index.x[ids], index.y[ids]])
+                    in_polygons[ids] |= polygons.points_inside(points, n)
 
+        if use_cells:
+            cell_mask = in_polygons.reshape(self.cell_shape)
+        else:
+            _node_mask = in_polygons.reshape(self.shape).astype(int)
             cell_mask = (
                 _node_mask[1:, 1:] + _node_mask[:-1, :-1] +
                 _node_mask[:-1, 1:] + _node_mask[1:, :-1]
-            ) < min_nodes,
+            ) >= min_nodes
+
         if not inside:
             cell_mask = ~cell_mask
 
         if inplace:
-            self.cell_mask = np.bitwise_or(self.cell_mask, cell_mask)
+            current = self.cell_mask
+            if isinstance(current, np.memmap) and current.flags.writeable:
+                # e.g., opened with `open_mmap(mode='r+')`: update the
+                # file instead of replacing it with an in-memory copy
+                np.bitwise_or(current, cell_mask, out=current)
+                current.flush()
+            else:
+                self.cell_mask = np.bitwise_or(current, cell_mask)
 
         else:
             return cell_mask
 
+    def _points_inside_polygons(self, polygons, use_cells=True):
+        '''Flat mask of the cells (or nodes) inside any of the polygons,
+        reading `chunksize` points at a time.
+        '''
+        if use_cells:
+            X, Y = self.xc, self.yc
+        else:
+            X, Y = self.xn, self.yn
+
+        in_polygons = np.zeros(X.shape, dtype=bool)
+        for rows in _row_blocks(X.shape[0], X.shape[1], self.chunksize):
+            x = np.asarray(X[rows])
+            y = np.asarray(Y[rows])
+            block = in_polygons[rows]
+            valid = ~(np.isnan(x) | np.isnan(y))
+            if not valid.any():
+                continue
+
+            # only polygons overlapping this block's extent are tested
+            xmin, xmax = x[valid].min(), x[valid].max()
+            ymin, ymax = y[valid].min(), y[valid].max()
+            for n in polygons.query_bbox(xmin, ymin, xmax, ymax):
+                pxmin, pymin, pxmax, pymax = polygons.bboxes[n]
+                candidates = (
+                    (x >= pxmin) & (x <= pxmax) &
+                    (y >= pymin) & (y <= pymax)
+                )
+                if candidates.any():
+                    points = np.column_stack([x[candidates], y[candidates]])
+                    block[candidates] |= polygons.points_inside(points, n)
+
+        return in_polygons.ravel()
+
+    def save_binary(self, outputdir, chunksize=1000000):
+        '''
+        Saves the grid as a directory of ``.npy`` files that can be
+        memory-mapped by `ModelGrid.open_mmap`.
+
+        Parameters
+        ----------
+        outputdir : str
+            Directory for the files (created if needed).
+        chunksize : optional int (default = 1000000)
+            Approximate number of nodes copied at a time.
+
+        Notes
+        -----
+        The directory contains the (ny, nx, 2) nodes, the
+        (ny-1, nx-1, 2) cell centers, the cell mask, and a
+        ``grid.json`` file with the same versioned header as
+        `io.saveGridFile`.
+
+        '''
+
+        if not os.path.exists(outputdir):
+            os.makedirs(outputdir)
+
+        ny, nx = self.shape
+        dtype = np.result_type(self.xn, self.yn)
+        nodes = np.lib.format.open_memmap(
+            os.path.join(outputdir, 'nodes.npy'), mode='w+',
+            dtype=dtype, shape=self.shape + (2,)
+        )
+        for rows in _row_blocks(ny, nx, chunksize):
+            nodes[rows, :, 0] = self.xn[rows]
+            nodes[rows, :, 1] = self.yn[rows]
+
+        cells = np.lib.format.open_memmap(
+            os.path.join(outputdir, 'cells.npy'), mode='w+',
+            dtype=np.result_type(dtype, 0.25), shape=self.cell_shape + (2,)
+        )
+        for rows in _row_blocks(ny - 1, nx, chunksize):
+            _cell_centers(nodes[rows.start:rows.stop + 1], out=cells[rows])
+
+        nodes.flush()
+        cells.flush()
+        del nodes, cells
+
+        np.save(os.path.join(outputdir, 'cell_mask.npy'),
+                np.asarray(self.cell_mask, dtype=bool))
+
+        meta = io._grid_header(self.shape, self.template)
+        with open(os.path.join(outputdir, 'grid.json'), 'w') as f:
+            json.dump(meta, f)
+
     def writeGEFDCControlFile(self, outputdir=None, filename='gefdc.inp',
                               bathyrows=0, title='test'):
         outfile = io._outputfile(outputdir, filename)
@@ -229,7 +549,7 @@ class ModelGrid(object):
                            triangles=False, maxcols=125):
 
         cells = misc.make_gefdc_cells(
-            ~np.isnan(self.xn), self.cell_mask, triangles=triangles
+            self.valid_nodes, self.cell_mask, triangles=triangles
         )
         outfile = io._outputfile(outputdir, filename)
 
@@ -239,16 +559,11 @@ class ModelGrid(object):
 
     def writeGEFDCGridFile(self, outputdir=None, filename='grid.out'):
         outfile = io._outputfile(outputdir, filename)
-        df = io._write_gridout_file(self.xn, self.yn, outfile)
-        return df
+        io._write_gridout_file(self.xn, self.yn, outfile)
 
     def writeGEFDCGridextFile(self, outputdir, shift=2, filename='gridext.inp'):
         outfile = io._outputfile(outputdir, filename)
-        df = self.as_dataframe().stack(level='i', dropna=True).reset_index()
-        df['i'] += shift
-        df['j'] += shift
-        io._write_gridext_file(df, outfile)
-        return df
+        io._write_gridext_nodes(self.xn, self.yn, outfile, shift=shift)
 
     def _plot_nodes(self, boundary=None, engine='mpl', ax=None, **kwargs):
         raise NotImplementedError
@@ -262,6 +577,8 @@ class ModelGrid(object):
     def plotCells(self, engine='mpl', ax=None, usemask=True,
                   river=None, islands=None, boundary=None,
                   bxcol='x', bycol='y', **kwargs):
+        from . import viz
+
         if usemask:
             mask = self.cell_mask.copy()
         else:
@@ -300,22 +617,101 @@ class ModelGrid(object):
         return easting.join(northing)
 
     def as_coord_pairs(self, usemask=False, which='nodes'):
+        '''N x 2 array of x-y pairs of the nodes or cells. Unless masked,
+        cells (and nodes of interleaved grids) are returned as
+        read-only views without copying.
+        '''
         x, y = self._get_x_y(which, usemask=usemask)
-        return np.array(list(zip(x.flatten(), y.flatten())))
+        if usemask:
+            return np.column_stack([
+                x.filled(np.nan).ravel(), y.filled(np.nan).ravel()
+            ])
+
+        if which.lower() == 'cells':
+            pairs = self._cells()
+        else:
+            pairs = self._interleaved_nodes()
+            if pairs is None:
+                return np.column_stack([x.ravel(), y.ravel()])
+
+        pairs = pairs.reshape(-1, 2)
+        pairs.flags.writeable = False
+        return pairs
+
+    def quality(self):
+        '''
+        Summary of the shape of the cells that have four valid nodes.
+
+        Returns
+        -------
+        metrics : dict
+            - "cells": number of valid cells
+            - "orthogonality_max", "orthogonality_mean": deviation (in
+              degrees) of the angle between a cell's i- and j-sides
+              from 90
+            - "aspect_ratio_max", "aspect_ratio_mean": ratio of the
+              longer to the shorter side of each cell (>= 1)
+            - "smoothness_max": largest ratio of the areas of two
+              neighboring cells (>= 1)
+
+        '''
+        x = np.ma.filled(np.ma.asarray(self.xn, dtype=float), np.nan)
+        y = np.ma.filled(np.ma.asarray(self.yn, dtype=float), np.nan)
+
+        # average i- and j-direction sides of each cell
+        ix = 0.5 * (np.diff(x[:-1], axis=1) + np.diff(x[1:], axis=1))
+        iy = 0.5 * (np.diff(y[:-1], axis=1) + np.diff(y[1:], axis=1))
+        jx = 0.5 * (np.diff(x[:, :-1], axis=0) + np.diff(x[:, 1:], axis=0))
+        jy = 0.5 * (np.diff(y[:, :-1], axis=0) + np.diff(y[:, 1:], axis=0))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            li = np.hypot(ix, iy)
+            lj = np.hypot(jx, jy)
+            area = np.abs(ix * jy - iy * jx)
+            cosine = np.abs(ix * jx + iy * jy) / (li * lj)
+            skew = np.degrees(np.arcsin(np.clip(cosine, 0, 1)))
+            aspect = np.maximum(li, lj) / np.minimum(li, lj)
+            smooth = [
+                np.maximum(a, b) / np.minimum(a, b) for a, b in
+                [(area[:, 1:], area[:, :-1]), (area[1:], area[:-1])]
+            ]
+
+        valid = np.isfinite(skew)
+        metrics = {'cells': int(valid.sum())}
+        if not valid.any():
+            metrics.update(dict.fromkeys([
+                'orthogonality_max', 'orthogonality_mean',
+                'aspect_ratio_max', 'aspect_ratio_mean', 'smoothness_max'
+            ], np.nan))
+            return metrics
+
+        smooth = np.concatenate([r[np.isfinite(r)] for r in smooth])
+        metrics.update({
+            'orthogonality_max': float(skew[valid].max()),
+            'orthogonality_mean': float(skew[valid].mean()),
+            'aspect_ratio_max': float(aspect[valid].max()),
+            'aspect_ratio_mean': float(aspect[valid].mean()),
+            'smoothness_max': float(smooth.max()) if smooth.size else 1.0,
+        })
+        return metrics
 
     def to_shapefile(self, outputfile, usemask=True, which='cells',
                      river=None, reach=0, elev=None, template=None,
-                     geom='Polygon', mode='w', triangles=False):
+                     geom='Polygon', mode='w', triangles=False,
+                     chunksize=10000):
 
 
         if template is None:
             template = self.template
 
+        if elev is None and (which == 'cells' or geom.lower() != 'point'):
+            elev = self.elev
+
         if geom.lower() == 'point':
             x, y = self._get_x_y(which, usemask=usemask)
             io.savePointShapefile(x, y, template, outputfile,
                                   mode=mode, river=river, reach=reach,
-                                  elev=elev)
+                                  elev=elev, chunksize=chunksize)
 
         elif geom.lower() in ('cell', 'cells', 'grid', 'polygon'):
             if usemask:
@@ -326,12 +722,25 @@ class ModelGrid(object):
             io.saveGridShapefile(x, y, mask, template,
                                  outputfile, mode=mode, river=river,
                                  reach=reach, elev=elev,
-                                 triangles=triangles)
+                                 triangles=triangles, chunksize=chunksize)
             if which == 'cells':
                 warnings.warn("polygons always constructed from nodes")
         else:
             raise ValueError("geom must be either 'Point' or 'Polygon'")
 
+    def to_gridfile(self, outputfile, attrs=None, compress=False):
+        '''
+        Saves the nodes, cell mask, and template (and optionally cell
+        attributes) to a single binary file. See `io.saveGridFile`.
+        '''
+        if self.elev is not None:
+            attrs = dict(attrs or {})
+            attrs.setdefault('elev', self.elev)
+
+        io.saveGridFile(outputfile, self.xn, self.yn,
+                        cell_mask=self.cell_mask, template=self.template,
+                        attrs=attrs, compress=compress)
+
     def _get_x_y(self, which, usemask=False):
         if which.lower() == 'nodes':
             if usemask:
@@ -357,16 +766,87 @@ class ModelGrid(object):
         return ModelGrid(nodes_x, nodes_y)
 
     @staticmethod
+    @profiling.traced('core.ModelGrid.from_shapefile')
     def from_shapefile(shapefile, icol='ii', jcol='jj'):
-        df = io.readGridShapefile(shapefile, icol=icol, jcol=jcol)
-        return ModelGrid.from_dataframes(df['easting'], df['northing'])
+        nodes_x, nodes_y, _, _ = io._read_grid_nodes(shapefile, icol=icol,
+                                                     jcol=jcol)
+        return ModelGrid(nodes_x, nodes_y)
+
+    @staticmethod
+    def from_gridfile(filename):
+        '''
+        Loads a grid written by `ModelGrid.to_gridfile`. Use
+        `io.loadGridFile` to get any saved cell attributes as well.
+        '''
+        data = io.loadGridFile(filename)
+        grid = ModelGrid(data['nodes_x'], data['nodes_y'])
+        grid.cell_mask = data['cell_mask']
+        grid.template = data['template']
+        grid.elev = data['attrs'].get('elev')
+        return grid
+
+    @staticmethod
+    def from_gridout(filename):
+        '''Loads a grid from a grid.out file (see `io.readGridout`)'''
+        return ModelGrid(*io.readGridout(filename))
 
     @staticmethod
     def from_Gridgen(gridgen):
         return ModelGrid(gridgen.x, gridgen.y)
 
+    @staticmethod
+    def from_nodes(nodes):
+        '''Interleaved ModelGrid sharing memory with a (ny, nx, 2) array'''
+        nodes = np.ascontiguousarray(nodes)
+        if nodes.ndim != 3 or nodes.shape[2] != 2:
+            raise ValueError('nodes must be an (ny, nx, 2) array')
+        return ModelGrid(nodes[..., 0], nodes[..., 1], interleaved=True)
+
+    @staticmethod
+    def open_mmap(path, mode='r', chunksize=1000000):
+        '''
+        Opens a grid written by `ModelGrid.save_binary` without reading
+        it into memory.
+
+        Parameters
+        ----------
+        path : str
+            Directory written by `save_binary`.
+        mode : optional str (default = 'r')
+            Memory-map mode (see `numpy.load`) of the cell mask. With
+            'r+', masking cells in place updates ``cell_mask.npy``.
+            The nodes and cell centers are always opened read-only;
+            transforming the grid builds new arrays in memory.
+        chunksize : optional int (default = 1000000)
+            Approximate number of points read at a time when masking
+            (see `ModelGrid.chunksize`).
+
+        Returns
+        -------
+        grid : ModelGrid
+            Interleaved grid whose nodes, cell centers, and cell mask
+            are memory-mapped.
+
+        '''
+
+        with open(os.path.join(path, 'grid.json'), 'r') as f:
+            meta = io._check_grid_header(json.load(f), path)
 
-def makeGrid(coords=None, bathydata=None, verbose=False, **gparams):
+        nodes = np.load(os.path.join(path, 'nodes.npy'), mmap_mode='r')
+        grid = ModelGrid.from_nodes(nodes)
+        grid._cached('cells', lambda: np.load(
+            os.path.join(path, 'cells.npy'), mmap_mode='r'
+        ))
+        grid.cell_mask = np.load(os.path.join(path, 'cell_mask.npy'),
+                                 mmap_mode=mode)
+        grid.template = meta['template']
+        grid.chunksize = chunksize
+        return grid
+
+
+@profiling.traced('core.makeGrid')
+def makeGrid(coords=None, bathydata=None, verbose=False, engine='csa',
+             engine_kws=None, **gparams):
     '''
     Generate and (optionally) visualize a grid, and create input files
     for the GEDFC preprocessor (makes grid input files for GEFDC).
@@ -379,13 +859,26 @@ def makeGrid(coords=None, bathydata=None, verbose=False, **gparams):
           - 'x' (easting)
           - 'y' (northing),
           - 'beta' (turning points, must sum to 1)
-    bathydata : optional pandas.DataFrame or None (default)
+    bathydata : optional pandas.DataFrame, misc.Bathymetry,
+                misc.RasterBathymetry, or None (default)
         Point bathymetry/elevation data. Will be interpolated unto the
-        grid if provided. If None, a default value of 0 will be used.
+        grid's cells if provided. If None, no interpolation is done.
+        Pass a `misc.Bathymetry` object to reuse its fit when making
+        several grids from the same survey. Rasters are sampled
+        bilinearly (`engine` is ignored).
         Required columns:
           - 'x' (easting)
           - 'y' (northing),
           - 'z' (elevation)
+    engine : optional string (default = 'csa')
+        The method used to interpolate `bathydata` onto the grid. One
+        of 'csa', 'nearest', 'idw', or 'linear'. See
+        `misc.interpolateBathymetry`.
+    engine_kws : optional dict or None (default)
+        Extra keyword arguments for `misc.interpolateBathymetry` or
+        `misc.Bathymetry.interpolate` (e.g., `k`, `power`,
+        `chunksize`, `nthreads`, `thin`, or `tiles` and `nprocs` to
+        interpolate large grids in parallel blocks).
     **gparams : optional kwargs
         Parameters to be passed to the pygridgen.grid.Gridgen constructor.
         Only used if `makegrid` = True and `coords` is not None.
@@ -436,13 +929,16 @@ def makeGrid(coords=None, bathydata=None, verbose=False, **gparams):
 
     Returns
     -------
-    grid : pygridgen.grid.Gridgen obejct
+    grid : pygridtools.ModelGrid
+        The new grid. If `bathydata` was provided, the interpolated
+        elevations of the cells are in `grid.elev`.
 
     Notes
     -----
     If your boundary has a lot of points, this really can take quite
     some time. Setting verbose=True will help track the progress of the
-    grid generattion.
+    grid generattion. For the time spent in each stage (gridgen, the
+    bathymetry, etc.), enable `pygridtools.profiling`.
 
     See Also
     --------
@@ -458,12 +954,186 @@ def makeGrid(coords=None, bathydata=None, verbose=False, **gparams):
     if verbose:
         print('generating grid')
 
-    grid = pygridgen.Gridgen(coords.x, coords.y, coords.beta, shape, **gparams)
+    with profiling.span('pygridgen.Gridgen', count=shape[0] * shape[1]):
+        gridgen = pygridgen.Gridgen(coords.x, coords.y, coords.beta, shape,
+                                    **gparams)
+    grid = ModelGrid.from_Gridgen(gridgen)
+
+    if bathydata is not None:
+        if verbose:
+            print('interpolating bathymetry')
+
+        if engine_kws is None:
+            engine_kws = {}
+
+        with profiling.span('core.makeGrid.bathymetry', engine=engine,
+                            count=grid.cell_mask.size):
+            if isinstance(bathydata, misc.RasterBathymetry):
+                grid.elev = bathydata.sample(gridgen.x_rho, gridgen.y_rho)
+            elif isinstance(bathydata, misc.Bathymetry):
+                grid.elev = bathydata.interpolate(
+                    gridgen.x_rho, gridgen.y_rho, engine=engine, **engine_kws
+                )
+            else:
+                grid.elev = misc.interpolateBathymetry(
+                    bathydata, gridgen.x_rho, gridgen.y_rho, xcol='x',
+                    ycol='y', zcol='z', engine=engine, **engine_kws
+                )
 
-    if verbose:
-        print('interpolating bathymetry')
+    return grid
 
-    newbathy = misc.interpolateBathymetry(bathydata, grid.x_rho, grid.y_rho,
-                                          xcol='x', ycol='y', zcol='z')
 
-    return grid
+try:
+    from multiprocessing.connection import wait as _wait_for
+except ImportError:  # python 2.7
+    def _wait_for(connections, timeout=None):
+        '''The connections that are ready to read (waits up to
+        `timeout` seconds, or forever, for at least one)'''
+        start = time.time()
+        while True:
+            ready = [conn for conn in connections if conn.poll()]
+            if ready or (timeout is not None and
+                         time.time() - start >= timeout):
+                return ready
+            time.sleep(0.01)
+
+
+def _sweep_job(conn, coords, shape, gparams):
+    '''Builds one grid of a sweep in a worker process'''
+    t0 = time.time()
+    try:
+        gridgen = pygridgen.Gridgen(coords.x, coords.y, coords.beta, shape,
+                                    **gparams)
+        x = np.ma.filled(np.ma.asarray(gridgen.x, dtype=float), np.nan)
+        y = np.ma.filled(np.ma.asarray(gridgen.y, dtype=float), np.nan)
+        result = {'status': 'ok', 'gridgen_time': time.time() - t0,
+                  'x': x, 'y': y}
+        result.update(ModelGrid(x, y).quality())
+    except Exception as e:
+        result = {'status': 'error', 'gridgen_time': time.time() - t0,
+                  'error': '{}: {}'.format(type(e).__name__, e)}
+
+    conn.send(result)
+    conn.close()
+
+
+def makeGrids(coords, paramsets, nprocs=None, timeout=None):
+    '''
+    Generates grids for many sets of parameters (e.g., a sweep over
+    `nx`/`ny`, `focus`, `nppe`, and `precision`) in parallel processes.
+
+    Parameters
+    ----------
+    coords : pandas.DataFrame
+        The boundary, with columns "x", "y", and "beta" (see
+        `makeGrid`).
+    paramsets : list of dicts
+        Keyword arguments for `pygridgen.Gridgen`, one dict per grid.
+        Each needs "nx" and "ny".
+    nprocs : optional int or None (default)
+        Maximum number of grids generated at once (at least 1).
+        Defaults to the number of CPUs.
+    timeout : optional float or None (default)
+        Seconds after which a grid is abandoned (and its process
+        terminated).
+
+    Yields
+    ------
+    result : dict
+        One for each parameter set, in the order they finish, with:
+          - "index": position of the parameters in `paramsets`
+          - "params": the parameters
+          - "status": "ok", "error", or "timeout"
+          - "error": the error message (if any)
+          - "grid": the new ModelGrid (or None)
+          - "wall": seconds since the job started
+          - "gridgen_time": seconds spent in `pygridgen.Gridgen`
+          - the metrics from `ModelGrid.quality`
+
+    Notes
+    -----
+    Stopping the iteration early terminates any unfinished jobs.
+    Bathymetry is left out; interpolate it onto the chosen grid(s)
+    with `misc.interpolateBathymetry` or `misc.Bathymetry`.
+
+    Examples
+    --------
+    >>> params = [dict(nx=nx, ny=ny, nnodes=12) for nx, ny in shapes]
+    >>> results = list(makeGrids(boundary, params, timeout=60))
+    >>> table = pandas.DataFrame(results).drop(columns='grid')
+
+    '''
+
+    jobs = []
+    for index, params in enumerate(paramsets):
+        gparams = dict(params)
+        try:
+            shape = (gparams.pop('ny'), gparams.pop('nx'))
+        except KeyError:
+            raise ValueError('each set of parameters needs `nx` and `ny`')
+        jobs.append((index, dict(params), shape, gparams))
+
+    if nprocs is None:
+        nprocs = multiprocessing.cpu_count()
+    elif nprocs < 1:
+        raise ValueError('nprocs must be at least 1')
+
+    def _result(index, params, start, **fields):
+        result = {'index': index, 'params': params, 'error': None,
+                  'grid': None, 'wall': time.time() - start,
+                  'gridgen_time': None}
+        result.update(fields)
+        if result['status'] == 'ok':
+            result['grid'] = ModelGrid(result.pop('x'), result.pop('y'))
+        return result
+
+    jobs.reverse()
+    running = {}
+    try:
+        while jobs or running:
+            while jobs and len(running) < nprocs:
+                index, params, shape, gparams = jobs.pop()
+                reader, writer = multiprocessing.Pipe(duplex=False)
+                proc = multiprocessing.Process(
+                    target=_sweep_job, args=(writer, coords, shape, gparams)
+                )
+                proc.daemon = True
+                proc.start()
+                writer.close()
+                running[reader] = (index, params, proc, time.time())
+
+            # sleep until a job finishes or the next one runs out of time
+            wait = None
+            if timeout is not None:
+                deadline = min(job[3] for job in running.values()) + timeout
+                wait = max(0, deadline - time.time())
+
+            for reader in _wait_for(list(running), timeout=wait):
+                index, params, proc, start = running.pop(reader)
+                try:
+                    fields = reader.recv()
+                except EOFError:
+                    fields = None
+                reader.close()
+                proc.join()
+                if fields is None:
+                    fields = {'status': 'error', 'error': 'worker exited '
+                              'with code {}'.format(proc.exitcode)}
+                yield _result(index, params, start, **fields)
+
+            if timeout is not None:
+                for reader, job in list(running.items()):
+                    index, params, proc, start = job
+                    if time.time() - start >= timeout:
+                        del running[reader]
+                        proc.terminate()
+                        proc.join()
+                        reader.close()
+                        yield _result(index, params, start, status='timeout',
+                                      error='timed out after {} s'.format(
+                                          timeout))
+    finally:
+        for reader, (index, params, proc, start) in running.items():
+            proc.terminate()
+            proc.join()
+            reader.close()
@@ -1,16 +1,44 @@
 from __future__ import division
 
 import os
-import re
-import pdb
+import json
 from collections import OrderedDict
 
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas
-import fiona
 
 from . import misc
+from . import profiling
+
+
+GRIDFILE_FORMAT = 'pygridtools.grid'
+GRIDFILE_VERSION = 1
+
+# characters of cell.inp's cell types
+_CELL_DIGITS = np.frombuffer(b'0123456789', dtype=np.uint8)
+
+
+def _grid_header(shape, template=None, attrs=()):
+    # shared by the .npz grid file (`saveGridFile`) and the directory
+    # of .npy files (`ModelGrid.save_binary`)
+    return {
+        'format': GRIDFILE_FORMAT,
+        'version': GRIDFILE_VERSION,
+        'shape': list(shape),
+        'template': template,
+        'attrs': list(attrs),
+    }
+
+
+def _check_grid_header(header, source):
+    if not isinstance(header, dict) or header.get('format') != GRIDFILE_FORMAT:
+        raise ValueError('{} is not a pygridtools grid file'.format(source))
+
+    if header.get('version', 0) > GRIDFILE_VERSION:
+        raise ValueError('grid file version {} is newer than the '
+                         'supported version ({})'.format(
+                            header['version'], GRIDFILE_VERSION))
+    return header
 
 
 def _outputfile(outputdir, filename):
@@ -59,6 +87,67 @@ def _check_for_same_masks(X, Y):
         return X, Y
 
 
+def _write_records(out, ids, coords, geomtype, props, chunksize=10000):
+    '''
+    Writes records to an open fiona collection in batches.
+
+    Parameters
+    ----------
+    out : fiona.Collection
+        The collection (opened in "w" or "a" mode) to write to.
+    ids : numpy array
+        Record ID numbers.
+    coords : numpy array
+        Coordinates of each record's geometry, stacked along the first
+        axis (N x 2 for Points, N x V x 2 or N x V x 3 for Polygons).
+    geomtype : string
+        A valid GDAL/OGR geometry specification (e.g. Point, Polygon)
+    props : collections.OrderedDict
+        Columns of the attribute table. Values can either be arrays
+        with the same length as `ids` or scalars repeated for every
+        record.
+    chunksize : optional int (default = 10000)
+        Number of records passed to fiona at a time.
+
+    Returns
+    -------
+    None
+
+    '''
+
+    names = list(props.keys())
+    for start in range(0, len(ids), chunksize):
+        chunk = slice(start, start + chunksize)
+        _ids = ids[chunk].tolist()
+        columns = []
+        for value in props.values():
+            if np.ndim(value) == 0:
+                columns.append([value] * len(_ids))
+            else:
+                columns.append(np.asarray(value)[chunk].tolist())
+
+        records = [
+            misc.makeRecord(ID, xy, geomtype, OrderedDict(zip(names, attrs)))
+            for ID, xy, attrs in zip(_ids, coords[chunk].tolist(), zip(*columns))
+        ]
+        with profiling.span('fiona.writerecords', count=len(records)):
+            out.writerecords(records)
+
+
+def _column_blocks(nrows, ncols, chunksize):
+    '''Slices of whole columns with about `chunksize` elements each'''
+    step = max(1, chunksize // max(1, nrows))
+    return [slice(start, min(start + step, ncols))
+            for start in range(0, ncols, step)]
+
+
+def _ii_jj_labels(ii, jj, width=2):
+    '''Formats arrays of indices as zero-padded "ii_jj" strings'''
+    ii = np.char.zfill(np.asarray(ii).astype(str), width)
+    jj = np.char.zfill(np.asarray(jj).astype(str), width)
+    return np.char.add(np.char.add(ii, '_'), jj)
+
+
 def loadBoundaryFromShapefile(shapefile, betacol='beta', reachcol=None,
                               sortcol=None, upperleftcol=None,
                               filterfxn=None):
@@ -103,6 +192,8 @@ def loadBoundaryFromShapefile(shapefile, betacol='beta', reachcol=None,
 
     '''
 
+    import fiona
+
     # load and filter the data
     with fiona.open(shapefile, 'r') as shp:
         if filterfxn is None:
@@ -166,6 +257,8 @@ def loadPolygonFromShapefile(shapefile, filterfxn=None, squeeze=True):
 
     '''
 
+    import fiona
+
     # load and filter the data
     with fiona.open(shapefile, 'r') as shp:
         if filterfxn is None:
@@ -183,6 +276,80 @@ def loadPolygonFromShapefile(shapefile, filterfxn=None, squeeze=True):
     return data
 
 
+@profiling.traced('io.loadRaggedPolygons')
+def loadRaggedPolygons(shapefile, bbox=None, filterfxn=None):
+    '''
+    Loads all of the polygons (e.g., marshes, islands) from a shapefile
+    into a compact `misc.RaggedPolygons`, including every part of
+    multipart geometries and their holes.
+
+    Parameters
+    ----------
+    shapefile : string
+        Path to the shapefile of polygons.
+    bbox : optional tuple or None (default)
+        The ``(xmin, ymin, xmax, ymax)`` of the area of interest. Only
+        the records whose extents overlap it are read.
+    filterfxn : function or lambda expression or None (default)
+        Pulls out relevant records from the shapefile. Defaults to
+        `True` to consider everything.
+
+    Returns
+    -------
+    polygons : misc.RaggedPolygons
+        The polygons, with the shapefile's record numbers as `ids`.
+
+    Notes
+    -----
+    Z-coordinates are not supported. Only x-y coordinates will be
+    loaded. Records without a (multi)polygon geometry are skipped.
+
+    '''
+
+    import fiona
+
+    rings = []
+    ring_sizes = []
+    part_sizes = []
+    polygon_sizes = []
+    ids = []
+    with fiona.open(shapefile, 'r') as shp:
+        for fid, record in shp.items(bbox=bbox):
+            if filterfxn is not None and not filterfxn(record):
+                continue
+
+            geom = record['geometry']
+            if geom is None:
+                continue
+            elif geom['type'] == 'Polygon':
+                parts = [geom['coordinates']]
+            elif geom['type'] == 'MultiPolygon':
+                parts = geom['coordinates']
+            else:
+                continue
+
+            for part in parts:
+                for ring in part:
+                    rings.append(np.asarray(ring, dtype=float)[:, :2])
+                    ring_sizes.append(len(ring))
+                part_sizes.append(len(part))
+
+            polygon_sizes.append(len(parts))
+            ids.append(fid)
+
+    def _offsets(sizes):
+        return np.concatenate([[0], np.cumsum(sizes, dtype=int)])
+
+    if rings:
+        coords = np.vstack(rings)
+    else:
+        coords = np.empty((0, 2))
+
+    return misc.RaggedPolygons(coords, _offsets(ring_sizes),
+                               _offsets(part_sizes), _offsets(polygon_sizes),
+                               ids=ids)
+
+
 def dumpGridFiles(grid, filename):
     '''
     Dump vertices from a pygridgen object to file in the standard grid.out
@@ -202,14 +369,27 @@ def dumpGridFiles(grid, filename):
 
     with open(filename, 'w') as f:
         f.write('## {:d} x {:d}\n'.format(grid.nx, grid.ny))
+        _write_xy_pairs(f, grid.x, grid.y)
+
 
-        df = pandas.DataFrame({'x': grid.x.flatten(), 'y': grid.y.flatten()})
-        df.to_csv(f, sep=' ', na_rep='NaN', index=False,
-                  header=False, float_format='%.3f')
+def _write_xy_pairs(f, xcoords, ycoords, chunksize=100000):
+    '''
+    Writes "x y" lines (formatted as "%.3f", with "NaN" for missing
+    values) for every node, `chunksize` nodes at a time.
+    '''
+    X = np.ma.filled(np.ma.asarray(xcoords, dtype=float), np.nan).ravel()
+    Y = np.ma.filled(np.ma.asarray(ycoords, dtype=float), np.nan).ravel()
+    for start in range(0, X.shape[0], chunksize):
+        pairs = np.column_stack([X[start:start + chunksize],
+                                 Y[start:start + chunksize]])
+        lines = '%.3f %.3f\n' * pairs.shape[0]
+        text = lines % tuple(pairs.ravel().tolist())
+        f.write(text.replace('nan', 'NaN'))
 
 
+@profiling.traced('io.savePointShapefile', count='X')
 def savePointShapefile(X, Y, template, outputfile, mode='w', river=None,
-                       reach=0, elev=None):
+                       reach=0, elev=None, chunksize=10000):
     '''
     Saves grid-related attributes of a pygridgen.Gridgen object to a
     shapefile with geomtype = 'Point'
@@ -233,6 +413,8 @@ def savePointShapefile(X, Y, template, outputfile, mode='w', river=None,
     elev : optional array or None (defauly)
         The elevation of the grid cells. Array dimensions must be 1 less than
         X and Y.
+    chunksize : optional int (default = 10000)
+        Number of points handed to fiona in each batch of records.
 
     Returns
     -------
@@ -240,14 +422,25 @@ def savePointShapefile(X, Y, template, outputfile, mode='w', river=None,
 
     '''
 
+    import fiona
+
     # check that the `mode` is a valid value
     mode = _check_mode(mode)
 
-    # check that X and Y are have the same shape, NaN cells
-    X, Y = _check_for_same_masks(X, Y)
+    # check that X and Y are have the same shape, NaN cells. This (and
+    # everything below) works on blocks of columns so that large (e.g.,
+    # memory-mapped) arrays are never copied all at once.
+    if np.shape(X) != np.shape(Y):
+        raise ValueError('X, Y are not the same shape')
+
+    ny, nx = X.shape
+    blocks = _column_blocks(ny, nx, chunksize)
+    for cols in blocks:
+        _check_for_same_masks(X[:, cols], Y[:, cols])
 
     # check elev shape
-    elev = _check_elev_or_mask(X, elev, 'elev', offset=0)
+    if elev is not None:
+        elev = _check_elev_or_mask(X, elev, 'elev', offset=0)
 
     # load the template
     with fiona.open(template, 'r') as src:
@@ -265,29 +458,41 @@ def savePointShapefile(X, Y, template, outputfile, mode='w', river=None,
         schema=src_schema
     ) as out:
         row = 0
-        for ii in range(X.shape[1]):
-            for jj in range(X.shape[0]):
-                # check that nothing is masked (outside of the river)
-                if not (X.mask[jj, ii]):
-                    row += 1
-
-                    # build the coords
-                    coords = (X[jj, ii], Y[jj, ii])
-
-                    # build the attributes
-                    props = OrderedDict(
-                        id=int(row), river=river, reach=reach,
-                        ii=int(ii+2), jj=int(jj+2), elev=elev[jj,ii],
-                        ii_jj='{:02d}_{:02d}'.format(ii+2, jj+2)
-                    )
-
-                    # append to the output file
-                    record = misc.makeRecord(row, coords, 'Point', props)
-                    out.write(record)
-
-
+        for cols in blocks:
+            x, y = _check_for_same_masks(X[:, cols], Y[:, cols])
+
+            # select everything that isn't masked (outside of the river),
+            # numbered column by column (`jj` varies fastest)
+            ii, jj = np.nonzero(~np.ma.getmaskarray(x).T)
+            if ii.shape[0] == 0:
+                continue
+
+            ids = np.arange(row + 1, row + ii.shape[0] + 1)
+            row += ii.shape[0]
+
+            # build the coords
+            coords = np.column_stack([x.data[jj, ii], y.data[jj, ii]])
+            if elev is None:
+                Z = np.zeros(ii.shape, dtype=X.dtype)
+            else:
+                Z = np.asarray(elev[:, cols])[jj, ii]
+
+            # build the attributes
+            ii = ii + cols.start
+            props = OrderedDict(
+                id=ids, river=river, reach=reach,
+                ii=ii + 2, jj=jj + 2, elev=Z,
+                ii_jj=_ii_jj_labels(ii + 2, jj + 2)
+            )
+
+            _write_records(out, ids, coords, 'Point', props,
+                           chunksize=chunksize)
+
+
+@profiling.traced('io.saveGridShapefile', count='X')
 def saveGridShapefile(X, Y, mask, template, outputfile, mode,
-                      river=None, reach=0, elev=None, triangles=False):
+                      river=None, reach=0, elev=None, triangles=False,
+                      chunksize=10000):
     '''
     Saves a shapefile of quadrilaterals representing grid cells.
 
@@ -312,11 +517,13 @@ def saveGridShapefile(X, Y, mask, template, outputfile, mode,
     reach : optional int (default = 0)
         The reach of the river to be listed in the shapefile's attribute
         table.
-    elev : optional array or None (defauly)
-        The elevation of the grid cells. Shape should be N-1 by M-1,
+    elev : optional array or None (default)
+        The elevation of each grid cell. Shape must be N-1 by M-1,
         where N and M are the dimensions of `X` and `Y` (like `mask`).
     triangles : optional bool (default = False)
         If True, triangles can be included
+    chunksize : optional int (default = 10000)
+        Number of cells handed to fiona in each batch of records.
 
     Returns
     -------
@@ -324,6 +531,8 @@ def saveGridShapefile(X, Y, mask, template, outputfile, mode,
 
     '''
 
+    import fiona
+
     # check that `mode` is valid
     mode = _check_mode(mode)
 
@@ -331,16 +540,15 @@ def saveGridShapefile(X, Y, mask, template, outputfile, mode,
     Y = _check_elev_or_mask(X, Y, 'Y', offset=0)
 
     # check elev shape
-    elev = _check_elev_or_mask(X, elev, 'elev', offset=0)
+    if elev is not None:
+        elev = _check_elev_or_mask(X, elev, 'elev', offset=1)
 
     # check the mask shape
-    mask = _check_elev_or_mask(X, mask, 'mask', offset=1)
+    if mask is not None:
+        mask = _check_elev_or_mask(X, mask, 'mask', offset=1)
 
-    X = np.ma.masked_invalid(X)
-    Y = np.ma.masked_invalid(Y)
     ny, nx = X.shape
 
-
     # load the template
     with fiona.open(template, 'r') as src:
         src_driver = src.driver
@@ -356,67 +564,498 @@ def saveGridShapefile(X, Y, mask, template, outputfile, mode,
         crs=src_crs,
         schema=src_schema
     ) as out:
+        # work on blocks of columns so that large (e.g., memory-mapped)
+        # arrays are never copied all at once
         row = 0
-        for ii in range(nx-1):
-            for jj in range(ny-1):
-                if not (np.any(X.mask[jj:jj+2, ii:ii+2]) or mask[jj, ii]):
-                    row += 1
-                    Z = elev[jj, ii]
-                    # build the array or coordinates
-                    coords = misc.makePolyCoords(
-                        xarr=X[jj:jj+2, ii:ii+2],
-                        yarr=Y[jj:jj+2, ii:ii+2],
-                        zpnt=Z, triangles=triangles
-                    )
-
-                    # build the attributes
-                    props = OrderedDict(
-                        id=row, river=river, reach=reach,
-                        ii=ii+2, jj=jj+2, elev=Z,
-                        ii_jj='{:02d}_{:02d}'.format(ii+2, jj+2)
-                    )
-
-                    # append to file is coordinates are not masked
-                    # (masked = beyond the river boundary)
-                    if coords is not None:
-                        record = misc.makeRecord(row, coords, 'Polygon', props)
-                        out.write(record)
+        for cols in _column_blocks(ny - 1, nx - 1, chunksize):
+            x = np.ma.masked_invalid(X[:, cols.start:cols.stop + 1])
+            y = np.ma.masked_invalid(Y[:, cols.start:cols.stop + 1])
+
+            # a cell is written if none of its nodes are masked (outside
+            # of the river) and the cell itself isn't masked
+            node_mask = np.ma.getmaskarray(x) | np.ma.getmaskarray(y)
+            invalid = (
+                node_mask[:-1, :-1] | node_mask[:-1, 1:] |
+                node_mask[1:, :-1] | node_mask[1:, 1:]
+            )
+            if mask is not None:
+                invalid |= np.asarray(mask[:, cols], dtype=bool)
+
+            # cells are numbered column by column (`jj` varies fastest)
+            ii, jj = np.nonzero(~invalid.T)
+            if ii.shape[0] == 0:
+                continue
+
+            ids = np.arange(row + 1, row + ii.shape[0] + 1)
+            row += ii.shape[0]
+
+            # build the ring of each quad: (jj, ii), (jj, ii+1),
+            # (jj+1, ii+1), (jj+1, ii), with the cell's elevation at
+            # each vertex
+            if elev is None:
+                Z = np.zeros(ii.shape, dtype=X.dtype)
+            else:
+                Z = np.asarray(elev[:, cols])[jj, ii]
+
+            corners_j = np.column_stack([jj, jj, jj + 1, jj + 1])
+            corners_i = np.column_stack([ii, ii + 1, ii + 1, ii])
+            coords = np.dstack([
+                x.data[corners_j, corners_i],
+                y.data[corners_j, corners_i],
+                np.repeat(Z[:, None], 4, axis=1),
+            ])
+
+            # build the attributes
+            ii = ii + cols.start
+            props = OrderedDict(
+                id=ids, river=river, reach=reach,
+                ii=ii + 2, jj=jj + 2, elev=Z,
+                ii_jj=_ii_jj_labels(ii + 2, jj + 2)
+            )
+
+            _write_records(out, ids, coords, 'Polygon', props,
+                           chunksize=chunksize)
+
+
+@profiling.traced('io._read_grid_nodes')
+def _read_grid_nodes(shapefile, icol='ii', jcol='jj', othercols=None,
+                     expand=1):
+    '''
+    Reads a point or polygon (cell) shapefile of a grid in a single
+    pass and scatters the coordinates into (ny, nx) node arrays.
 
+    The first four vertices of each cell are its corners, starting at
+    node (jj, ii) as written by `saveGridShapefile`. Nodes shared by
+    neighboring cells collapse onto the same element. If both corner
+    orders fit equally well (e.g., a single cell, or cells that share
+    no corners), the vertices are taken in the order they are stored.
 
-def readGridShapefile(shapefile, icol='ii', jcol='jj', othercols=None,
-                      expand=1):
+    Returns
+    -------
+    nodes_x, nodes_y : numpy arrays
+        Node coordinates, NaN where the shapefile has no node.
+    rows : numpy array of ints
+        Index of the record that defines each node (-1 if none).
+    others : dict of numpy arrays
+        The values of each of the `othercols`, one per record.
+
+    '''
+
+    import fiona
 
-    data = []
     if othercols is None:
         othercols = []
 
     with fiona.open(shapefile) as shp:
-        for record in shp:
-            geomtype = record['geometry']['type']
-            if geomtype == 'Point':
-                geom = np.array(record['geometry']['coordinates'])
-            elif geomtype == 'Polygon':
-                raise NotImplementedError("can only read points for now")
-                #geom = np.array(record['geometry']['coordinates']).flatten()
-
-            dfrow = {
-                'i': expand * (record['properties'][icol] - 2),
-                'j': expand * (record['properties'][jcol] - 2),
-                'easting': geom[0],
-                'northing': geom[1],
-            }
+        geomtype = shp.schema['geometry']
+        if geomtype == 'Point':
+            nverts = 1
+        elif geomtype == 'Polygon':
+            if othercols:
+                raise ValueError("`othercols` can only be read from points")
+            nverts = 4
+        else:
+            raise NotImplementedError("can only read points or polygons")
+
+        N = len(shp)
+        ii = np.empty(N, dtype=int)
+        jj = np.empty(N, dtype=int)
+        coords = np.empty((N, nverts, 2), dtype=float)
+        others = {col: np.empty(N, dtype=object) for col in othercols}
+        for n, record in enumerate(shp):
+            props = record['properties']
+            ii[n] = props[icol]
+            jj[n] = props[jcol]
             for col in othercols:
-                dfrow[col] = record['properties'][col]
+                others[col][n] = props[col]
+
+            geom = record['geometry']['coordinates']
+            if nverts == 1:
+                coords[n, 0] = geom[:2]
+            else:
+                coords[n] = [xy[:2] for xy in geom[0][:nverts]]
+
+    if N and (ii.min() < 2 or jj.min() < 2):
+        raise ValueError("grid indices must be at least 2")
+
+    if nverts == 1:
+        corners = [([0], [0])]
+    else:
+        # writers may reverse rings to make them clockwise, which swaps
+        # the (jj, ii+1) and (jj+1, ii) corners, so use whichever order
+        # makes the corners shared by neighboring cells agree. ties
+        # (nothing shared) keep the stored order, which comes first.
+        corners = [([0, 0, 1, 1], [0, 1, 1, 0]), ([0, 1, 1, 0], [0, 0, 1, 1])]
+
+    x = coords[..., 0].ravel()
+    y = coords[..., 1].ravel()
+    best = None
+    for dj, di in corners:
+        jn = (expand * (jj[:, None] - 2 + np.array(dj))).ravel()
+        inn = (expand * (ii[:, None] - 2 + np.array(di))).ravel()
+        shape = (jn.max() + 1, inn.max() + 1) if N else (0, 0)
+        nodes_x = np.full(shape, np.nan)
+        nodes_y = np.full(shape, np.nan)
+        nodes_x[jn, inn] = x
+        nodes_y[jn, inn] = y
+        misfit = np.nansum(np.abs(nodes_x[jn, inn] - x) +
+                           np.abs(nodes_y[jn, inn] - y))
+        if best is None or misfit < best[0]:
+            best = (misfit, nodes_x, nodes_y, jn, inn)
+
+    _, nodes_x, nodes_y, jn, inn = best
+    rows = np.full(nodes_x.shape, -1, dtype=int)
+    rows[jn, inn] = np.repeat(np.arange(N), nverts)
+    return nodes_x, nodes_y, rows, others
+
+
+@profiling.traced('io.readGridShapefile')
+def readGridShapefile(shapefile, icol='ii', jcol='jj', othercols=None,
+                      expand=1):
+    '''
+    Reads the nodes of a grid from a point shapefile or a polygon
+    shapefile of its cells.
+
+    Parameters
+    ----------
+    shapefile : string
+        Path to the shapefile.
+    icol, jcol : optional strings (defaults = 'ii' and 'jj')
+        Columns of the attribute table with the (2-based) i and j
+        indices of each point or cell.
+    othercols : optional list of strings or None (default)
+        Other columns of the attribute table to include (points only).
+    expand : optional int (default = 1)
+        Factor by which the indices are multiplied.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        The "easting" and "northing" (and `othercols`) of each node,
+        indexed by "j" and "i".
+
+    '''
+
+    if othercols is None:
+        othercols = []
+
+    nodes_x, nodes_y, rows, others = _read_grid_nodes(
+        shapefile, icol=icol, jcol=jcol, othercols=othercols, expand=expand
+    )
+
+    jj, ii = np.nonzero(rows >= 0)
+    index = pandas.MultiIndex.from_arrays([jj, ii], names=['j', 'i'])
+    df = pandas.DataFrame({
+        'easting': nodes_x[jj, ii],
+        'northing': nodes_y[jj, ii],
+    }, index=index)
+    for col in othercols:
+        df[col] = others[col][rows[jj, ii]].tolist()
+
+    return df
+
+
+@profiling.traced('io.loadBathymetry')
+def loadBathymetry(filename, bbox=None, buffer=0, resolution=None,
+                   chunksize=1000000, sep=r'\s+', header=None, xcol='x',
+                   ycol='y', zcol='z', **read_kws):
+    '''
+    Reads (potentially huge) XYZ or CSV bathymetry files in chunks,
+    keeping only the points near the grid.
+
+    Parameters
+    ----------
+    filename : string
+        Path to the text file of x-y-z points.
+    bbox : optional tuple or None (default)
+        The ``(xmin, ymin, xmax, ymax)`` extent of the grid. Points
+        outside of it (plus `buffer`) are dropped as they are read.
+    buffer : optional float (default = 0)
+        Distance by which `bbox` is grown on each side.
+    resolution : optional float or None (default)
+        If provided, the points are binned onto squares of this size
+        and each bin is replaced by the mean of its points. Memory then
+        scales with the number of bins instead of the number of
+        points.
+    chunksize : optional int (default = 1000000)
+        Number of lines read at a time.
+    sep : optional string (default = r'\s+')
+        Column delimiter. The default handles whitespace-delimited XYZ
+        files. Use ',' for CSV.
+    header : optional int or None (default)
+        Row number of the column names (e.g., 0 for CSV). If None,
+        the first three columns are read as `xcol`, `ycol`, and
+        `zcol`.
+    xcol/ycol/zcol : optional strings
+        Column names for each of the quantities defining the elevation
+        pints. Defaults are "x/y/z".
+    **read_kws : optional kwargs
+        Passed on to `pandas.read_csv` (e.g., `skiprows`).
+
+    Returns
+    -------
+    bathy : pandas.DataFrame
+        The x-y-z points, ready for `misc.interpolateBathymetry` or
+        `misc.Bathymetry`.
 
-            data.append(dfrow)
+    '''
+
+    columns = [xcol, ycol, zcol]
+    if header is None:
+        read_kws.update(dict(names=columns, usecols=[0, 1, 2]))
+    else:
+        read_kws.update(dict(usecols=columns))
+
+    reader = pandas.read_csv(filename, sep=sep, header=header,
+                             chunksize=chunksize, **read_kws)
+
+    kept = []
+    for chunk in reader:
+        chunk = chunk[columns].dropna(how='any')
+        if bbox is not None:
+            xmin, ymin, xmax, ymax = bbox
+            chunk = chunk[
+                (chunk[xcol] >= xmin - buffer) &
+                (chunk[xcol] <= xmax + buffer) &
+                (chunk[ycol] >= ymin - buffer) &
+                (chunk[ycol] <= ymax + buffer)
+            ]
+
+        if resolution is not None:
+            # running sums and counts of each bin
+            bins = [
+                np.floor(chunk[xcol].values / resolution).astype(np.int64),
+                np.floor(chunk[ycol].values / resolution).astype(np.int64),
+            ]
+            sums = chunk.assign(n=1).groupby(bins).sum()
+            if kept:
+                sums = pandas.concat([kept[0], sums])
+                sums = sums.groupby(level=[0, 1]).sum()
+            kept = [sums]
+
+        else:
+            kept.append(chunk)
+
+    if not kept:
+        return pandas.DataFrame(columns=columns, dtype=float)
+
+    bathy = pandas.concat(kept)
+    if resolution is not None:
+        bathy = bathy[columns].div(bathy['n'], axis=0)
+
+    return bathy.reset_index(drop=True)
+
+
+def _read_ascii_grid_header(filename):
+    header = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if not parts or not parts[0][0].isalpha():
+                break
+            header[parts[0].lower()] = float(parts[1])
+
+    return header
+
+
+@profiling.traced('io.loadRasterBathymetry')
+def loadRasterBathymetry(filename, transform=None, bbox=None, buffer=0):
+    '''
+    Reads the part of a raster DEM (an ESRI ASCII grid or a ``.npy``
+    array) that covers a grid.
+
+    Parameters
+    ----------
+    filename : string
+        Path to the raster. ``*.npy`` files are memory-mapped and need
+        `transform`. Anything else is read as an ESRI ASCII grid.
+    transform : optional tuple or None (default)
+        GDAL-style geotransform of a ``.npy`` raster:
+        ``(x_origin, dx, 0, y_origin, 0, dy)``.
+    bbox : optional tuple or None (default)
+        The ``(xmin, ymin, xmax, ymax)`` extent of the grid. Only the
+        pixels covering it (plus `buffer`) are read.
+    buffer : optional float (default = 0)
+        Distance by which `bbox` is grown on each side.
+
+    Returns
+    -------
+    raster : misc.RasterBathymetry
+
+    '''
+
+    if filename.lower().endswith('.npy'):
+        if transform is None:
+            raise ValueError('`transform` is required for .npy rasters')
+        values = np.load(filename, mmap_mode='r')
+        shape = values.shape
+        nodata = None
+
+    else:
+        header = _read_ascii_grid_header(filename)
+        shape = (int(header['nrows']), int(header['ncols']))
+        size = header['cellsize']
+        if 'xllcenter' in header:
+            x0 = header['xllcenter'] - 0.5 * size
+        else:
+            x0 = header['xllcorner']
+
+        if 'yllcenter' in header:
+            y0 = header['yllcenter'] - 0.5 * size
+        else:
+            y0 = header['yllcorner']
+
+        transform = (x0, size, 0, y0 + size * shape[0], 0, -size)
+        nodata = header.get('nodata_value')
+
+    if bbox is None:
+        rows, cols = slice(0, shape[0]), slice(0, shape[1])
+    else:
+        xmin, ymin, xmax, ymax = bbox
+        rows, cols = misc.raster_window(transform, shape, (
+            xmin - buffer, ymin - buffer, xmax + buffer, ymax + buffer
+        ))
+
+    nrows, ncols = rows.stop - rows.start, cols.stop - cols.start
+    if nrows == 0 or ncols == 0:
+        window = np.empty((nrows, ncols))
+
+    elif filename.lower().endswith('.npy'):
+        window = np.array(values[rows, cols], dtype=float)
+
+    else:
+        window = pandas.read_csv(
+            filename, sep=r'\s+', header=None, nrows=nrows,
+            skiprows=len(header) + rows.start,
+            usecols=range(cols.start, cols.stop)
+        ).values.astype(float)
+
+    if nodata is not None:
+        window[window == nodata] = np.nan
+
+    x0, dx, _, y0, _, dy = transform
+    transform = (x0 + cols.start * dx, dx, 0, y0 + rows.start * dy, 0, dy)
+    return misc.RasterBathymetry(window, transform)
+
+
+@profiling.traced('io.saveGridFile', count='nodes_x')
+def saveGridFile(outputfile, nodes_x, nodes_y, cell_mask=None,
+                 template=None, attrs=None, compress=False):
+    '''
+    Saves the nodes of a grid (and optionally its cell mask, template
+    shapefile, and cell attributes) to a single binary file.
+
+    Parameters
+    ----------
+    outputfile : string
+        Path to the file to be written (conventionally ``*.npz``).
+    nodes_x, nodes_y : numpy arrays
+        The x- and y-coordinates of the nodes. Must be the same shape.
+    cell_mask : optional array or None (default)
+        Boolean mask of the cells. Dimensions must be 1 less than
+        `nodes_x` and `nodes_y`.
+    template : optional string or None (default)
+        Path to the grid's template shapefile. Only the path is stored.
+    attrs : optional dict or None (default)
+        Arrays of cell attributes (e.g., elevation) keyed by name.
+        Dimensions must be 1 less than `nodes_x` and `nodes_y`.
+    compress : optional bool (default = False)
+        Toggles zlib compression of the arrays. Smaller, but slower to
+        write and load.
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    The file is a numpy ``.npz`` archive with a JSON header recording
+    the format version, shape, template, and attribute names. See
+    `loadGridFile`. `ModelGrid.save_binary` writes the same header
+    next to a directory of ``.npy`` files instead, because arrays
+    inside an ``.npz`` archive cannot be memory-mapped.
+
+    '''
+
+    nodes_x = np.asarray(nodes_x)
+    nodes_y = np.asarray(nodes_y)
+    if nodes_x.shape != nodes_y.shape or nodes_x.ndim != 2:
+        raise ValueError('nodes_x and nodes_y must be 2D and the same shape')
+
+    cell_mask = np.asarray(
+        _check_elev_or_mask(nodes_x, cell_mask, 'cell_mask', offset=1),
+        dtype=bool
+    )[:nodes_x.shape[0] - 1, :nodes_x.shape[1] - 1]
+
+    if attrs is None:
+        attrs = {}
 
-    df = pandas.DataFrame(data).set_index(['j', 'i'])
-    columns = ['easting', 'northing']
-    columns.extend(othercols)
-    df.sort(inplace=True)
-    return df[columns]
+    arrays = {'nodes_x': nodes_x, 'nodes_y': nodes_y, 'cell_mask': cell_mask}
+    for name, values in attrs.items():
+        values = np.asarray(values)
+        _check_elev_or_mask(nodes_x, values, name, offset=1)
+        arrays['attr_{}'.format(name)] = values
 
+    header = _grid_header(nodes_x.shape, template, attrs.keys())
+    arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'),
+                                     dtype=np.uint8)
 
+    if compress:
+        savez = np.savez_compressed
+    else:
+        savez = np.savez
+
+    # writing to an open file keeps numpy from appending ".npz"
+    with open(outputfile, 'wb') as f:
+        savez(f, **arrays)
+
+
+@profiling.traced('io.loadGridFile')
+def loadGridFile(filename):
+    '''
+    Loads a grid saved with `saveGridFile`.
+
+    Parameters
+    ----------
+    filename : string
+        Path to the grid file.
+
+    Returns
+    -------
+    grid : dict
+        The ``nodes_x``, ``nodes_y``, and ``cell_mask`` arrays, the
+        ``template`` path, and an ordered dictionary of cell ``attrs``.
+
+    '''
+
+    data = np.load(filename, allow_pickle=False)
+    if not hasattr(data, 'files'):
+        raise ValueError('{} is not a pygridtools grid file'.format(filename))
+
+    with data:
+        if 'header' not in data.files:
+            raise ValueError('{} is not a pygridtools grid '
+                             'file'.format(filename))
+
+        header = _check_grid_header(
+            json.loads(data['header'].tobytes().decode('utf-8')), filename
+        )
+
+        grid = {
+            'nodes_x': data['nodes_x'],
+            'nodes_y': data['nodes_y'],
+            'cell_mask': data['cell_mask'],
+            'template': header['template'],
+            'attrs': OrderedDict(
+                (name, data['attr_{}'.format(name)])
+                for name in header['attrs']
+            )
+        }
+
+    return grid
+
+
+@profiling.traced('io.writeCellinp', count='cell_array')
 def _write_cellinp(cell_array, outputfile='cell.inp', mode='w',
                    writeheader=True, rowlabels=True,
                    maxcols=125, flip=True):
@@ -452,49 +1091,61 @@ def _write_cellinp(cell_array, outputfile='cell.inp', mode='w',
     if flip:
         cell_array = np.flipud(cell_array)
 
+    cell_array = np.asarray(cell_array)
     nrows, ncols = cell_array.shape
 
-    if cell_array.shape[1] > maxcols:
-        first_array = cell_array[:, :maxcols]
-        _second_array = cell_array[:, maxcols:]
-        padwidth = maxcols - _second_array.shape[1]
-        second_array = np.pad(_second_array, ((0, 0), (0, padwidth)),
-                              mode='constant', constant_values=0)
-
-        _write_cellinp(first_array, outputfile=outputfile, mode=mode,
-                       writeheader=writeheader, rowlabels=rowlabels,
-                       maxcols=maxcols, flip=False)
-        _write_cellinp(second_array, outputfile=outputfile, mode='a',
-                       writeheader=False, rowlabels=False,
-                       maxcols=maxcols, flip=False)
-
-    else:
-        columns = np.arange(1, maxcols+1, dtype=int)
-        colstr = [list('{:04d}'.format(c)) for c in columns]
-        hundreds = ''.join([c[1] for c in colstr])
-        tens = ''.join([c[2] for c in colstr])
-        ones = ''.join([c[3] for c in colstr])
-
-        with open(outputfile, mode) as outfile:
-            if writeheader:
-                title = 'C -- cell.inp for EFDC model by pygridtools\n'
-                outfile.write(title)
-                outfile.write('C    {}\n'.format(hundreds[:ncols]))
-                outfile.write('C    {}\n'.format(tens[:ncols]))
-                outfile.write('C    {}\n'.format(ones[:ncols]))
-
-            for n, row in enumerate(cell_array):
-                row_number = nrows - n
-                row_strings = row.astype(str)
-                cell_text = ''.join(row_strings.tolist())
-                if rowlabels:
-                    row_text = '{0:3d}  {1:s}\n'.format(
-                        int(row_number), cell_text
-                    )
-                else:
-                    row_text = '     {0:s}\n'.format(cell_text)
-
-                outfile.write(row_text)
+    # grids wider than `maxcols` are written as blocks of `maxcols`
+    # columns. only the first block has a header and row labels; the
+    # others are padded with zeros
+    nblocks = max(1, -(-ncols // maxcols))
+    with open(outputfile, mode) as outfile:
+        if writeheader:
+            width = min(ncols, maxcols)
+            columns = np.char.mod('%04d', np.arange(1, width + 1))
+            title = 'C -- cell.inp for EFDC model by pygridtools\n'
+            outfile.write(title)
+            for digit in (1, 2, 3):
+                digits = ''.join(c[digit] for c in columns)
+                outfile.write('C    {}\n'.format(digits))
+
+        for block in range(nblocks):
+            cells = cell_array[:, block * maxcols:(block + 1) * maxcols]
+            if block > 0 and cells.shape[1] < maxcols:
+                padwidth = maxcols - cells.shape[1]
+                cells = np.pad(cells, ((0, 0), (0, padwidth)),
+                               mode='constant', constant_values=0)
+
+            if block == 0 and rowlabels:
+                row_numbers = np.arange(nrows, 0, -1)
+                labels = np.char.mod('%3d  ', row_numbers)
+            else:
+                labels = np.array(['     '] * nrows)
+
+            outfile.write(_cellinp_rows(cells, labels))
+
+
+def _cellinp_rows(cells, labels):
+    '''Text of the rows of a block of cell.inp'''
+
+    nrows, ncols = cells.shape
+    if nrows == 0:
+        return ''
+
+    if (np.issubdtype(cells.dtype, np.integer) and cells.size > 0 and
+            cells.min() >= 0 and cells.max() <= 9):
+        # single digits: look up the character of each cell and view
+        # each row (plus its newline) as a single string
+        lines = np.empty((nrows, ncols + 1), dtype=np.uint8)
+        lines[:, :-1] = _CELL_DIGITS[cells]
+        lines[:, -1] = ord('\n')
+        rows = lines.view('S{}'.format(ncols + 1)).ravel()
+        text = np.char.add(labels.astype(bytes), rows)
+        return b''.join(text.tolist()).decode('ascii')
+
+    return ''.join(
+        label + ''.join(row.astype(str).tolist()) + '\n'
+        for label, row in zip(labels.tolist(), cells)
+    )
 
 
 def _write_gefdc_control_file(outfile, title, max_i, max_j, bathyrows):
@@ -542,22 +1193,52 @@ def _write_gefdc_control_file(outfile, title, max_i, max_j, bathyrows):
     return gefdc
 
 
+@profiling.traced('io.writeGridout', count='xcoords')
 def _write_gridout_file(xcoords, ycoords, outfile):
     if xcoords.shape != ycoords.shape:
         raise ValueError('input dimensions must be equivalent')
 
     ny, nx = xcoords.shape
-    df = pandas.DataFrame({
-        'x': xcoords.flatten(),
-        'y': ycoords.flatten()
-    })
-
     with open(outfile, 'w') as f:
         f.write('## {:d} x {:d}\n'.format(nx, ny))
-        df.to_csv(f, sep=' ', na_rep='NaN', index=False,
-                  header=False, float_format='%.3f')
+        _write_xy_pairs(f, xcoords, ycoords)
 
-    return df
+
+@profiling.traced('io.readGridout')
+def readGridout(filename):
+    '''
+    Reads the nodes from a grid.out file (e.g., as written by
+    `ModelGrid.writeGEFDCGridFile` or `dumpGridFiles`).
+
+    Parameters
+    ----------
+    filename : string
+        Path to the grid.out file.
+
+    Returns
+    -------
+    nodes_x, nodes_y : numpy arrays
+        The x- and y-coordinates of the nodes (NaN where missing)
+        shaped according to the file's "## nx x ny" header.
+
+    '''
+
+    with open(filename, 'r') as f:
+        header = f.readline().split()
+
+    try:
+        nx, ny = int(header[1]), int(header[3])
+    except (IndexError, ValueError):
+        raise ValueError('{} does not start with a "## nx x ny" '
+                         'header'.format(filename))
+
+    values = pandas.read_csv(filename, sep=' ', header=None, skiprows=1,
+                             names=['x', 'y'], dtype=float).values
+    if values.shape[0] != nx * ny:
+        raise ValueError('expected {} nodes in {}, found {}'.format(
+            nx * ny, filename, values.shape[0]))
+
+    return values[:, 0].reshape(ny, nx), values[:, 1].reshape(ny, nx)
 
 
 def _write_gridext_file(tidydf, outfile, icol='i', jcol='j',
@@ -570,7 +1251,38 @@ def _write_gridext_file(tidydf, outfile, icol='i', jcol='j',
            float_format=None)
 
 
-def gridextToShapefile(inputfile, outputfile, template, river='na', reach=0):
+@profiling.traced('io.writeGridext', count='xcoords')
+def _write_gridext_nodes(xcoords, ycoords, outfile, shift=2,
+                         chunksize=100000):
+    '''
+    Writes the "i j x y" lines of gridext.inp straight from the node
+    arrays, skipping nodes that have neither coordinate.
+    '''
+    X = np.ma.filled(np.ma.asarray(xcoords, dtype=float), np.nan)
+    Y = np.ma.filled(np.ma.asarray(ycoords, dtype=float), np.nan)
+    if X.shape != Y.shape:
+        raise ValueError('input dimensions must be equivalent')
+
+    # row by row (`ii` varies fastest)
+    jj, ii = np.nonzero(~(np.isnan(X) & np.isnan(Y)))
+
+    with open(outfile, 'w') as f:
+        for start in range(0, ii.shape[0], chunksize):
+            j = jj[start:start + chunksize]
+            i = ii[start:start + chunksize]
+            values = [None] * (4 * i.shape[0])
+            values[0::4] = (i + shift).tolist()
+            values[1::4] = (j + shift).tolist()
+            values[2::4] = X[j, i].tolist()
+            values[3::4] = Y[j, i].tolist()
+            text = ('%d %d %r %r\n' * i.shape[0]) % tuple(values)
+            # pandas writes missing values as empty fields
+            f.write(text.replace('nan', ''))
+
+
+@profiling.traced('io.gridextToShapefile')
+def gridextToShapefile(inputfile, outputfile, template, river='na', reach=0,
+                       chunksize=10000):
     '''
     Converts gridext.inp from the rtools to a shapefile with
     geomtype = 'Point'
@@ -588,22 +1300,41 @@ def gridextToShapefile(inputfile, outputfile, template, river='na', reach=0):
     reach : optional int (default = 0)
         The reach of the river to be listed in the shapefile's attribute
         table.
+    chunksize : optional int (default = 10000)
+        Number of points handed to fiona in each batch of records.
 
     Returns
     -------
-    None
+    failed : pandas.DataFrame
+        The rows of `inputfile` that could not be converted (i.e.,
+        missing or non-numeric values, non-integer indices). The
+        "in gis layer" column is 0 for all of them.
 
     '''
+
+    import fiona
+
     errmsg = 'file {} not found in {}'
     if not os.path.exists(inputfile):
         raise ValueError(errmsg.format(inputfile, os.getcwd()))
 
+    # read everything as text and coerce, so that bad rows end up as
+    # NaN and can be masked out instead of raising mid-conversion
     df = pandas.read_csv(
         inputfile,
-        sep='\s+',
+        sep=r'\s+',
         header=None,
         names=['i', 'j', 'x', 'y'],
-        dtype={'i':int, 'j':int, 'x':float, 'y':float}
+        usecols=[0, 1, 2, 3],
+        dtype=str,
+    ).apply(pandas.to_numeric, errors='coerce')
+
+    ij = df[['i', 'j']].values
+    xy = df[['x', 'y']].values
+    failed = (
+        ~np.isfinite(ij).all(axis=1) |
+        (np.floor(ij) != ij).any(axis=1) |
+        ~np.isfinite(xy).all(axis=1)
     )
 
     # load the template
@@ -617,19 +1348,14 @@ def gridextToShapefile(inputfile, outputfile, template, river='na', reach=0):
 
     src_schema['geometry'] = 'Point'
 
-    def row2record(row, outfile):
-        coords = (float(row.x), float(row.y))
-        props = OrderedDict(
-            id=int(row.name), river=river, reach=reach,
-            ii=int(row.i), jj=int(row.j), elev=0,
-            ii_jj='{:03d}_{:03d}'.format(int(row.i), int(row.j))
-        )
-        record = misc.makeRecord(int(row.name), coords, 'Point', props)
-        try:
-            outfile.write(record)
-            return 1
-        except: # pragma: no cover
-            return 0
+    ok = ~failed
+    ii = ij[ok, 0].astype(int)
+    jj = ij[ok, 1].astype(int)
+    props = OrderedDict([
+        ('id', np.flatnonzero(ok)), ('river', river), ('reach', reach),
+        ('ii', ii), ('jj', jj), ('elev', 0),
+        ('ii_jj', _ii_jj_labels(ii, jj, width=3)),
+    ])
 
     # start writting or appending to the output
     with fiona.open(
@@ -638,8 +1364,8 @@ def gridextToShapefile(inputfile, outputfile, template, river='na', reach=0):
         crs=src_crs,
         schema=src_schema
     ) as out:
-        df['in gis layer'] = df.apply(
-            lambda row: row2record(row, out), axis=1
-        )
+        _write_records(out, props['id'], xy[ok], 'Point', props,
+                       chunksize=chunksize)
 
-    return df[df['in gis layer'] == 0]
+    df['in gis layer'] = ok.astype(int)
+    return df[failed]
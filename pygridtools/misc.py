@@ -1,20 +1,263 @@
 import os
+import hashlib
+import logging
 import warnings
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.path as mpath
-import matplotlib.mlab as mlab
 import pandas
-import fiona
 
 import pygridgen
 
+from . import profiling
+
+
+logger = logging.getLogger(__name__)
+
 
 def points_inside_poly(points, polyverts):
+    # imported here so that matplotlib is only loaded when masking
+    import matplotlib.path as mpath
     return mpath.Path(polyverts).contains_points(points)
 
 
+class BucketIndex(object):
+    '''
+    Uniform grid of buckets over a set of points so that only the
+    points near a region need to be tested against it.
+
+    Parameters
+    ----------
+    x, y : numpy arrays
+        Coordinates of the points. Any shape is accepted; results refer
+        to positions in the flattened arrays. Points with NaN
+        coordinates are never returned.
+    bucketsize : optional int (default = 16)
+        Target average number of points in each bucket.
+
+    '''
+
+    def __init__(self, x, y, bucketsize=16):
+        self.x = np.asarray(x, dtype=float).ravel()
+        self.y = np.asarray(y, dtype=float).ravel()
+        if self.x.shape != self.y.shape:
+            raise ValueError('x and y must have the same size')
+
+        valid = np.flatnonzero(np.isfinite(self.x) & np.isfinite(self.y))
+        if valid.shape[0] == 0:
+            self.bounds = None
+            self._ids = valid
+            return
+
+        xv = self.x[valid]
+        yv = self.y[valid]
+        self.bounds = (xv.min(), yv.min(), xv.max(), yv.max())
+        width = self.bounds[2] - self.bounds[0]
+        height = self.bounds[3] - self.bounds[1]
+
+        # roughly square buckets, but never more rows or columns than
+        # there are buckets
+        nbuckets = max(1, valid.shape[0] // bucketsize)
+        size = max(np.sqrt(width * height / nbuckets),
+                   max(width, height) / nbuckets)
+        self._size = size if size > 0 else 1.0
+        self._nx = int(width // self._size) + 1
+        self._ny = int(height // self._size) + 1
+
+        # sort the points by bucket so that each bucket (and each run
+        # of buckets along a row) is a contiguous slice of `_ids`
+        ix, iy = self._bucket(xv, yv)
+        key = iy * self._nx + ix
+        order = np.argsort(key, kind='mergesort')
+        self._ids = valid[order]
+        self._offsets = np.searchsorted(key[order],
+                                        np.arange(self._nx * self._ny + 1))
+
+    def _bucket(self, x, y):
+        ix = np.clip((x - self.bounds[0]) // self._size, 0, self._nx - 1)
+        iy = np.clip((y - self.bounds[1]) // self._size, 0, self._ny - 1)
+        return ix.astype(int), iy.astype(int)
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        '''
+        Positions of the points inside (or on the edge of) a bounding
+        box.
+
+        Returns
+        -------
+        ids : numpy int array
+            Indices into the flattened `x` and `y` arrays.
+
+        '''
+        if (self.bounds is None or xmax < self.bounds[0] or
+                ymax < self.bounds[1] or xmin > self.bounds[2] or
+                ymin > self.bounds[3]):
+            return np.array([], dtype=int)
+
+        (ix0, ix1), (iy0, iy1) = self._bucket(np.array([xmin, xmax]),
+                                              np.array([ymin, ymax]))
+        rows = np.arange(iy0, iy1 + 1) * self._nx
+        starts = self._offsets[rows + ix0]
+        stops = self._offsets[rows + ix1 + 1]
+        ids = np.concatenate([
+            self._ids[start:stop] for start, stop in zip(starts, stops)
+        ])
+
+        x = self.x[ids]
+        y = self.y[ids]
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return ids[inside]
+
+    def points_inside_poly(self, polyverts):
+        '''
+        Like `points_inside_poly`, but only tests the points within the
+        polygon's bounding box.
+
+        Returns
+        -------
+        inside : numpy bool array
+            Flat array with one value for each point.
+
+        '''
+        polyverts = np.asarray(polyverts)
+        inside = np.zeros(self.x.shape, dtype=bool)
+        xmin, ymin = polyverts.min(axis=0)
+        xmax, ymax = polyverts.max(axis=0)
+        ids = self.query_bbox(xmin, ymin, xmax, ymax)
+        if ids.shape[0] > 0:
+            points = np.column_stack([self.x[ids], self.y[ids]])
+            inside[ids] = points_inside_poly(points, polyverts)
+
+        return inside
+
+
+class RaggedPolygons(object):
+    '''
+    Many polygons (with holes and multiple parts) stored in a few flat
+    arrays instead of one object per polygon.
+
+    Parameters
+    ----------
+    coords : numpy array
+        N x 2 array of the vertices of all of the rings, one ring after
+        the other.
+    ring_offsets : numpy int array
+        Position of the first vertex of each ring in `coords`, plus the
+        total number of vertices at the end.
+    part_offsets : numpy int array
+        Position of the first ring of each part (an exterior ring
+        followed by its holes), plus the total number of rings.
+    polygon_offsets : numpy int array
+        Position of the first part of each polygon, plus the total
+        number of parts.
+    ids : optional numpy int array
+        Identifier of each polygon (e.g., its record number in a
+        shapefile). Defaults to 0, 1, 2, ...
+
+    Attributes
+    ----------
+    bboxes : numpy array
+        The ``(xmin, ymin, xmax, ymax)`` of each polygon.
+
+    '''
+
+    def __init__(self, coords, ring_offsets, part_offsets, polygon_offsets,
+                 ids=None):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.ring_offsets = np.asarray(ring_offsets, dtype=int)
+        self.part_offsets = np.asarray(part_offsets, dtype=int)
+        self.polygon_offsets = np.asarray(polygon_offsets, dtype=int)
+        if ids is None:
+            ids = np.arange(len(self))
+        self.ids = np.asarray(ids, dtype=int)
+
+        if len(self) == 0:
+            self.bboxes = np.empty((0, 4))
+            return
+
+        # extent of each ring, then of each polygon's block of rings
+        rings = self.ring_offsets[:-1]
+        lower = np.minimum.reduceat(self.coords, rings, axis=0)
+        upper = np.maximum.reduceat(self.coords, rings, axis=0)
+        first_rings = self.part_offsets[self.polygon_offsets[:-1]]
+        self.bboxes = np.hstack([
+            np.minimum.reduceat(lower, first_rings, axis=0),
+            np.maximum.reduceat(upper, first_rings, axis=0),
+        ])
+
+    def __len__(self):
+        return self.polygon_offsets.shape[0] - 1
+
+    @staticmethod
+    def from_polygons(polygons, ids=None):
+        '''
+        Packs a list of (N x 2) arrays of vertices, e.g., from
+        `io.loadPolygonFromShapefile`, as single-ring polygons.
+        '''
+        polygons = [np.asarray(p, dtype=float)[:, :2] for p in polygons]
+        sizes = [p.shape[0] for p in polygons]
+        if polygons:
+            coords = np.vstack(polygons)
+        else:
+            coords = np.empty((0, 2))
+
+        ring_offsets = np.concatenate([[0], np.cumsum(sizes, dtype=int)])
+        offsets = np.arange(len(polygons) + 1)
+        return RaggedPolygons(coords, ring_offsets, offsets, offsets, ids=ids)
+
+    def _ring_range(self, n):
+        parts = self.polygon_offsets[n:n + 2]
+        return self.part_offsets[parts[0]], self.part_offsets[parts[1]]
+
+    def rings(self, n):
+        '''Views of the vertices of all of the rings of polygon `n`'''
+        first, last = self._ring_range(n)
+        return [
+            self.coords[self.ring_offsets[r]:self.ring_offsets[r + 1]]
+            for r in range(first, last)
+        ]
+
+    def parts(self, n):
+        '''Rings of polygon `n` grouped by part (exterior first)'''
+        parts = []
+        for part in range(self.polygon_offsets[n],
+                          self.polygon_offsets[n + 1]):
+            rings = range(self.part_offsets[part],
+                          self.part_offsets[part + 1])
+            parts.append([
+                self.coords[self.ring_offsets[r]:self.ring_offsets[r + 1]]
+                for r in rings
+            ])
+        return parts
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        '''Positions of the polygons whose extents overlap a bbox'''
+        b = self.bboxes
+        return np.flatnonzero(
+            (b[:, 0] <= xmax) & (b[:, 2] >= xmin) &
+            (b[:, 1] <= ymax) & (b[:, 3] >= ymin)
+        )
+
+    def points_inside(self, points, n):
+        '''
+        Flags the points inside of polygon `n`. Rings are combined with
+        the even-odd rule, so points in holes are outside.
+        '''
+        inside = np.zeros(len(points), dtype=bool)
+        for ring in self.rings(n):
+            inside ^= points_inside_poly(points, ring)
+        return inside
+
+    def separated_coords(self):
+        '''
+        All of the vertices with a row of NaN after each ring, so that
+        every ring can be drawn with a single call to ``plot``.
+        '''
+        return np.insert(self.coords, self.ring_offsets[1:], np.nan, axis=0)
+
+
 def makePolyCoords(xarr, yarr, zpnt=None, triangles=False):
     '''
     Makes an array for coordinates suitable for building quadrilateral
@@ -105,8 +348,187 @@ def makeRecord(ID, coords, geomtype, props):
     return record
 
 
+INTERPOLATION_ENGINES = ('csa', 'nearest', 'idw', 'linear')
+
+
+def _tree_interpolator(x, y, z, engine, k=8, power=2):
+    '''
+    Builds a function that estimates `z` at an (N x 2) array of points
+    from a KD-tree (or, for `engine='linear'`, a Delaunay
+    triangulation) of the x-y-z data.
+    '''
+
+    from scipy import interpolate, spatial
+
+    xy = np.column_stack([x, y])
+    if engine == 'linear':
+        return interpolate.LinearNDInterpolator(xy, z)
+
+    tree = spatial.cKDTree(xy)
+    if engine == 'nearest':
+        def interp(points):
+            dist, idx = tree.query(points, k=1)
+            return z[idx]
+
+    elif engine == 'idw':
+        k = min(k, z.shape[0])
+
+        def interp(points):
+            dist, idx = tree.query(points, k=k)
+            if k == 1:
+                dist, idx = dist[:, None], idx[:, None]
+
+            # points that coincide with the data take its value
+            exact = dist[:, 0] == 0
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / dist ** power
+            weights[exact] = (dist[exact] == 0).astype(float)
+            return (weights * z[idx]).sum(axis=1) / weights.sum(axis=1)
+
+    else:
+        raise ValueError('engine must be one of {}'.format(
+            INTERPOLATION_ENGINES))
+
+    return interp
+
+
+def _interpolate_in_chunks(interp, x_points, y_points, chunksize=100000,
+                           nthreads=None):
+    '''
+    Evaluates `interp` at the valid x-y points in chunks spread over a
+    pool of threads. Invalid (NaN or masked) points get NaN.
+    '''
+
+    xx = np.ma.filled(np.ma.asarray(x_points, dtype=float), np.nan).ravel()
+    yy = np.ma.filled(np.ma.asarray(y_points, dtype=float), np.nan).ravel()
+    valid = ~(np.isnan(xx) | np.isnan(yy))
+    points = np.column_stack([xx[valid], yy[valid]])
+
+    chunks = [slice(start, start + chunksize)
+              for start in range(0, points.shape[0], chunksize)]
+    if len(chunks) > 1:
+        pool = ThreadPool(nthreads)
+        try:
+            results = pool.map(lambda chunk: interp(points[chunk]), chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [interp(points[chunk]) for chunk in chunks]
+
+    elev = np.empty(xx.shape)
+    elev.fill(np.nan)
+    if results:
+        elev[valid] = np.concatenate(results)
+
+    return elev.reshape(np.shape(x_points))
+
+
+def _tile_ranges(n, ntiles, overlap):
+    '''(start, stop) of `ntiles` blocks of `n` rows (or columns), each
+    extended by `overlap` on both sides'''
+    edges = np.linspace(0, n, ntiles + 1).astype(int)
+    return [(max(0, start - overlap), min(n, stop + overlap))
+            for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+def _tile_weights(start, stop, n, overlap):
+    '''Blending weights of a tile's rows (or columns): 1 in the middle,
+    ramping down over `overlap` rows toward edges shared with another
+    tile'''
+    idx = np.arange(start, stop, dtype=float)
+    dist = np.empty(idx.shape)
+    dist.fill(np.inf)
+    if start > 0:
+        dist = np.minimum(dist, idx - start)
+    if stop < n:
+        dist = np.minimum(dist, stop - 1 - idx)
+    return np.minimum(1.0, (dist + 1) / (overlap + 1))
+
+
+def _interpolate_tile(job):
+    '''Fits and evaluates a single tile in a worker process'''
+    x, y, z, xx, yy, engine, engine_kws = job
+    if z.shape[0] == 0:
+        return np.nan * xx
+
+    if engine == 'csa':
+        return np.asarray(pygridgen.csa(x, y, z)(xx, yy), dtype=float)
+
+    interp = _tree_interpolator(x, y, z, engine, **engine_kws)
+    return interp(np.column_stack([xx, yy]))
+
+
+def _interpolate_tiled(x, y, z, x_points, y_points, engine, tiles,
+                       overlap=8, buffer=0.25, nprocs=None, **engine_kws):
+    '''
+    Splits the locations into overlapping blocks of rows and columns
+    and interpolates each one in a pool of processes from only the
+    nearby points. The overlapping parts of the blocks are blended with
+    linearly ramped weights so that the seams don't show.
+    '''
+
+    xx = np.atleast_2d(np.ma.filled(np.ma.asarray(x_points, dtype=float),
+                                    np.nan))
+    yy = np.atleast_2d(np.ma.filled(np.ma.asarray(y_points, dtype=float),
+                                    np.nan))
+    ny, nx = xx.shape
+    if np.isscalar(tiles):
+        tiles = (tiles, tiles)
+
+    jobs = []
+    places = []
+    for r0, r1 in _tile_ranges(ny, tiles[0], overlap):
+        for c0, c1 in _tile_ranges(nx, tiles[1], overlap):
+            bx = xx[r0:r1, c0:c1]
+            by = yy[r0:r1, c0:c1]
+            valid = ~(np.isnan(bx) | np.isnan(by))
+            if not valid.any():
+                continue
+
+            # the points in (and around) the tile's bounding box
+            xmin, xmax = bx[valid].min(), bx[valid].max()
+            ymin, ymax = by[valid].min(), by[valid].max()
+            pad = buffer * max(xmax - xmin, ymax - ymin)
+            near = (
+                (x >= xmin - pad) & (x <= xmax + pad) &
+                (y >= ymin - pad) & (y <= ymax + pad)
+            )
+            jobs.append((x[near], y[near], z[near], bx[valid], by[valid],
+                         engine, engine_kws))
+            places.append((r0, r1, c0, c1, valid))
+
+    if nprocs == 1 or len(jobs) < 2:
+        results = [_interpolate_tile(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            results = pool.map(_interpolate_tile, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    total = np.zeros(xx.shape)
+    weight = np.zeros(xx.shape)
+    for (r0, r1, c0, c1, valid), elev in zip(places, results):
+        w = np.outer(_tile_weights(r0, r1, ny, overlap),
+                     _tile_weights(c0, c1, nx, overlap))[valid]
+        w[np.isnan(elev)] = 0
+        total[r0:r1, c0:c1][valid] += w * np.nan_to_num(elev)
+        weight[r0:r1, c0:c1][valid] += w
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        elev = np.where(weight > 0, total / weight, np.nan)
+
+    return elev.reshape(np.shape(x_points))
+
+
+@profiling.traced('misc.interpolateBathymetry', count='x_points')
 def interpolateBathymetry(bathy, x_points, y_points,
-                          xcol='x', ycol='y', zcol='z'):
+                          xcol='x', ycol='y', zcol='z', engine='csa',
+                          chunksize=100000, nthreads=None, tiles=None,
+                          overlap=8, buffer=0.25, nprocs=None, thin=None,
+                          thin_factor=0.5, **engine_kws):
     '''
     Interpolates x-y-z point data onto the grid of a Gridgen object.
     Matplotlib's nearest-neighbor interpolation schema is used to
@@ -118,10 +540,49 @@ def interpolateBathymetry(bathy, x_points, y_points,
         The bathymetry data stored as x-y-z points in a DataFrame.
     [x|y]_points : numpy arrays
         The x, y locations onto which the bathymetry will be
-        interpolated.
+        interpolated, e.g., the nodes (`ModelGrid.xn`, `.yn`) or cells
+        (`ModelGrid.xc`, `.yc`) of a grid.
     xcol/ycol/zcol : optional strings
         Column names for each of the quantities defining the elevation
         pints. Defaults are "x/y/z".
+    engine : optional string (default = 'csa')
+        The interpolation method:
+          - 'csa': cubic spline approximation (`pygridgen.csa`)
+          - 'nearest': value of the nearest point
+          - 'idw': inverse distance weighting of the `k` nearest
+            points
+          - 'linear': linear interpolation on a Delaunay triangulation
+            of the points (NaN outside of their convex hull)
+        All but 'csa' require scipy.
+    chunksize : optional int (default = 100000)
+        Number of locations handed to each thread at a time. Not used
+        by 'csa'.
+    nthreads : optional int or None (default)
+        Number of threads. Defaults to the number of CPUs.
+    tiles : optional int, tuple of ints, or None (default)
+        If provided, the (2D) locations are split into this many blocks
+        of rows and columns (e.g., ``(4, 4)``). Each block is fit to
+        only the nearby points in a separate process.
+    overlap : optional int (default = 8)
+        Number of rows and columns that neighboring tiles share. The
+        tiles' estimates are blended across this band.
+    buffer : optional float (default = 0.25)
+        Fraction of a tile's extent by which its bounding box is grown
+        when selecting its points.
+    nprocs : optional int or None (default)
+        Number of processes used for the tiles. Defaults to the number
+        of CPUs.
+    thin : optional string or None (default)
+        If provided, the points are first thinned to the local spacing
+        of `x_points` and `y_points` (times `thin_factor`) by reducing
+        them with 'mean', 'median', or 'min'. See `thinBathymetry`.
+    thin_factor : optional float (default = 0.5)
+        Size of the thinning bins relative to the local spacing. The
+        number of points dropped is logged at the INFO level by the
+        "pygridtools.misc" logger (and recorded as the "dropped" field
+        of the "misc.interpolateBathymetry.thin" span).
+    **engine_kws : optional kwargs
+        For 'idw', `k` (default = 8) and `power` (default = 2).
 
     Returns
     -------
@@ -134,6 +595,10 @@ def interpolateBathymetry(bathy, x_points, y_points,
 
     '''
 
+    if engine not in INTERPOLATION_ENGINES:
+        raise ValueError('engine must be one of {}'.format(
+            INTERPOLATION_ENGINES))
+
     if bathy is None:
         elev = np.zeros(x_points.shape)
 
@@ -159,17 +624,497 @@ def interpolateBathymetry(bathy, x_points, y_points,
 
     gridbathy = bathy[grididx].dropna(how='any')
 
+    if thin is not None:
+        gridbathy = _thin_to_grid(gridbathy, x_points, y_points, thin,
+                                  thin_factor, xcol=xcol, ycol=ycol,
+                                  zcol=zcol)
+
+    if tiles is not None:
+        elev = _interpolate_tiled(
+            gridbathy[xcol].values, gridbathy[ycol].values,
+            gridbathy[zcol].values, x_points, y_points, engine, tiles,
+            overlap=overlap, buffer=buffer, nprocs=nprocs, **engine_kws
+        )
+        if isinstance(x_points, np.ma.MaskedArray):
+            elev = np.ma.masked_invalid(elev)
+
+        return elev
+
+    if engine != 'csa':
+        interp = _tree_interpolator(
+            gridbathy[xcol].values, gridbathy[ycol].values,
+            gridbathy[zcol].values, engine, **engine_kws
+        )
+        elev = _interpolate_in_chunks(interp, x_points, y_points,
+                                      chunksize=chunksize, nthreads=nthreads)
+        if isinstance(x_points, np.ma.MaskedArray):
+            elev = np.ma.masked_invalid(elev)
+
+        return elev
+
+    # use cubic-spline approximation to interpolate the grid
+    csa = pygridgen.csa(gridbathy[xcol], gridbathy[ycol], gridbathy[zcol])
+    return _evaluate_csa(csa, x_points, y_points)
+
+
+def _thin_to_grid(bathy, x_points, y_points, how, factor, xcol='x',
+                  ycol='y', zcol='z'):
+    '''
+    `thinBathymetry` at the grid's local spacing. The number of points
+    dropped is logged (at INFO) and recorded in the "dropped" field of
+    a profiling span.
+    '''
+    with profiling.span('misc.interpolateBathymetry.thin',
+                        count=bathy.shape[0]) as s:
+        thinned, dropped = thinBathymetry(
+            bathy, x_points=x_points, y_points=y_points, factor=factor,
+            how=how, xcol=xcol, ycol=ycol, zcol=zcol
+        )
+        s['dropped'] = dropped
+
+    logger.info('thinning (%s) dropped %d of %d bathymetry points', how,
+                dropped, bathy.shape[0])
+    return thinned
+
+
+def _evaluate_csa(csa, x_points, y_points):
     # fill in NaNs with something outside of the bounds
     xx = x_points.copy()
     yy = y_points.copy()
     xx[np.isnan(x_points)] = x_points.max() + 5
     yy[np.isnan(y_points)] = y_points.max() + 5
-
-    # use cubic-spline approximation to interpolate the grid
-    csa = pygridgen.csa(gridbathy[xcol], gridbathy[ycol], gridbathy[zcol])
     return csa(xx, yy)
 
-        # linear interpol
+
+def _local_spacing(x_points, y_points):
+    '''Typical distance between each (2D) grid point and its neighbors'''
+    X = np.ma.filled(np.ma.asarray(x_points, dtype=float), np.nan)
+    Y = np.ma.filled(np.ma.asarray(y_points, dtype=float), np.nan)
+
+    # average length of the edges on either side of each point in each
+    # direction (missing edges are NaN)
+    edges = []
+    for axis in (0, 1):
+        length = np.hypot(np.diff(X, axis=axis), np.diff(Y, axis=axis))
+        both = np.empty((2,) + X.shape)
+        both.fill(np.nan)
+        if axis == 0:
+            both[0, 1:], both[1, :-1] = length, length
+        else:
+            both[0, :, 1:], both[1, :, :-1] = length, length
+        edges.append(both)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        spacing = np.sqrt(np.nanmean(edges[0], axis=0) *
+                          np.nanmean(edges[1], axis=0))
+
+    return spacing
+
+
+@profiling.traced('misc.thinBathymetry', count='bathy')
+def thinBathymetry(bathy, resolution=None, x_points=None, y_points=None,
+                   factor=0.5, how='mean', xcol='x', ycol='y', zcol='z'):
+    '''
+    Reduces dense (or duplicated) bathymetry points to one point per
+    bin so that interpolation cost follows the grid's resolution
+    instead of the survey's.
+
+    Parameters
+    ----------
+    bathy : pandas.DataFrame
+        The bathymetry data stored as x-y-z points.
+    resolution : optional float or None (default)
+        Size of the (square) bins. If None, the bins near each point
+        are `factor` times the local spacing of `x_points` and
+        `y_points`.
+    [x|y]_points : optional 2D numpy arrays
+        The nodes or cells of the grid. Required when `resolution` is
+        None.
+    factor : optional float (default = 0.5)
+        Size of the bins relative to the grid's local spacing.
+    how : optional string (default = 'mean')
+        How the points in each bin are reduced:
+          - 'mean': the average of their coordinates and elevations
+          - 'median': their average coordinates and median elevation
+          - 'min': the point with the lowest elevation
+    xcol/ycol/zcol : optional strings
+        Column names for each of the quantities defining the elevation
+        pints. Defaults are "x/y/z".
+
+    Returns
+    -------
+    thinned : pandas.DataFrame
+        The reduced x-y-z points.
+    dropped : int
+        The number of points removed (including those with missing
+        values).
+
+    Notes
+    -----
+    Locally sized bins are rounded down to the smallest bin size times
+    a power of two so that neighboring bins of the same size line up.
+    Finding the local spacing requires scipy.
+
+    '''
+
+    if how not in ('mean', 'median', 'min'):
+        raise ValueError("how must be 'mean', 'median', or 'min'")
+
+    original = bathy.shape[0]
+    bathy = bathy[[xcol, ycol, zcol]].dropna(how='any')
+    bathy = bathy.reset_index(drop=True)
+    x = bathy[xcol].values
+    y = bathy[ycol].values
+
+    if resolution is not None:
+        size = np.empty(x.shape)
+        size.fill(float(resolution))
+
+    elif x_points is not None and y_points is not None:
+        from scipy import spatial
+
+        spacing = _local_spacing(x_points, y_points)
+        X = np.ma.filled(np.ma.asarray(x_points, dtype=float), np.nan)
+        Y = np.ma.filled(np.ma.asarray(y_points, dtype=float), np.nan)
+        valid = np.isfinite(X) & np.isfinite(Y) & np.isfinite(spacing)
+        tree = spatial.cKDTree(np.column_stack([X[valid], Y[valid]]))
+        dist, nearest = tree.query(np.column_stack([x, y]), k=1)
+        size = factor * spacing[valid][nearest]
+
+    else:
+        raise ValueError('either `resolution` or `x_points` and `y_points` '
+                         'must be provided')
+
+    if not np.all(np.isfinite(size) & (size > 0)):
+        raise ValueError('bin sizes must be positive and finite (check '
+                         '`resolution` or the spacing of the grid)')
+
+    if x.shape[0] == 0:
+        return bathy, original
+
+    # power-of-two multiples of the smallest bin
+    base = size.min()
+    level = np.floor(np.log2(size / base)).astype(np.int64)
+    size = base * 2.0 ** level
+    groups = bathy.groupby([
+        level,
+        np.floor(x / size).astype(np.int64),
+        np.floor(y / size).astype(np.int64),
+    ])
+
+    if how == 'mean':
+        thinned = groups.mean()
+    elif how == 'median':
+        thinned = groups.agg({xcol: 'mean', ycol: 'mean', zcol: 'median'})
+    else:
+        thinned = bathy.loc[groups[zcol].idxmin()]
+
+    thinned = thinned[[xcol, ycol, zcol]].reset_index(drop=True)
+    return thinned, original - thinned.shape[0]
+
+
+def raster_window(transform, shape, bbox, pad=1):
+    '''
+    Rows and columns of a raster covering a bounding box.
+
+    Parameters
+    ----------
+    transform : tuple
+        GDAL-style geotransform of the raster:
+        ``(x_origin, dx, 0, y_origin, 0, dy)``.
+    shape : tuple of ints
+        Number of rows and columns in the raster.
+    bbox : tuple
+        The ``(xmin, ymin, xmax, ymax)`` extent to cover.
+    pad : optional int (default = 1)
+        Extra rows and columns on each side (one is enough for bilinear
+        sampling).
+
+    Returns
+    -------
+    rows, cols : slices
+
+    '''
+
+    x0, dx, _, y0, _, dy = transform
+    xmin, ymin, xmax, ymax = bbox
+    cols = sorted([(xmin - x0) / dx, (xmax - x0) / dx])
+    rows = sorted([(ymin - y0) / dy, (ymax - y0) / dy])
+
+    def _slice(lower, upper, n):
+        start = int(np.clip(np.floor(lower) - pad, 0, n))
+        stop = int(np.clip(np.ceil(upper) + pad, 0, n))
+        return slice(start, max(start, stop))
+
+    return (_slice(rows[0], rows[1], shape[0]),
+            _slice(cols[0], cols[1], shape[1]))
+
+
+class RasterBathymetry(object):
+    '''
+    Elevations on a regular raster (e.g., a DEM) that can be sampled
+    directly onto the nodes or cells of a grid.
+
+    Parameters
+    ----------
+    values : 2D numpy array
+        Elevation of each pixel, the first row being at `y_origin`.
+        NaNs are treated as missing.
+    transform : tuple
+        GDAL-style geotransform of the raster:
+        ``(x_origin, dx, 0, y_origin, 0, dy)``, where the origin is the
+        outer corner of the first pixel. `dy` is typically negative.
+        Rotated rasters are not supported.
+
+    See Also
+    --------
+    io.loadRasterBathymetry
+
+    '''
+
+    def __init__(self, values, transform):
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 2:
+            raise ValueError('raster values must be a 2D array')
+
+        transform = tuple(float(t) for t in transform)
+        if len(transform) != 6:
+            raise ValueError('transform must have six values')
+
+        if transform[2] != 0 or transform[4] != 0:
+            raise ValueError('rotated rasters are not supported')
+
+        self.values = values
+        self.transform = transform
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def bbox(self):
+        '''``(xmin, ymin, xmax, ymax)`` extent of the raster'''
+        x0, dx, _, y0, _, dy = self.transform
+        xs = sorted([x0, x0 + dx * self.shape[1]])
+        ys = sorted([y0, y0 + dy * self.shape[0]])
+        return (xs[0], ys[0], xs[1], ys[1])
+
+    def window(self, bbox):
+        '''The part of the raster covering a bounding box'''
+        rows, cols = raster_window(self.transform, self.shape, bbox)
+        x0, dx, _, y0, _, dy = self.transform
+        transform = (x0 + cols.start * dx, dx, 0, y0 + rows.start * dy, 0, dy)
+        return RasterBathymetry(self.values[rows, cols], transform)
+
+    @profiling.traced('misc.RasterBathymetry.sample', count='x_points')
+    def sample(self, x_points, y_points):
+        '''
+        Bilinearly interpolates the pixel centers onto new locations
+        (e.g., `ModelGrid.xn` and `.yn`, or `.xc` and `.yc`).
+
+        Returns
+        -------
+        elev : numpy array
+            Same shape as `x_points`. NaN (or masked, if `x_points` is
+            masked) outside of the raster or next to missing pixels.
+
+        '''
+
+        x0, dx, _, y0, _, dy = self.transform
+        nrows, ncols = self.shape
+        xx = np.ma.filled(np.ma.asarray(x_points, dtype=float), np.nan)
+        yy = np.ma.filled(np.ma.asarray(y_points, dtype=float), np.nan)
+
+        # fractional positions relative to the pixel centers, with the
+        # outer half pixels clamped to the edge
+        with np.errstate(invalid='ignore'):
+            col = (xx - x0) / dx - 0.5
+            row = (yy - y0) / dy - 0.5
+            inside = (
+                (col >= -0.5) & (col <= ncols - 0.5) &
+                (row >= -0.5) & (row <= nrows - 0.5)
+            )
+        col = np.clip(np.where(inside, col, 0), 0, ncols - 1)
+        row = np.clip(np.where(inside, row, 0), 0, nrows - 1)
+
+        c0 = np.minimum(np.floor(col).astype(int), max(ncols - 2, 0))
+        r0 = np.minimum(np.floor(row).astype(int), max(nrows - 2, 0))
+        c1 = np.minimum(c0 + 1, ncols - 1)
+        r1 = np.minimum(r0 + 1, nrows - 1)
+        fc = col - c0
+        fr = row - r0
+
+        v = self.values
+        elev = (
+            v[r0, c0] * (1 - fr) * (1 - fc) + v[r0, c1] * (1 - fr) * fc +
+            v[r1, c0] * fr * (1 - fc) + v[r1, c1] * fr * fc
+        )
+        elev[~inside] = np.nan
+
+        if isinstance(x_points, np.ma.MaskedArray):
+            elev = np.ma.masked_invalid(elev)
+
+        return elev
+
+
+# fitted interpolators shared by all `Bathymetry` objects, most
+# recently used last
+_FITTED = OrderedDict()
+FITTED_CACHE_SIZE = 8
+
+
+class Bathymetry(object):
+    '''
+    Survey points that are fit once and then interpolated onto any
+    number of grids, e.g., while iterating on a grid's design.
+
+    Parameters
+    ----------
+    bathy : pandas.DataFrame
+        The bathymetry data stored as x-y-z points.
+    xcol/ycol/zcol : optional strings
+        Column names for each of the quantities defining the elevation
+        pints. Defaults are "x/y/z".
+    bbox : optional tuple or None (default)
+        If provided, only the points inside of this
+        ``(xmin, ymin, xmax, ymax)`` box are kept. Use it to clip a
+        large survey to the area that any of the grids will cover.
+
+    Notes
+    -----
+    Fitted interpolators are kept in a least-recently-used cache of
+    `FITTED_CACHE_SIZE` entries that is keyed on a hash of the points
+    and the engine's parameters, so new objects built from the same
+    survey reuse earlier fits. Every grid is interpolated from the same
+    fit of all of the (kept) points, whatever its extent.
+
+    See Also
+    --------
+    interpolateBathymetry
+
+    '''
+
+    def __init__(self, bathy, xcol='x', ycol='y', zcol='z', bbox=None):
+        bathy = bathy[[xcol, ycol, zcol]].dropna(how='any')
+        if bbox is not None:
+            xmin, ymin, xmax, ymax = bbox
+            bathy = bathy[
+                (bathy[xcol] >= xmin) & (bathy[xcol] <= xmax) &
+                (bathy[ycol] >= ymin) & (bathy[ycol] <= ymax)
+            ]
+
+        self.x = np.ascontiguousarray(bathy[xcol].values, dtype=float)
+        self.y = np.ascontiguousarray(bathy[ycol].values, dtype=float)
+        self.z = np.ascontiguousarray(bathy[zcol].values, dtype=float)
+        self._hash = None
+
+    @property
+    def hash(self):
+        '''Hex digest of the x-y-z points'''
+        if self._hash is None:
+            sha = hashlib.sha1()
+            for values in (self.x, self.y, self.z):
+                sha.update(values.tobytes())
+            self._hash = sha.hexdigest()
+        return self._hash
+
+    def fit(self, engine='csa', **engine_kws):
+        '''
+        The interpolator of the points for an engine (see
+        `interpolateBathymetry`), fitting it only if it is not already
+        cached. Only actual fits are timed (the "misc.Bathymetry.fit"
+        span).
+        '''
+        if engine not in INTERPOLATION_ENGINES:
+            raise ValueError('engine must be one of {}'.format(
+                INTERPOLATION_ENGINES))
+
+        if engine == 'csa':
+            # csa has no options (as in `interpolateBathymetry`)
+            engine_kws = {}
+
+        key = (self.hash, engine, tuple(sorted(engine_kws.items())))
+        if key in _FITTED:
+            _FITTED[key] = _FITTED.pop(key)
+
+        else:
+            with profiling.span('misc.Bathymetry.fit', engine=engine,
+                                count=self.x.shape[0]):
+                if engine == 'csa':
+                    interp = pygridgen.csa(self.x, self.y, self.z)
+                else:
+                    interp = _tree_interpolator(self.x, self.y, self.z,
+                                                engine, **engine_kws)
+
+            _FITTED[key] = interp
+            while len(_FITTED) > FITTED_CACHE_SIZE:
+                _FITTED.popitem(last=False)
+
+        return _FITTED[key]
+
+    def interpolate(self, x_points, y_points, engine='csa',
+                    chunksize=100000, nthreads=None, tiles=None,
+                    overlap=8, buffer=0.25, nprocs=None, thin=None,
+                    thin_factor=0.5, **engine_kws):
+        '''
+        Interpolates the points onto new locations (e.g., `x_rho` and
+        `y_rho` of a Gridgen object). See `interpolateBathymetry` for
+        the parameters.
+
+        The interpolator is fit once for the whole survey and reused
+        for every grid. With `tiles`, each tile is fit (in a worker
+        process, without caching) from only the points near it. With
+        `thin`, the points inside of the locations' bounding box are
+        thinned to their spacing and fit again for each new grid.
+        '''
+        if engine not in INTERPOLATION_ENGINES:
+            raise ValueError('engine must be one of {}'.format(
+                INTERPOLATION_ENGINES))
+
+        survey = self
+        if thin is not None:
+            inside = self._within(x_points, y_points)
+            survey = Bathymetry(_thin_to_grid(
+                pandas.DataFrame({'x': self.x[inside], 'y': self.y[inside],
+                                  'z': self.z[inside]}),
+                x_points, y_points, thin, thin_factor
+            ))
+
+        if tiles is not None:
+            elev = _interpolate_tiled(
+                survey.x, survey.y, survey.z, x_points, y_points, engine,
+                tiles, overlap=overlap, buffer=buffer, nprocs=nprocs,
+                **engine_kws
+            )
+
+        else:
+            interp = survey.fit(engine, **engine_kws)
+            if engine == 'csa':
+                return _evaluate_csa(interp, x_points, y_points)
+
+            elev = _interpolate_in_chunks(interp, x_points, y_points,
+                                          chunksize=chunksize,
+                                          nthreads=nthreads)
+
+        if isinstance(x_points, np.ma.MaskedArray):
+            elev = np.ma.masked_invalid(elev)
+
+        return elev
+
+    def _within(self, x_points, y_points):
+        '''Mask of the points inside of the locations' bounding box'''
+        xx = np.ma.filled(np.ma.asarray(x_points, dtype=float), np.nan)
+        yy = np.ma.filled(np.ma.asarray(y_points, dtype=float), np.nan)
+        return (
+            (self.x >= np.nanmin(xx)) & (self.x <= np.nanmax(xx)) &
+            (self.y >= np.nanmin(yy)) & (self.y <= np.nanmax(yy))
+        )
+
+    @staticmethod
+    def clear_cache():
+        '''Drops all of the fitted interpolators'''
+        _FITTED.clear()
 
 
 def padded_stack(a, b, how='vert', where='+', shift=0, padval=np.nan):
@@ -279,6 +1224,7 @@ def padded_stack(a, b, how='vert', where='+', shift=0, padval=np.nan):
     return stacked
 
 
+@profiling.traced('misc.make_gefdc_cells', count='node_mask')
 def make_gefdc_cells(node_mask, cell_mask=None, triangles=False):
     '''
     Take an array defining the nodes as wet (1) or dry (0) create the
@@ -291,7 +1237,8 @@ def make_gefdc_cells(node_mask, cell_mask=None, triangles=False):
         (unmasked) grid.
     cell_mask : optional numpy bool array (N-1 x M-1) or None (default)
         Bool array specifying if a cell should be masked (e.g. due to
-        being an island or something like that).
+        being an island or something like that). If None, no cells are
+        masked.
     triangles : optional bool (default = False)
         Currently not implemented. Will eventually enable the writting of
         triangular cells when True.
@@ -303,12 +1250,10 @@ def make_gefdc_cells(node_mask, cell_mask=None, triangles=False):
 
     '''
 
-    triangle_cells = {
-        0: 3,
-        1: 2,
-        3: 1,
-        2: 4,
-    }
+    # cell value for triangles, indexed by the position of the dry node
+    # in the flattened 2x2 quad (upper left, upper right, lower left,
+    # lower right)
+    triangle_cells = np.array([3, 2, 4, 1])
     land_cell = 0
     water_cell = 5
     bank_cell = 9
@@ -317,58 +1262,43 @@ def make_gefdc_cells(node_mask, cell_mask=None, triangles=False):
     if triangles:
         warnings.warn('triangles are experimental')
 
+    node_mask = np.asarray(node_mask)
+    if cell_mask is None:
+        cell_mask = np.zeros([n - 1 for n in node_mask.shape], dtype=bool)
+
     # define the initial cells with everything labeled as a bank
     ny, nx = cell_mask.shape
     cells = np.zeros((ny+2, nx+2), dtype=int) + bank_cell
 
-    # loop through each *node*
-    for jj in range(1, ny+1):
-        for ii in range(1, nx+1):
-            # pull out the 4 nodes defining the cell (call it a quad)
-            quad = node_mask[jj-1:jj+1, ii-1:ii+1]
-            n_wet = quad.sum()
-
-            # anything that's masked is a "bank"
-            if not cell_mask[jj-1, ii-1]:
-                # if all 4 nodes are wet (=1), then the cell is 5
-                if n_wet == 4:
-                    cells[jj, ii] = water_cell
-
-                # if only 3  are wet, might be a triangle, but...
-                # this ignored since we already raised an error
-                elif n_wet == 3 and triangles:
-                    dry_node = np.argmin(quad.flatten())
-                    cells[jj, ii] = triangle_cells[dry_node]
-
-            # otherwise it's just a bank
-            else:
-                cells[jj, ii] = bank_cell
+    # the 4 nodes defining each cell (call it a quad), stacked along
+    # the first axis in the same order as the flattened quad
+    node_mask = node_mask[:ny+1, :nx+1]
+    quads = np.array([
+        node_mask[:-1, :-1], node_mask[:-1, 1:],
+        node_mask[1:, :-1], node_mask[1:, 1:],
+    ])
+    n_wet = quads.sum(axis=0)
 
+    # anything that's masked is a "bank"
+    unmasked = ~np.asarray(cell_mask, dtype=bool)
+    interior = cells[1:-1, 1:-1]
+
+    # if all 4 nodes are wet (=1), then the cell is 5
+    interior[unmasked & (n_wet == 4)] = water_cell
+
+    # if only 3 are wet, might be a triangle
+    if triangles:
+        is_tri = unmasked & (n_wet == 3)
+        dry_node = np.argmin(quads[:, is_tri], axis=0)
+        interior[is_tri] = triangle_cells[dry_node]
+
+    # cells whose 3x3 neighborhood is entirely bank are land
+    shift = 3
     padded_cells = np.pad(cells, 1, mode='constant', constant_values=bank_cell)
-    for cj in range(cells.shape[0]):
-        for ci in range(cells.shape[1]):
-            shift = 3
-            total = np.sum(padded_cells[cj:cj+shift, ci:ci+shift])
-            if total == bank_cell * shift**2:
-                cells[cj, ci] = land_cell
-
-    nrows = cells.shape[0]
-    ncols = cells.shape[1]
-
-    # nchunks = np.ceil(ncols / maxcols)
-    # if ncols > maxcols:
-    #     final_cells = np.zeros((nrows*nchunks, maxcols), dtype=int)
-    #     for n in np.arange(nchunks):
-    #         col_start = n * maxcols
-    #         col_stop = (n+1) * maxcols
-
-    #         row_start = n * nrows
-    #         row_stop = (n+1) * nrows
-
-    #         cells_to_move = cells[:, col_start:col_stop]
-    #         final_cells[row_start:row_stop, 0:cells_to_move.shape[1]] = cells_to_move
-    # else:
-    #     final_cells = cells.copy()
-
-    final_cells = cells.copy()
-    return final_cells
+    total = np.zeros_like(cells)
+    for dj in range(shift):
+        for di in range(shift):
+            total += padded_cells[dj:dj+ny+2, di:di+nx+2]
+
+    cells[total == bank_cell * shift**2] = land_cell
+    return cells
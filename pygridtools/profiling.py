@@ -0,0 +1,364 @@
+'''
+Lightweight timing (and optional peak memory) of the stages of the
+grid pipeline.
+
+Stages of `core`, `misc`, and `io` are wrapped in named spans. Nothing
+is measured until sinks are enabled, and a disabled span is a single
+shared object that does nothing:
+
+    >>> from pygridtools import profiling
+    >>> collector = profiling.MemoryCollector()
+    >>> with profiling.profile(collector, profiling.LoggingSink()):
+    ...     grid = makeGrid(...)
+    >>> collector.to_dataframe()
+
+Each finished span is handed to every sink as a dict with its "name",
+"start" (epoch seconds), "wall" (seconds), "peak_memory" (bytes
+allocated above the level at the start of the span, or None), "depth"
+and "parent" (name of the enclosing span), and any extra fields
+(e.g., "count", the number of elements processed).
+
+'''
+
+import json
+import time
+import inspect
+import logging
+import warnings
+import threading
+import functools
+
+import numpy
+
+
+# the active sinks. An empty tuple means that profiling is disabled.
+_SINKS = ()
+_MEMORY = False
+_STARTED_TRACING = False
+_local = threading.local()
+
+# imported by `enable(memory=True)` (it needs python 3.4 or later)
+tracemalloc = None
+
+# python 2.7 has neither
+_clock = getattr(time, 'perf_counter', time.time)
+_signature = getattr(inspect, 'signature', None)
+
+
+class _NullSpan(object):
+    '''Stand-in for a span when profiling is disabled'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(dict):
+    '''A running span. Extra fields can be set while it is open.'''
+
+    def __init__(self, name, fields):
+        dict.__init__(self, fields)
+        self['name'] = name
+        self._base = None
+        self._peak = 0
+        self._start_peak = 0
+
+    def _saw(self, current, peak):
+        # before python 3.9 the peak can't be reset, so a peak that
+        # isn't new is from before this span started
+        if not hasattr(tracemalloc, 'reset_peak') and \
+                peak <= self._start_peak:
+            peak = current
+        self._peak = max(self._peak, peak)
+
+    def __enter__(self):
+        stack = _stack()
+        self['depth'] = len(stack)
+        self['parent'] = stack[-1]['name'] if stack else None
+        if _MEMORY:
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]._saw(current, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._base = self._peak = current
+            self._start_peak = peak
+
+        stack.append(self)
+        self['start'] = time.time()
+        self._t0 = _clock()
+        return self
+
+    def __exit__(self, *exc):
+        self['wall'] = _clock() - self._t0
+        stack = _stack()
+        stack.pop()
+        if self._base is not None and tracemalloc.is_tracing():
+            self._saw(*tracemalloc.get_traced_memory())
+            self['peak_memory'] = self._peak - self._base
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, self._peak)
+        else:
+            self['peak_memory'] = None
+
+        record = dict(self)
+        for sink in _SINKS:
+            sink(record)
+        return False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def span(name, **fields):
+    '''
+    Context manager that times the code inside of it.
+
+    Parameters
+    ----------
+    name : string
+        Name of the stage, e.g., "io.saveGridShapefile".
+    **fields
+        Extra values stored with the span, e.g., ``count=x.size``.
+        More can be set on the object returned by the ``with``
+        statement (``s['count'] = n``).
+
+    '''
+    if not _SINKS:
+        return _NULL_SPAN
+    return _Span(name, fields)
+
+
+def traced(name, count=None):
+    '''
+    Decorator that wraps every call to a function in a `span`.
+
+    Parameters
+    ----------
+    name : string
+        Name of the span.
+    count : optional string or function
+        The "count" of the span: either the name of an argument (the
+        size of an array or the length of anything else) or a function
+        called with the arguments.
+
+    '''
+    def decorator(fxn):
+        if isinstance(count, str):
+            if _signature is not None:
+                signature = _signature(fxn)
+
+                def get_argument(*args, **kwargs):
+                    return signature.bind(*args, **kwargs).arguments[count]
+            else:
+                def get_argument(*args, **kwargs):
+                    return inspect.getcallargs(fxn, *args, **kwargs)[count]
+
+            def get_count(*args, **kwargs):
+                value = get_argument(*args, **kwargs)
+                if isinstance(value, numpy.ndarray):
+                    return value.size
+                return len(value)
+        else:
+            get_count = count
+
+        @functools.wraps(fxn)
+        def wrapper(*args, **kwargs):
+            if not _SINKS:
+                return fxn(*args, **kwargs)
+
+            fields = {}
+            if get_count is not None:
+                fields['count'] = get_count(*args, **kwargs)
+            with _Span(name, fields):
+                return fxn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(*sinks, **kwargs):
+    '''
+    Starts sending spans to `sinks`.
+
+    Parameters
+    ----------
+    *sinks : callables
+        Each is called with every finished span (a dict).
+    memory : optional bool (default = False)
+        Also record each span's peak memory with `tracemalloc`, which
+        slows everything down noticeably. Requires Python 3.4 or
+        later, and before Python 3.9 the peak of a span is only
+        recorded when it exceeds every earlier peak.
+
+    '''
+    global _SINKS, _MEMORY, _STARTED_TRACING, tracemalloc
+    memory = kwargs.pop('memory', False)
+    if kwargs:
+        raise TypeError('unexpected arguments: {}'.format(sorted(kwargs)))
+
+    if memory and tracemalloc is None:
+        try:
+            import tracemalloc
+        except ImportError:
+            warnings.warn('memory profiling requires tracemalloc '
+                          '(Python 3.4 or later)')
+            memory = False
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _STARTED_TRACING = True
+    _SINKS = tuple(sinks)
+    _MEMORY = memory
+
+
+def disable():
+    '''Stops profiling (and memory tracing started by `enable`)'''
+    global _SINKS, _MEMORY, _STARTED_TRACING
+    if _STARTED_TRACING:
+        tracemalloc.stop()
+        _STARTED_TRACING = False
+    _SINKS = ()
+    _MEMORY = False
+
+
+class profile(object):
+    '''
+    Context manager version of `enable`. Whatever was enabled before
+    is restored on the way out.
+    '''
+
+    def __init__(self, *sinks, **kwargs):
+        self.sinks = sinks
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        self._previous = (_SINKS, _MEMORY)
+        enable(*self.sinks, **self.kwargs)
+        return self
+
+    def __exit__(self, *exc):
+        sinks, memory = self._previous
+        if _MEMORY and not memory:
+            disable()
+        enable(*sinks, memory=memory)
+        return False
+
+
+class MemoryCollector(object):
+    '''
+    Sink that keeps every span in `records`.
+    '''
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def to_dataframe(self):
+        '''The spans as a pandas.DataFrame, one row each'''
+        import pandas
+        return pandas.DataFrame(self.records)
+
+    def summary(self):
+        '''
+        Number of calls and total, mean, and longest wall time of each
+        named span, slowest first.
+        '''
+        df = self.to_dataframe()
+        if df.empty:
+            return df
+        return (
+            df.groupby('name')['wall']
+              .agg(['count', 'sum', 'mean', 'max'])
+              .rename(columns={'count': 'calls', 'sum': 'total'})
+              .sort_values('total', ascending=False)
+        )
+
+
+class LoggingSink(object):
+    '''
+    Sink that writes a line about every span to a logger (by default,
+    "pygridtools.profiling").
+    '''
+
+    def __init__(self, logger=None, level=logging.INFO):
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, record):
+        extras = [
+            '{}={}'.format(key, value) for key, value in sorted(record.items())
+            if key not in ('name', 'start', 'wall', 'peak_memory', 'depth',
+                           'parent')
+        ]
+        if record.get('peak_memory') is not None:
+            extras.insert(0, 'peak={:.1f} MB'.format(
+                record['peak_memory'] / 2.0**20
+            ))
+
+        self.logger.log(self.level, '%s%s: %.3f s %s',
+                        '  ' * record['depth'], record['name'],
+                        record['wall'], ' '.join(extras))
+
+
+class JSONLinesSink(object):
+    '''
+    Sink that appends every span to a file as one line of JSON.
+
+    Parameters
+    ----------
+    path : string or file-like
+        File name (opened for appending) or an open text file.
+
+    '''
+
+    def __init__(self, path):
+        if hasattr(path, 'write'):
+            self.file = path
+            self._owner = False
+        else:
+            self.file = open(path, 'a')
+            self._owner = True
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=_jsonable)
+        with self._lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self._owner:
+            self.file.close()
+
+
+def _jsonable(value):
+    # numpy scalars and anything else that json can't handle
+    try:
+        return value.item()
+    except AttributeError:
+        return str(value)
@@ -159,5 +159,10 @@ def _plot_boundaries_mpl(river=None, islands=None, ax=None):
     if river is not None:
         ax.plot(river[:, 0], river[:, 1], '-')
 
-    for island in islands:
-        ax.plot(island[:, 0], island[:, 1], '-')
+    if isinstance(islands, misc.RaggedPolygons):
+        # every ring in one line, broken up by NaNs
+        xy = islands.separated_coords()
+        ax.plot(xy[:, 0], xy[:, 1], '-')
+    else:
+        for island in islands:
+            ax.plot(island[:, 0], island[:, 1], '-')
@@ -1,10 +1,16 @@
 import os
+import json
+import sys
+import time
+import subprocess
+import multiprocessing
 import warnings
 
 import numpy as np
 from numpy import nan
 import matplotlib.pyplot as plt
 import pandas
+import fiona
 import pygridgen
 
 import nose.tools as nt
@@ -13,6 +19,8 @@ import pandas.util.testing as pdtest
 
 import pygridgen
 from pygridtools import core
+from pygridtools import io
+from pygridtools import misc
 import testing
 
 
@@ -313,6 +321,13 @@ class test_ModelGrid(object):
             [1.25, 3.25], [1.75, 3.25], [1.25, 3.75], [1.75, 3.75]
         ])
 
+        self.poly1 = np.array([
+            [1.0, 0.0], [1.5, 0.0], [1.5, 1.0], [1.0, 1.0]
+        ])
+        self.poly2 = np.array([
+            [2.9, 1.1], [3.6, 1.1], [3.6, 1.9], [2.9, 1.9]
+        ])
+
         self.known_node_pairs = np.array([
             [1.25, 0.25], [1.75, 0.25], [1.25, 0.75], [1.75, 0.75],
             [1.25, 1.25], [1.75, 1.25], [1.25, 1.75], [1.75, 1.75],
@@ -342,6 +357,31 @@ class test_ModelGrid(object):
         nt.assert_true(isinstance(self.g1.cells_y, np.ndarray))
         nptest.assert_array_equal(self.g1.cells_y, self.yc[:, :2])
 
+    def test_cells_cached(self):
+        nt.assert_true(self.g1.cells_x is self.g1.cells_x)
+        nt.assert_true(self.g1.cells_y is self.g1.cells_y)
+        nt.assert_false(self.g1.cells_x.flags.writeable)
+
+    def test_cells_cache_cleared_by_transform(self):
+        xc = self.g1.cells_x
+        self.g1.transform(lambda x: x * 10)
+        nt.assert_false(self.g1.cells_x is xc)
+        nptest.assert_array_equal(self.g1.cells_x, self.xc[:, :2] * 10)
+
+    def test_cells_cache_cleared_by_merge(self):
+        self.g1.cells_x
+        self.g1.merge(self.g2, how='horiz', where='+', shift=2)
+        nptest.assert_array_equal(self.g1.cells_x, self.mg.cells_x)
+        nt.assert_tuple_equal(self.g1.cell_shape, self.mg.cell_shape)
+
+    def test_cells_cache_cleared_by_setter(self):
+        self.g1.cells_y
+        self.g1.nodes_y = core._PointSet(self.g1.yn + 1)
+        nptest.assert_array_equal(self.g1.cells_y, self.yc[:, :2] + 1)
+
+    def test_valid_nodes(self):
+        nptest.assert_array_equal(self.mg.valid_nodes, ~np.isnan(self.xn))
+
     def test_icells(self):
         nt.assert_equal(
             self.g1.icells,
@@ -446,6 +486,31 @@ class test_ModelGrid(object):
             df.columns, self.known_masked_cell_df.columns,
         )
 
+    def test_as_coord_pairs_interleaved(self):
+        mg = core.ModelGrid(self.xn[:, :3], self.yn[:, :3], interleaved=True)
+        pairs = mg.as_coord_pairs()
+        nptest.assert_array_equal(pairs, self.known_coord_pairs)
+        nt.assert_true(np.shares_memory(pairs, mg.xn))
+        nt.assert_false(pairs.flags.writeable)
+
+    def test_interleaved_transform(self):
+        mg = core.ModelGrid(self.xn, self.yn, interleaved=True)
+        mg.transpose()
+        nptest.assert_array_equal(mg.xn, self.mg.xn.T)
+        nt.assert_true(np.shares_memory(mg.nodes, mg.yn))
+        nptest.assert_array_equal(mg.xc, self.mg.xc.T)
+
+    def test_from_nodes(self):
+        nodes = np.dstack([self.xn.data, self.yn.data])
+        mg = core.ModelGrid.from_nodes(nodes)
+        nt.assert_true(np.shares_memory(mg.xn, nodes))
+        nptest.assert_array_equal(mg.yn, self.mg.yn)
+        nptest.assert_array_equal(mg.yc, self.mg.yc)
+
+    @nt.raises(ValueError)
+    def test_from_nodes_bad_shape(self):
+        core.ModelGrid.from_nodes(np.zeros((4, 3, 3)))
+
     def test_transform(self):
         gx = self.g1.xn.copy() * 10
         g = self.g1.transform(lambda x: x * 10)
@@ -475,10 +540,235 @@ class test_ModelGrid(object):
         nptest.assert_array_equal(g3.xn, g4.xn)
         nptest.assert_array_equal(g3.xc, g4.xc)
 
+    def test_elev_follows_nodes(self):
+        elev = np.arange(np.prod(self.mg.cell_shape)).reshape(
+            self.mg.cell_shape)
+        self.mg.elev = elev.copy()
+        self.mg.transpose().fliplr().flipud()
+        nptest.assert_array_equal(self.mg.elev, elev.T[::-1, ::-1])
+        nt.assert_tuple_equal(self.mg.elev.shape, self.mg.cell_shape)
+
+        self.mg.transform(lambda x: x * 10)
+        nt.assert_true(self.mg.elev is None)
+
+        self.g1.elev = np.ones(self.g1.cell_shape)
+        self.g1.merge(self.g2, how='horiz', where='+', shift=2)
+        nt.assert_true(self.g1.elev is None)
+
+    def test_mask_cells_with_polygon(self):
+        known = np.zeros(self.mg.cell_shape, dtype=bool)
+        known[:2, 0] = True
+        self.mg.mask_cells_with_polygon(self.poly1)
+        nptest.assert_array_equal(self.mg.cell_mask, known)
+
+    def test_mask_cells_with_polygon_outside(self):
+        known = np.ones(self.mg.cell_shape, dtype=bool)
+        known[:2, 0] = False
+        mask = self.mg.mask_cells_with_polygon(self.poly1, inside=False,
+                                               inplace=False)
+        nptest.assert_array_equal(mask, known)
+        nt.assert_false(self.mg.cell_mask.any())
+
+    def test_mask_cells_with_polygon_nodes(self):
+        known = np.zeros(self.mg.cell_shape, dtype=bool)
+        known[2:4, 4] = True
+        mask = self.mg.mask_cells_with_polygon(self.poly2, use_cells=False,
+                                               min_nodes=2, inplace=False)
+        nptest.assert_array_equal(mask, known)
+
+    @nt.raises(ValueError)
+    def test_mask_cells_with_polygon_bad_verts(self):
+        self.mg.mask_cells_with_polygon(self.poly1[:2])
+
+    def test_mask_cells_with_polygons(self):
+        known = np.zeros(self.mg.cell_shape, dtype=bool)
+        known[:2, 0] = True
+        known[2:4, 4] = True
+        self.mg.mask_cells_with_polygons([self.poly1, self.poly2])
+        nptest.assert_array_equal(self.mg.cell_mask, known)
+
+    def test_mask_cells_with_polygons_chunked(self):
+        known = self.mg.mask_cells_with_polygons([self.poly1, self.poly2],
+                                                 inplace=False)
+        self.mg.chunksize = 4
+        mask = self.mg.mask_cells_with_polygons([self.poly1, self.poly2],
+                                                inplace=False)
+        nptest.assert_array_equal(mask, known)
+
+    def test_mask_cells_with_ragged_polygons(self):
+        outer = np.array([[1.0, 0.0], [2.0, 0.0], [2.0, 1.0], [1.0, 1.0]])
+        hole = np.array([[1.6, 0.6], [1.9, 0.6], [1.9, 0.9], [1.6, 0.9]])
+        known = (
+            self.mg.mask_cells_with_polygon(outer, inplace=False) &
+            ~self.mg.mask_cells_with_polygon(hole, inplace=False)
+        )
+        polygons = misc.RaggedPolygons(np.vstack([outer, hole, self.poly2]),
+                                       [0, 4, 8, 12], [0, 2, 3], [0, 2])
+        known |= self.mg.mask_cells_with_polygon(self.poly2, inplace=False)
+
+        mask = self.mg.mask_cells_with_polygons(polygons, inplace=False)
+        nptest.assert_array_equal(mask, known)
+
+        self.mg.chunksize = 4
+        mask = self.mg.mask_cells_with_polygons(polygons, inplace=False)
+        nptest.assert_array_equal(mask, known)
+
+    def test_mask_cells_with_polygon_nodes_chunked(self):
+        known = self.mg.mask_cells_with_polygon(self.poly2, use_cells=False,
+                                                min_nodes=2, inplace=False)
+        self.mg.chunksize = 3
+        mask = self.mg.mask_cells_with_polygon(self.poly2, use_cells=False,
+                                               min_nodes=2, inplace=False)
+        nptest.assert_array_equal(mask, known)
+
+    def test_save_binary_open_mmap(self):
+        outputdir = 'tests/result_files/binary_grid'
+        self.mg.template = 'junk.shp'
+        self.mg.mask_cells_with_polygon(self.poly1)
+        self.mg.save_binary(outputdir, chunksize=5)
+
+        with open(os.path.join(outputdir, 'grid.json'), 'r') as f:
+            header = json.load(f)
+        nt.assert_equal(header['format'], io.GRIDFILE_FORMAT)
+        nt.assert_equal(header['version'], io.GRIDFILE_VERSION)
+
+        mg = core.ModelGrid.open_mmap(outputdir, chunksize=5)
+        nt.assert_false(mg.xn.flags.writeable)
+        nt.assert_equal(mg.template, 'junk.shp')
+        nt.assert_equal(mg.chunksize, 5)
+        nptest.assert_array_equal(mg.xn, self.mg.xn)
+        nptest.assert_array_equal(mg.yn, self.mg.yn)
+        nptest.assert_array_equal(mg.xc, self.mg.xc)
+        nptest.assert_array_equal(mg.yc, self.mg.yc)
+        nptest.assert_array_equal(mg.cell_mask, self.mg.cell_mask)
+
+        mg.mask_cells_with_polygon(self.poly2)
+        self.mg.mask_cells_with_polygon(self.poly2)
+        nptest.assert_array_equal(mg.cell_mask, self.mg.cell_mask)
+
+    def test_open_mmap_masking_persists(self):
+        outputdir = 'tests/result_files/binary_grid_rplus'
+        self.mg.save_binary(outputdir)
+
+        mg = core.ModelGrid.open_mmap(outputdir, mode='r+')
+        mg.mask_cells_with_polygon(self.poly1)
+        nt.assert_true(isinstance(mg.cell_mask, np.memmap))
+        mg.mask_cells_with_polygon(self.poly2)
+        del mg
+
+        self.mg.mask_cells_with_polygon(self.poly1)
+        self.mg.mask_cells_with_polygon(self.poly2)
+        reopened = core.ModelGrid.open_mmap(outputdir)
+        nt.assert_true(reopened.cell_mask.any())
+        nptest.assert_array_equal(reopened.cell_mask, self.mg.cell_mask)
+
+    def test_open_mmap_read_only_mask(self):
+        outputdir = 'tests/result_files/binary_grid_readonly'
+        self.mg.save_binary(outputdir)
+
+        mg = core.ModelGrid.open_mmap(outputdir)
+        mg.mask_cells_with_polygon(self.poly1)
+        nt.assert_true(mg.cell_mask.any())
+        nt.assert_false(core.ModelGrid.open_mmap(outputdir).cell_mask.any())
+
+    @nt.raises(ValueError)
+    def test_open_mmap_bad_version(self):
+        outputdir = 'tests/result_files/binary_grid_badversion'
+        self.mg.save_binary(outputdir)
+        with open(os.path.join(outputdir, 'grid.json'), 'w') as f:
+            f.write('{"format": "pygridtools.grid", "version": 999}')
+        core.ModelGrid.open_mmap(outputdir)
+
+    def test_to_gridfile_from_gridfile(self):
+        outfile = 'tests/result_files/mg_gridfile.npz'
+        self.mg.template = 'junk.shp'
+        self.mg.mask_cells_with_polygon(self.poly1)
+        self.mg.to_gridfile(outfile, compress=True)
+
+        mg = core.ModelGrid.from_gridfile(outfile)
+        nptest.assert_array_equal(mg.xn, self.mg.xn)
+        nptest.assert_array_equal(mg.yn, self.mg.yn)
+        nptest.assert_array_equal(mg.cell_mask, self.mg.cell_mask)
+        nt.assert_equal(mg.template, 'junk.shp')
+        nt.assert_true(mg.elev is None)
+
+    def test_gridfile_elev(self):
+        outfile = 'tests/result_files/mg_gridfile_elev.npz'
+        self.mg.elev = np.arange(np.prod(self.mg.cell_shape)).reshape(
+            self.mg.cell_shape)
+        self.mg.to_gridfile(outfile)
+
+        mg = core.ModelGrid.from_gridfile(outfile)
+        nptest.assert_array_equal(mg.elev, self.mg.elev)
+
+    @nt.raises(ValueError)
+    def test_nodes_read_only(self):
+        self.mg.xc
+        self.mg.xn[0, 0] = 100
+
+    def test_nodes_not_frozen_for_caller(self):
+        x, y = testing.makeSimpleNodes()
+        mg = core.ModelGrid(x, y)
+        nt.assert_true(x.flags.writeable)
+        nt.assert_false(mg.xn.flags.writeable)
+        nt.assert_false(mg.nodes_y.points.flags.writeable)
+
+    def test_cell_index_cleared_by_transform(self):
+        index = self.mg.cell_index
+        self.mg.transform(lambda x: x * 10)
+        nt.assert_false(self.mg.cell_index is index)
+
     @nt.raises(ValueError)
     def test_to_shapefile_bad_geom(self):
         self.g1.to_shapefile('junk', geom='Line')
 
+    def test_quality(self):
+        metrics = self.mg.quality()
+        nt.assert_equal(metrics['cells'], 24)
+        nptest.assert_almost_equal(metrics['orthogonality_max'], 0)
+        nptest.assert_almost_equal(metrics['aspect_ratio_max'], 1)
+        nptest.assert_almost_equal(metrics['smoothness_max'], 1)
+
+    def test_quality_sheared(self):
+        y, x = np.mgrid[:5, :8].astype(float)
+        x += y * np.tan(np.radians(10))
+        metrics = core.ModelGrid(x, y).quality()
+        nt.assert_equal(metrics['cells'], 28)
+        nptest.assert_almost_equal(metrics['orthogonality_max'], 10)
+        nptest.assert_almost_equal(metrics['orthogonality_mean'], 10)
+        nptest.assert_almost_equal(metrics['smoothness_max'], 1)
+
+    def test_from_shapefile_points(self):
+        outfile = 'tests/result_files/mgshp_roundtrip_points.shp'
+        self.g2.to_shapefile(outfile, usemask=False, which='nodes',
+                             geom='point')
+        mg = core.ModelGrid.from_shapefile(outfile)
+        nptest.assert_array_equal(mg.xn, self.g2.xn)
+        nptest.assert_array_equal(mg.yn, self.g2.yn)
+
+    def test_from_shapefile_polys(self):
+        outfile = 'tests/result_files/mgshp_roundtrip_polys.shp'
+        self.g2.to_shapefile(outfile, usemask=False, which='nodes',
+                             geom='polygon')
+        mg = core.ModelGrid.from_shapefile(outfile)
+        nptest.assert_array_equal(mg.xn, self.g2.xn)
+        nptest.assert_array_equal(mg.yn, self.g2.yn)
+
+    def test_from_shapefile_single_row_or_column(self):
+        for shape in [(2, 6), (6, 2)]:
+            for sign in [1, -1]:
+                y, x = np.mgrid[:shape[0], :shape[1]].astype(float)
+                x = sign * (2 * x + 0.3 * y)
+                grid = core.ModelGrid(x, y)
+                grid.template = self.template
+                outfile = 'tests/result_files/mgshp_{}x{}_{}.shp'.format(
+                    shape[0], shape[1], sign)
+                grid.to_shapefile(outfile, usemask=False, which='nodes')
+
+                mg = core.ModelGrid.from_shapefile(outfile)
+                nptest.assert_array_equal(mg.xn, x)
+                nptest.assert_array_equal(mg.yn, y)
+
     def test_to_shapefile_nomask_nodes_points(self):
         outfile = 'tests/result_files/mgshp_nomask_nodes_points.shp'
         basefile = 'tests/baseline_files/mgshp_nomask_nodes_points.shp'
@@ -534,6 +824,23 @@ class test_ModelGrid(object):
 
         testing.compareShapefiles(outfile, basefile)
 
+    def test_to_shapefile_elev(self):
+        outfile = 'tests/result_files/mgshp_elev_polys.shp'
+        elev = np.arange(np.prod(self.g1.cell_shape), dtype=float)
+        self.g1.elev = elev.reshape(self.g1.cell_shape)
+        self.g1.to_shapefile(outfile, usemask=False, which='nodes')
+
+        with fiona.open(outfile, 'r') as shp:
+            written = {
+                (feat['properties']['jj'], feat['properties']['ii']):
+                    feat['properties']['elev']
+                for feat in shp
+            }
+        jj, ii = np.nonzero(np.isfinite(self.g1.xc))
+        nt.assert_equal(len(written), jj.shape[0])
+        for j, i in zip(jj, ii):
+            nt.assert_equal(written[(j + 2, i + 2)], self.g1.elev[j, i])
+
     @nt.raises(ValueError)
     def test_to_shapefile_mask_nodes(self):
         self.g1.to_shapefile('junk', usemask=True, which='nodes', geom='point')
@@ -596,6 +903,14 @@ class test_ModelGrid(object):
             known_filename
         )
 
+    def test_from_gridout(self):
+        outputfile = 'tests/result_files/modelgrid_roundtrip.out'
+        self.mg.writeGEFDCGridFile(outputdir='tests/result_files',
+                                   filename='modelgrid_roundtrip.out')
+        mg = core.ModelGrid.from_gridout(outputfile)
+        nptest.assert_array_almost_equal(mg.xn, self.mg.xn, decimal=3)
+        nptest.assert_array_almost_equal(mg.yn, self.mg.yn, decimal=3)
+
     def test_writeGEFDCGridextFiles(self):
         known_filename = 'tests/baseline_files/modelgrid_gridext.inp'
         result_path = 'tests/result_files'
@@ -610,6 +925,73 @@ class test_ModelGrid(object):
         )
 
 
+class test_makeGrids(object):
+    def setup(self):
+        self.coords = testing.makeSimpleBoundary()
+        self.paramsets = [
+            {'nx': 9, 'ny': 7, 'nnodes': 12, 'ul_idx': 0},
+            {'nx': 11, 'ny': 9, 'nnodes': 12, 'ul_idx': 0},
+            {'nx': 13, 'ny': 7, 'nnodes': 12, 'ul_idx': 0,
+             'precision': 1e-6},
+        ]
+
+    def test_sweep(self):
+        results = list(core.makeGrids(self.coords, self.paramsets,
+                                      nprocs=2, timeout=120))
+        nt.assert_equal(sorted(r['index'] for r in results), [0, 1, 2])
+        for result in results:
+            params = self.paramsets[result['index']]
+            nt.assert_equal(result['status'], 'ok')
+            nt.assert_tuple_equal(result['grid'].shape,
+                                  (params['ny'], params['nx']))
+            nt.assert_true(result['cells'] > 0)
+            nt.assert_true(result['wall'] >= result['gridgen_time'])
+
+    def test_bad_params(self):
+        self.paramsets.append({'nx': 9, 'ny': 7, 'nnodes': 'junk'})
+        results = list(core.makeGrids(self.coords, self.paramsets[-1:],
+                                      nprocs=1))
+        nt.assert_equal(results[0]['status'], 'error')
+        nt.assert_true(results[0]['grid'] is None)
+
+    @nt.raises(ValueError)
+    def test_no_nx(self):
+        self.paramsets[1].pop('nx')
+        list(core.makeGrids(self.coords, self.paramsets))
+
+    @nt.raises(ValueError)
+    def test_no_procs(self):
+        list(core.makeGrids(self.coords, self.paramsets, nprocs=0,
+                            timeout=10))
+
+    # the slow Gridgen only reaches the workers if they are forked
+    @nptest.dec.skipif(getattr(multiprocessing, 'get_start_method',
+                               lambda: 'fork')() != 'fork')
+    def test_timeout(self):
+        class SlowGridgen(object):
+            def __init__(self, *args, **kwargs):
+                time.sleep(60)
+
+        gridgen = pygridgen.Gridgen
+        pygridgen.Gridgen = SlowGridgen
+        try:
+            start = time.time()
+            results = list(core.makeGrids(self.coords, self.paramsets[:2],
+                                          nprocs=2, timeout=0.5))
+        finally:
+            pygridgen.Gridgen = gridgen
+
+        nt.assert_true(time.time() - start < 30)
+        nt.assert_equal(sorted(r['index'] for r in results), [0, 1])
+        for result in results:
+            nt.assert_equal(result['status'], 'timeout')
+            nt.assert_true(result['grid'] is None)
+            nt.assert_true(result['wall'] >= 0.5)
+
+        # the workers were terminated, not left sleeping
+        nt.assert_list_equal(multiprocessing.active_children(), [])
+
+
 class test_makeGrid(object):
     def setup(self):
         self.coords = testing.makeSimpleBoundary()
@@ -628,7 +1010,13 @@ class test_makeGrid(object):
             bathydata=self.bathy.dropna(),
             **self.gridparams
         )
-        nt.assert_true(isinstance(grid, pygridgen.Gridgen))
+        nt.assert_true(isinstance(grid, core.ModelGrid))
+        nt.assert_tuple_equal(grid.elev.shape, grid.cell_shape)
+
+    def test_without_bathy(self):
+        grid = core.makeGrid(coords=self.coords, **self.gridparams)
+        nt.assert_true(isinstance(grid, core.ModelGrid))
+        nt.assert_true(grid.elev is None)
 
     @nt.raises(ValueError)
     def test_makegrid_no_nx(self):
@@ -648,3 +1036,13 @@ class test_makeGrid(object):
             **self.gridparams
         )
 
+
+
+def test_import_without_plotting_stack():
+    code = (
+        "import sys; import pygridtools; "
+        "heavy = ['matplotlib.pyplot', 'seaborn', 'bokeh', 'fiona']; "
+        "print(','.join(m for m in heavy if m in sys.modules))"
+    )
+    loaded = subprocess.check_output([sys.executable, '-c', code])
+    nt.assert_equal(loaded.decode().strip(), '')
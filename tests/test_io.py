@@ -169,6 +169,62 @@ class test_loadPolygonFromShapefile(object):
         nptest.assert_array_almost_equal(island[0], self.known_islands[1])
 
 
+class test_loadRaggedPolygons(object):
+    def setup(self):
+        self.shpfile = 'tests/test_data/simple_islands.shp'
+        self.filter = lambda x: x['properties']['name'] == 'keeper'
+        self.multifile = 'tests/result_files/multi_islands.shp'
+
+        square = [(0., 0.), (0., 4.), (4., 4.), (4., 0.), (0., 0.)]
+        hole = [(1., 1.), (3., 1.), (3., 3.), (1., 3.), (1., 1.)]
+        small = [(10., 0.), (10., 1.), (11., 1.), (11., 0.), (10., 0.)]
+        schema = {'geometry': 'Polygon', 'properties': {'name': 'str'}}
+        with fiona.open(self.multifile, 'w', driver='ESRI Shapefile',
+                        schema=schema) as out:
+            out.write({
+                'geometry': {'type': 'MultiPolygon',
+                             'coordinates': [[square, hole], [small]]},
+                'properties': {'name': 'multi'},
+            })
+            out.write({
+                'geometry': {'type': 'Polygon', 'coordinates': [small]},
+                'properties': {'name': 'single'},
+            })
+
+    def test_baseline(self):
+        islands = io.loadRaggedPolygons(self.shpfile)
+        nt.assert_equal(len(islands), 2)
+        nt.assert_equal(islands.coords.shape, (16, 2))
+        nptest.assert_array_almost_equal(islands.bboxes, [
+            [9.34025375, 3.63898501, 17.6816609, 11.98039216],
+            [-0.95732411, 3.67589389, 8.67589389, 10.98385236],
+        ])
+
+    def test_filter(self):
+        islands = io.loadRaggedPolygons(self.shpfile, filterfxn=self.filter)
+        nptest.assert_array_equal(islands.ids, [1])
+        nptest.assert_array_almost_equal(islands.rings(0)[0][[0, -2]], [
+            [1.10957324, 3.67589389], [6.86735871, 3.71280277]
+        ])
+
+    def test_multipart_and_holes(self):
+        islands = io.loadRaggedPolygons(self.multifile)
+        nt.assert_equal(len(islands), 2)
+        nptest.assert_array_equal(islands.polygon_offsets, [0, 2, 3])
+        nptest.assert_array_equal(islands.part_offsets, [0, 2, 3, 4])
+        nptest.assert_array_equal(islands.bboxes[0], [0, 0, 11, 4])
+        nt.assert_equal(islands.coords.shape, (20, 2))
+
+    def test_bbox(self):
+        islands = io.loadRaggedPolygons(self.multifile, bbox=(-1, -1, 2, 2))
+        nptest.assert_array_equal(islands.ids, [0])
+
+    def test_nothing_in_bbox(self):
+        islands = io.loadRaggedPolygons(self.multifile, bbox=(50, 50, 60, 60))
+        nt.assert_equal(len(islands), 0)
+        nt.assert_equal(islands.bboxes.shape, (0, 4))
+
+
 def test_dumpGridFile():
     grid = testing.makeSimpleGrid()
     outputfile = 'tests/result_files/grid.out'
@@ -232,6 +288,16 @@ class test_savePointShapefile(object):
 
         testing.compareShapefiles(outfile, basefile)
 
+    def test_small_chunks(self):
+        outfile = os.path.join(self.outputdir, 'chunked_point.shp')
+        basefile = os.path.join(self.baselinedir, 'mask_point.shp')
+        io.savePointShapefile(np.ma.MaskedArray(self.x, self.mask),
+                              np.ma.MaskedArray(self.y, self.mask),
+                              self.template, outfile, 'w', river=self.river,
+                              chunksize=2)
+
+        testing.compareShapefiles(outfile, basefile)
+
 
 class test_saveGridShapefile(object):
     def setup(self):
@@ -268,6 +334,15 @@ class test_saveGridShapefile(object):
 
         testing.compareShapefiles(basefile, outfile, atol=0.001)
 
+    def test_small_chunks(self):
+        outfile = os.path.join(self.outputdir, 'chunked_grid.shp')
+        basefile = os.path.join(self.baselinedir, 'mgshp_nomask_cells_polys.shp')
+        x, y = testing.makeSimpleNodes()
+        io.saveGridShapefile(x[:, :3], y[:, :3], None, self.template,
+                             outfile, 'w', chunksize=3)
+
+        testing.compareShapefiles(basefile, outfile, atol=0.001)
+
 
 class test_shapefileToDataFrame(object):
     def setup(self):
@@ -308,6 +383,19 @@ class test_write_cellinp(object):
             self.known_chunked_output
         )
 
+    def test_chunked_many_blocks(self):
+        outputfile = 'tests/result_files/cell_chunked_3blocks.inp'
+        knownfile = 'tests/baseline_files/cell_chunked_3blocks.inp'
+        io._write_cellinp(self.cells, outputfile, maxcols=4)
+        testing.compareTextFiles(outputfile, knownfile)
+
+    def test_multidigit_values(self):
+        outputfile = 'tests/result_files/cell_multidigit.inp'
+        io._write_cellinp(np.array([[10, 2], [3, -1]]), outputfile,
+                          writeheader=False)
+        with open(outputfile) as f:
+            nt.assert_equal(f.read(), '  2  3-1\n  1  102\n')
+
 
 class test_gridextToShapefile(object):
     def setup(self):
@@ -325,6 +413,25 @@ class test_gridextToShapefile(object):
         testing.compareShapefiles(self.outputfile, self.baselinefile)
 
 
+    def test_failed_rows(self):
+        inputfile = 'tests/result_files/gridext_bad.inp'
+        outputfile = 'tests/result_files/gridext_bad.shp'
+        with open(inputfile, 'w') as f:
+            f.write('  2  3 10.0 20.0\n'
+                    '  2  4 junk 21.0\n'
+                    '  2.5  5 12.0 22.0\n'
+                    '  3  3 11.0 20.0\n'
+                    '  3  4 11.0\n')
+
+        failed = io.gridextToShapefile(inputfile, outputfile, self.template,
+                                       river=self.river, chunksize=1)
+        nptest.assert_array_equal(failed.index, [1, 2, 4])
+        nptest.assert_array_equal(failed['in gis layer'], [0, 0, 0])
+
+        with fiona.open(outputfile) as shp:
+            ii_jj = [r['properties']['ii_jj'] for r in shp]
+        nt.assert_list_equal(ii_jj, ['002_003', '003_003'])
+
     @nt.raises(ValueError)
     def test_bad_input_file(self):
         io.gridextToShapefile('junk__', self.outputfile,
@@ -357,6 +464,43 @@ def test__write_gridext_file():
     testing.compareTextFiles(result_filename, known_filename)
 
 
+class test__write_gridext_nodes(object):
+    def setup(self):
+        self.result_filename = 'tests/result_files/gridext_nodes.inp'
+        self.x = np.ma.masked_invalid([
+            [1.0, 2.0, np.nan],
+            [1.5, 2.5, 3.5],
+        ])
+        self.y = np.ma.masked_invalid([
+            [0.0, 0.0, np.nan],
+            [0.5, np.nan, 0.5],
+        ])
+
+    def test_basic(self):
+        io._write_gridext_nodes(self.x, self.y, self.result_filename)
+        with open(self.result_filename, 'r') as f:
+            lines = f.read().splitlines()
+
+        nt.assert_list_equal(lines, [
+            '2 2 1.0 0.0',
+            '3 2 2.0 0.0',
+            '2 3 1.5 0.5',
+            '3 3 2.5 ',
+            '4 3 3.5 0.5',
+        ])
+
+    def test_shift_and_chunks(self):
+        io._write_gridext_nodes(self.x, self.y, self.result_filename,
+                                shift=0, chunksize=2)
+        df = pandas.read_csv(self.result_filename, sep=' ', header=None)
+        nptest.assert_array_equal(df[0], [0, 1, 0, 1, 2])
+        nptest.assert_array_equal(df[1], [0, 0, 1, 1, 1])
+
+    @nt.raises(ValueError)
+    def test_errors(self):
+        io._write_gridext_nodes(self.x, self.y[:, :2], 'junk')
+
+
 class test__write_gridout_file(object):
     def setup(self):
         self.known_filename = 'tests/baseline_files/testgrid.out'
@@ -373,6 +517,30 @@ class test__write_gridout_file(object):
         io._write_gridout_file(self.x, self.y[2:, 2:], 'junk')
 
 
+class test_readGridout(object):
+    def setup(self):
+        self.known_filename = 'tests/baseline_files/testgrid.out'
+        self.result_filename = 'tests/result_files/badgrid.out'
+        self.x, self.y = testing.makeSimpleNodes()
+
+    def test_baseline(self):
+        x, y = io.readGridout(self.known_filename)
+        nptest.assert_array_equal(x, self.x.filled(np.nan))
+        nptest.assert_array_equal(y, self.y.filled(np.nan))
+
+    @nt.raises(ValueError)
+    def test_bad_header(self):
+        with open(self.result_filename, 'w') as f:
+            f.write('1.000 2.000\n')
+        io.readGridout(self.result_filename)
+
+    @nt.raises(ValueError)
+    def test_wrong_size(self):
+        with open(self.result_filename, 'w') as f:
+            f.write('## 2 x 2\n1.000 2.000\nNaN NaN\n')
+        io.readGridout(self.result_filename)
+
+
 class test_readGridShapefile(object):
     def setup(self):
         self.point_file = "tests/baseline_files/array_point.shp"
@@ -396,8 +564,169 @@ class test_readGridShapefile(object):
         result_df = io.readGridShapefile(self.point_file, othercols=self.ocols)
         pdtest.assert_frame_equal(result_df, self.known_df)
 
-    @nt.raises(NotImplementedError)
     def test_read_cellfile(self):
         result_df = io.readGridShapefile(self.cell_file)
-        pdtest.assert_frame_equal(result_df, self.known_df)
+        nt.assert_equal(result_df.shape, (39, 2))
+
+        nodes = result_df.unstack(level='i')
+        nptest.assert_array_almost_equal(
+            nodes['easting'].iloc[2], [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0]
+        )
+        nptest.assert_array_almost_equal(
+            nodes['northing'][0], np.arange(0, 4.5, 0.5)
+        )
+        nt.assert_true(nodes['easting'].iloc[0, 3:].isnull().all())
+
+    @nt.raises(ValueError)
+    def test_read_cellfile_othercols(self):
+        io.readGridShapefile(self.cell_file, othercols=self.ocols)
+
+
+
+class test_saveGridFile(object):
+    def setup(self):
+        self.outputfile = 'tests/result_files/grid.npz'
+        self.x, self.y = testing.makeSimpleNodes()
+        self.y[0, 0] = np.nan
+        self.mask = np.zeros((self.x.shape[0] - 1, self.x.shape[1] - 1),
+                             dtype=bool)
+        self.mask[:2, 0] = True
+        self.elev = np.arange(self.mask.size).reshape(self.mask.shape) * 1.5
+
+    def test_roundtrip(self):
+        io.saveGridFile(self.outputfile, self.x, self.y, cell_mask=self.mask,
+                        template='junk.shp', attrs={'elev': self.elev})
+        grid = io.loadGridFile(self.outputfile)
+        nptest.assert_array_equal(grid['nodes_x'], self.x)
+        nptest.assert_array_equal(grid['nodes_y'], self.y)
+        nptest.assert_array_equal(grid['cell_mask'], self.mask)
+        nt.assert_equal(grid['template'], 'junk.shp')
+        nt.assert_equal(list(grid['attrs'].keys()), ['elev'])
+        nptest.assert_array_equal(grid['attrs']['elev'], self.elev)
+
+    def test_roundtrip_compressed_no_mask(self):
+        io.saveGridFile(self.outputfile, self.x, self.y, compress=True)
+        grid = io.loadGridFile(self.outputfile)
+        nptest.assert_array_equal(grid['nodes_x'], self.x)
+        nt.assert_false(grid['cell_mask'].any())
+        nt.assert_equal(grid['cell_mask'].shape, self.mask.shape)
+        nt.assert_true(grid['template'] is None)
+        nt.assert_equal(len(grid['attrs']), 0)
+
+    @nt.raises(ValueError)
+    def test_bad_attr_shape(self):
+        io.saveGridFile(self.outputfile, self.x, self.y,
+                        attrs={'elev': self.x})
+
+    @nt.raises(ValueError)
+    def test_bad_nodes_shape(self):
+        io.saveGridFile(self.outputfile, self.x, self.y[2:, 2:])
+
+    @nt.raises(ValueError)
+    def test_load_not_a_gridfile(self):
+        np.savez('tests/result_files/not_a_grid.npz', x=self.x)
+        io.loadGridFile('tests/result_files/not_a_grid.npz')
+
+    @nt.raises(ValueError)
+    def test_load_newer_version(self):
+        header = np.frombuffer(
+            b'{"format": "pygridtools.grid", "version": 999}', dtype=np.uint8
+        )
+        np.savez('tests/result_files/future_grid.npz', header=header)
+        io.loadGridFile('tests/result_files/future_grid.npz')
 
+
+class test_loadBathymetry(object):
+    def setup(self):
+        self.xyzfile = 'tests/result_files/bathy.xyz'
+        self.csvfile = 'tests/result_files/bathy.csv'
+        rng = np.random.RandomState(0)
+        self.known = pandas.DataFrame({
+            'x': rng.uniform(0, 10, size=500),
+            'y': rng.uniform(0, 10, size=500),
+            'z': rng.normal(size=500),
+        })[['x', 'y', 'z']]
+        self.known.to_csv(self.xyzfile, sep=' ', header=False, index=False)
+        self.known.rename(columns={'z': 'elev'}).to_csv(self.csvfile,
+                                                        index=False)
+
+    def test_all_points(self):
+        bathy = io.loadBathymetry(self.xyzfile, chunksize=64)
+        nptest.assert_array_almost_equal(bathy.values, self.known.values)
+
+    def test_csv(self):
+        bathy = io.loadBathymetry(self.csvfile, sep=',', header=0,
+                                  zcol='elev', chunksize=64)
+        nt.assert_equal(list(bathy.columns), ['x', 'y', 'elev'])
+        nptest.assert_array_almost_equal(bathy.values, self.known.values)
+
+    def test_bbox_and_buffer(self):
+        bathy = io.loadBathymetry(self.xyzfile, bbox=(2, 3, 5, 6),
+                                  buffer=1, chunksize=64)
+        known = self.known[
+            (self.known.x >= 1) & (self.known.x <= 6) &
+            (self.known.y >= 2) & (self.known.y <= 7)
+        ]
+        nptest.assert_array_almost_equal(bathy.values, known.values)
+
+    def test_resolution(self):
+        bathy = io.loadBathymetry(self.xyzfile, resolution=2.5, chunksize=64)
+        known = self.known.groupby([
+            np.floor(self.known.x / 2.5), np.floor(self.known.y / 2.5)
+        ]).mean().reset_index(drop=True)
+        nt.assert_equal(bathy.shape, (16, 3))
+        nptest.assert_array_almost_equal(bathy.values, known.values)
+
+    def test_nothing_in_bbox(self):
+        bathy = io.loadBathymetry(self.xyzfile, bbox=(20, 20, 30, 30))
+        nt.assert_equal(bathy.shape, (0, 3))
+
+
+class test_loadRasterBathymetry(object):
+    def setup(self):
+        self.ascfile = 'tests/result_files/dem.asc'
+        self.npyfile = 'tests/result_files/dem.npy'
+        self.values = np.arange(48, dtype=float).reshape(6, 8)
+        self.values[0, 0] = -9999
+        with open(self.ascfile, 'w') as f:
+            f.write('ncols 8\nnrows 6\nxllcorner 10.0\nyllcorner 20.0\n'
+                    'cellsize 2.0\nNODATA_value -9999\n')
+            np.savetxt(f, self.values, fmt='%.1f')
+        np.save(self.npyfile, self.values)
+        self.transform = (10, 2, 0, 32, 0, -2)
+
+    def test_ascii(self):
+        raster = io.loadRasterBathymetry(self.ascfile)
+        nt.assert_tuple_equal(raster.transform, self.transform)
+        known = self.values.copy()
+        known[0, 0] = np.nan
+        nptest.assert_array_equal(raster.values, known)
+
+    def test_ascii_center(self):
+        with open(self.ascfile, 'w') as f:
+            f.write('ncols 8\nnrows 6\nxllcenter 11.0\nyllcenter 21.0\n'
+                    'cellsize 2.0\n')
+            np.savetxt(f, self.values, fmt='%.1f')
+        raster = io.loadRasterBathymetry(self.ascfile)
+        nt.assert_tuple_equal(raster.transform, self.transform)
+        nptest.assert_array_equal(raster.values, self.values)
+
+    def test_ascii_window(self):
+        raster = io.loadRasterBathymetry(self.ascfile, bbox=(15, 25, 17, 27),
+                                         buffer=1)
+        nt.assert_tuple_equal(raster.transform, (12, 2, 0, 30, 0, -2))
+        nptest.assert_array_equal(raster.values, self.values[1:5, 1:5])
+
+    def test_npy_window(self):
+        raster = io.loadRasterBathymetry(self.npyfile, self.transform,
+                                         bbox=(15, 25, 17, 27), buffer=1)
+        nt.assert_tuple_equal(raster.transform, (12, 2, 0, 30, 0, -2))
+        nptest.assert_array_equal(raster.values, self.values[1:5, 1:5])
+
+    def test_outside(self):
+        raster = io.loadRasterBathymetry(self.ascfile, bbox=(50, 50, 60, 60))
+        nt.assert_equal(raster.values.size, 0)
+
+    @nt.raises(ValueError)
+    def test_npy_no_transform(self):
+        io.loadRasterBathymetry(self.npyfile)
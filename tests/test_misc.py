@@ -1,4 +1,5 @@
 import os
+import logging
 
 import numpy as np
 from numpy import nan
@@ -11,6 +12,7 @@ import numpy.testing as nptest
 import pandas.util.testing as pdtest
 
 from pygridtools import misc
+from pygridtools import profiling
 import testing
 
 np.set_printoptions(linewidth=150, nanstr='-')
@@ -28,6 +30,100 @@ def test_points_inside_poly():
     )
 
 
+class test_BucketIndex(object):
+    def setup(self):
+        x, y = np.meshgrid(np.arange(10.0), np.arange(8.0))
+        x[0, 0] = nan
+        self.index = misc.BucketIndex(x, y, bucketsize=4)
+        self.x = x.flatten()
+        self.y = y.flatten()
+
+    def test_query_bbox(self):
+        ids = np.sort(self.index.query_bbox(2.5, 1, 4, 2.5))
+        nptest.assert_array_equal(ids, [13, 14, 23, 24])
+
+    def test_query_bbox_outside(self):
+        ids = self.index.query_bbox(20, 20, 30, 30)
+        nt.assert_equal(ids.shape[0], 0)
+
+    def test_query_bbox_skips_nan(self):
+        ids = np.sort(self.index.query_bbox(-1, -1, 1, 0.5))
+        nptest.assert_array_equal(ids, [1])
+
+    def test_points_inside_poly(self):
+        polyverts = np.array([[0.5, 0.5], [3.5, 0.5], [0.5, 3.5]])
+        points = np.vstack([self.x, self.y]).T
+        nptest.assert_array_equal(
+            self.index.points_inside_poly(polyverts),
+            misc.points_inside_poly(points, polyverts)
+        )
+
+    @nt.raises(ValueError)
+    def test_bad_shapes(self):
+        misc.BucketIndex(np.arange(3.0), np.arange(4.0))
+
+
+class test_RaggedPolygons(object):
+    def setup(self):
+        # a square with a hole, then a two-part polygon
+        self.coords = np.array([
+            [0, 0], [4, 0], [4, 4], [0, 4],
+            [1, 1], [3, 1], [3, 3], [1, 3],
+            [10, 0], [11, 0], [11, 1],
+            [20, 5], [21, 5], [21, 6],
+        ], dtype=float)
+        self.polygons = misc.RaggedPolygons(
+            self.coords, [0, 4, 8, 11, 14], [0, 2, 3, 4], [0, 1, 3],
+            ids=[7, 9]
+        )
+
+    def test_len_and_ids(self):
+        nt.assert_equal(len(self.polygons), 2)
+        nptest.assert_array_equal(self.polygons.ids, [7, 9])
+
+    def test_bboxes(self):
+        nptest.assert_array_equal(self.polygons.bboxes, [
+            [0, 0, 4, 4],
+            [10, 0, 21, 6],
+        ])
+
+    def test_rings_and_parts(self):
+        rings = self.polygons.rings(0)
+        nt.assert_equal(len(rings), 2)
+        nptest.assert_array_equal(rings[1], self.coords[4:8])
+
+        parts = self.polygons.parts(1)
+        nt.assert_equal(len(parts), 2)
+        nptest.assert_array_equal(parts[1][0], self.coords[11:])
+
+    def test_query_bbox(self):
+        nptest.assert_array_equal(self.polygons.query_bbox(3, 3, 12, 12),
+                                  [0, 1])
+        nptest.assert_array_equal(self.polygons.query_bbox(15, 0, 16, 9),
+                                  [1])
+
+    def test_points_inside(self):
+        points = np.array([[0.5, 0.5], [2, 2], [5, 5]])
+        nptest.assert_array_equal(self.polygons.points_inside(points, 0),
+                                  [True, False, False])
+
+        points = np.array([[10.8, 0.2], [20.8, 5.2], [15, 3]])
+        nptest.assert_array_equal(self.polygons.points_inside(points, 1),
+                                  [True, True, False])
+
+    def test_separated_coords(self):
+        xy = self.polygons.separated_coords()
+        nt.assert_equal(xy.shape, (18, 2))
+        nt.assert_true(np.isnan(xy[[4, 9, 13, 17]]).all())
+
+    def test_from_polygons(self):
+        polygons = misc.RaggedPolygons.from_polygons([
+            self.coords[:4], self.coords[8:11]
+        ])
+        nt.assert_equal(len(polygons), 2)
+        nptest.assert_array_equal(polygons.bboxes[1], [10, 0, 11, 1])
+
+
 class test_makePolyCoords(object):
     def setup(self):
         x1 = 1
@@ -182,6 +278,292 @@ class test_interpolateBathymetry(object):
         pass
 
 
+class test_interpolateBathymetry_engines(object):
+    def setup(self):
+        self.bathy = testing.makeSimpleBathy()
+        self.x, self.y = testing.makeSimpleNodes()
+
+    def test_tree_engines(self):
+        x, y = self.x, self.y
+        known = 100 + 0.1 * x + 0.1 * y
+        for engine, decimal in [('nearest', 1), ('idw', 1), ('linear', 6)]:
+            elev = misc.interpolateBathymetry(self.bathy, x, y,
+                                              engine=engine, chunksize=7,
+                                              nthreads=2)
+            nt.assert_true(isinstance(elev, np.ma.MaskedArray))
+            nptest.assert_array_equal(elev.mask, x.mask)
+            nptest.assert_array_almost_equal(elev, known, decimal=decimal)
+
+    def test_idw_exact_points(self):
+        x = np.array([[1.0, 1.5], [2.0, 2.5]])
+        y = np.array([[1.0, 1.0], [2.0, 2.0]])
+        elev = misc.interpolateBathymetry(self.bathy, x, y, engine='idw',
+                                          k=4, power=1)
+        nptest.assert_array_almost_equal(elev, 100 + 0.1 * x + 0.1 * y)
+
+    def test_tiled(self):
+        x, y = self.x, self.y
+        known = misc.interpolateBathymetry(self.bathy, x, y, engine='linear')
+        for nprocs in (1, 2):
+            elev = misc.interpolateBathymetry(self.bathy, x, y,
+                                              engine='linear', tiles=(3, 2),
+                                              overlap=1, nprocs=nprocs)
+            nt.assert_true(isinstance(elev, np.ma.MaskedArray))
+            nptest.assert_array_equal(elev.mask, known.mask)
+            nptest.assert_array_almost_equal(elev, known)
+
+    def test_tile_weights(self):
+        nptest.assert_array_almost_equal(
+            misc._tile_weights(0, 6, 10, 2),
+            [1, 1, 1, 1, 2./3, 1./3]
+        )
+        nptest.assert_array_almost_equal(
+            misc._tile_weights(4, 10, 10, 2),
+            [1./3, 2./3, 1, 1, 1, 1]
+        )
+
+    def test_thinned(self):
+        elev = misc.interpolateBathymetry(self.bathy, self.x, self.y,
+                                          engine='linear', thin='mean',
+                                          thin_factor=0.5)
+        nptest.assert_array_almost_equal(elev, 100 + 0.1 * (self.x + self.y))
+
+    @nt.raises(ValueError)
+    def test_bad_engine(self):
+        misc.interpolateBathymetry(self.bathy, self.x, self.y,
+                                   engine='junk')
+
+
+class test_Bathymetry(object):
+    def setup(self):
+        misc.Bathymetry.clear_cache()
+        self.bathy = testing.makeSimpleBathy()
+        self.x, self.y = testing.makeSimpleNodes()
+        self.survey = misc.Bathymetry(self.bathy)
+
+    def teardown(self):
+        misc.Bathymetry.clear_cache()
+
+    def test_interpolate(self):
+        elev = self.survey.interpolate(self.x, self.y, engine='linear')
+        nt.assert_true(isinstance(elev, np.ma.MaskedArray))
+        nptest.assert_array_equal(elev.mask, self.x.mask)
+        nptest.assert_array_almost_equal(elev, 100 + 0.1 * (self.x + self.y))
+
+    def test_interpolate_reuses_fit(self):
+        collector = profiling.MemoryCollector()
+        with profiling.profile(collector):
+            first = self.survey.interpolate(self.x, self.y, engine='nearest')
+            second = self.survey.interpolate(self.x[2:, :3], self.y[2:, :3],
+                                             engine='nearest')
+
+        (key, interp), = misc._FITTED.items()
+        nt.assert_equal(key[0], self.survey.hash)
+        fits = [r for r in collector.records
+                if r['name'] == 'misc.Bathymetry.fit']
+        nt.assert_equal(len(fits), 1)
+        nt.assert_equal(fits[0]['count'], self.bathy.shape[0])
+        nptest.assert_array_equal(second, first[2:, :3])
+
+    def test_interpolate_tiled(self):
+        elev = self.survey.interpolate(self.x, self.y, engine='linear',
+                                       tiles=2, overlap=1, nprocs=1)
+        nptest.assert_array_equal(elev.mask, self.x.mask)
+        nptest.assert_array_almost_equal(elev, 100 + 0.1 * (self.x + self.y))
+        nt.assert_equal(len(misc._FITTED), 0)
+
+    def test_interpolate_thinned(self):
+        elev = self.survey.interpolate(self.x, self.y, engine='idw', k=1,
+                                       thin='mean', thin_factor=2)
+        nptest.assert_array_equal(elev.mask, self.x.mask)
+        (key, interp), = misc._FITTED.items()
+        nt.assert_true(('k', 1) in key[2])
+
+    def test_bbox(self):
+        survey = misc.Bathymetry(self.bathy, bbox=(1, 0, 4, 4))
+        nt.assert_true(survey.x.min() >= 1)
+        nt.assert_true(survey.x.max() <= 4)
+        nt.assert_true(survey.y.max() <= 4)
+
+    def test_hash(self):
+        other = misc.Bathymetry(self.bathy.copy())
+        nt.assert_equal(self.survey.hash, other.hash)
+
+        self.bathy.loc[0, 'z'] += 1
+        changed = misc.Bathymetry(self.bathy)
+        nt.assert_not_equal(self.survey.hash, changed.hash)
+
+    def test_fit_is_cached(self):
+        interp = self.survey.fit('nearest')
+        nt.assert_true(self.survey.fit('nearest') is interp)
+        nt.assert_true(misc.Bathymetry(self.bathy).fit('nearest') is interp)
+        nt.assert_false(self.survey.fit('idw', k=4) is interp)
+
+    def test_cache_evicts_least_recently_used(self):
+        first = self.survey.fit('idw', k=1)
+        for k in range(2, misc.FITTED_CACHE_SIZE + 1):
+            self.survey.fit('idw', k=k)
+
+        # touch k=1 so that k=2 is the one evicted
+        nt.assert_true(self.survey.fit('idw', k=1) is first)
+        self.survey.fit('nearest')
+
+        cached_ks = [dict(key[2]).get('k') for key in misc._FITTED]
+        nt.assert_equal(len(misc._FITTED), misc.FITTED_CACHE_SIZE)
+        nt.assert_true(1 in cached_ks)
+        nt.assert_false(2 in cached_ks)
+
+    @nt.raises(ValueError)
+    def test_bad_engine(self):
+        self.survey.fit('junk')
+
+
+class test_thinBathymetry(object):
+    def setup(self):
+        self.bathy = pandas.DataFrame({
+            'x': [0.1, 0.2, 0.3, 1.5, 1.6, 2.7, nan],
+            'y': [0.1, 0.2, 0.4, 0.5, 0.6, 2.7, 1.0],
+            'z': [1.0, 2.0, 6.0, 4.0, 2.0, 3.0, 9.0],
+        })[['x', 'y', 'z']]
+
+    def test_mean(self):
+        thinned, dropped = misc.thinBathymetry(self.bathy, resolution=1)
+        known = pandas.DataFrame({
+            'x': [0.2, 1.55, 2.7], 'y': [0.7 / 3, 0.55, 2.7],
+            'z': [3.0, 3.0, 3.0]
+        })[['x', 'y', 'z']]
+        pdtest.assert_frame_equal(thinned, known)
+        nt.assert_equal(dropped, 4)
+
+    def test_median(self):
+        thinned, dropped = misc.thinBathymetry(self.bathy, resolution=1,
+                                               how='median')
+        nptest.assert_array_almost_equal(thinned['z'], [2.0, 3.0, 3.0])
+        nptest.assert_array_almost_equal(thinned['x'], [0.2, 1.55, 2.7])
+
+    def test_min(self):
+        thinned, dropped = misc.thinBathymetry(self.bathy, resolution=1,
+                                               how='min')
+        nptest.assert_array_almost_equal(
+            thinned.values,
+            [[0.1, 0.1, 1.0], [1.6, 0.6, 2.0], [2.7, 2.7, 3.0]]
+        )
+
+    def test_local_spacing(self):
+        x, y = testing.makeSimpleNodes()
+        known = misc.thinBathymetry(self.bathy, resolution=0.25)
+        result = misc.thinBathymetry(self.bathy, x_points=x, y_points=y)
+        pdtest.assert_frame_equal(result[0], known[0])
+        nt.assert_equal(result[1], known[1])
+
+    def test__local_spacing(self):
+        x, y = testing.makeSimpleNodes()
+        spacing = misc._local_spacing(x, y)
+        nptest.assert_array_almost_equal(spacing[~x.mask],
+                                         0.5 * np.ones((~x.mask).sum()))
+
+    @nt.raises(ValueError)
+    def test_bad_how(self):
+        misc.thinBathymetry(self.bathy, resolution=1, how='junk')
+
+    @nt.raises(ValueError)
+    def test_no_resolution(self):
+        misc.thinBathymetry(self.bathy)
+
+    @nt.raises(ValueError)
+    def test_zero_resolution(self):
+        misc.thinBathymetry(self.bathy, resolution=0)
+
+    @nt.raises(ValueError)
+    def test_nan_resolution(self):
+        misc.thinBathymetry(self.bathy, resolution=nan)
+
+    def test_dropped_reported(self):
+        messages = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+
+        handler = Handler()
+        misc.logger.addHandler(handler)
+        misc.logger.setLevel(logging.INFO)
+        try:
+            x, y = testing.makeSimpleNodes()
+            bathy = testing.makeSimpleBathy()
+            misc.interpolateBathymetry(bathy, x, y, engine='nearest',
+                                       thin='mean')
+        finally:
+            misc.logger.removeHandler(handler)
+            misc.logger.setLevel(logging.NOTSET)
+
+        message, = messages
+        dropped, total = [int(n) for n in message.split()
+                          if n.isdigit()]
+        nt.assert_true(0 < dropped < total)
+        nt.assert_true(message.startswith('thinning (mean) dropped'))
+
+
+class test_RasterBathymetry(object):
+    def setup(self):
+        # pixel centers at x = 0.25, 0.75, ..., 4.75 and
+        # y = 4.25, 3.75, ..., -0.25
+        self.transform = (0, 0.5, 0, 4.5, 0, -0.5)
+        xc = np.arange(0.25, 5, 0.5)
+        yc = np.arange(4.25, -0.5, -0.5)
+        XX, YY = np.meshgrid(xc, yc)
+        self.values = 100 + 0.1 * XX + 0.1 * YY
+        self.raster = misc.RasterBathymetry(self.values, self.transform)
+
+    def test_bbox(self):
+        nt.assert_tuple_equal(self.raster.bbox, (0, -0.5, 5, 4.5))
+
+    def test_sample(self):
+        x, y = testing.makeSimpleNodes()
+        elev = self.raster.sample(x, y)
+        nt.assert_true(isinstance(elev, np.ma.MaskedArray))
+        nptest.assert_array_equal(elev.mask, x.mask)
+        nptest.assert_array_almost_equal(elev, 100 + 0.1 * (x + y))
+
+    def test_sample_edges_and_outside(self):
+        x = np.array([0.0, 0.1, 4.9, 5.0, 5.1, -0.1, 2.0])
+        y = np.array([2.0, 2.0, 2.0, 2.0, 2.0, 2.0, 4.7])
+        elev = self.raster.sample(x, y)
+        nt.assert_false(isinstance(elev, np.ma.MaskedArray))
+        nptest.assert_array_almost_equal(
+            elev, [100.225, 100.225, 100.675, 100.675, nan, nan, nan]
+        )
+
+    def test_sample_missing(self):
+        self.raster.values[4, 3] = nan
+        elev = self.raster.sample(np.array([1.9, 3.0]), np.array([2.0, 2.0]))
+        nt.assert_true(np.isnan(elev[0]))
+        nptest.assert_almost_equal(elev[1], 100.5)
+
+    def test_window(self):
+        window = self.raster.window((2.1, 1.1, 2.9, 1.9))
+        nt.assert_tuple_equal(window.shape, (4, 4))
+        nt.assert_tuple_equal(window.transform, (1.5, 0.5, 0, 2.5, 0, -0.5))
+        x = np.array([2.1, 2.5, 2.9])
+        y = np.array([1.1, 1.5, 1.9])
+        nptest.assert_array_almost_equal(window.sample(x, y),
+                                         self.raster.sample(x, y))
+
+    def test_raster_window(self):
+        rows, cols = misc.raster_window(self.transform, (10, 10),
+                                        (2.1, 1.1, 2.9, 1.9), pad=0)
+        nt.assert_equal(rows, slice(5, 7))
+        nt.assert_equal(cols, slice(4, 6))
+
+    @nt.raises(ValueError)
+    def test_rotated(self):
+        misc.RasterBathymetry(self.values, (0, 0.5, 0.1, 4, 0, -0.5))
+
+    @nt.raises(ValueError)
+    def test_not_2D(self):
+        misc.RasterBathymetry(self.values.flatten(), self.transform)
+
+
 class test_padded_stack(object):
 
     def setup(self):
@@ -448,6 +830,24 @@ class test_make_gefdc_cells_simple_nomask(base_make_gefdc_cells):
         ])
 
 
+class test_make_gefdc_cells_mask_is_None(base_make_gefdc_cells):
+    def setup(self):
+        size = 6
+        self.triangles = False
+        self.nodes = np.ones((size, size))
+        self.mask = None
+
+        self.known_cells = np.array([
+            [9, 9, 9, 9, 9, 9, 9],
+            [9, 5, 5, 5, 5, 5, 9],
+            [9, 5, 5, 5, 5, 5, 9],
+            [9, 5, 5, 5, 5, 5, 9],
+            [9, 5, 5, 5, 5, 5, 9],
+            [9, 5, 5, 5, 5, 5, 9],
+            [9, 9, 9, 9, 9, 9, 9]
+        ])
+
+
 class test_make_gefdc_cells_complex_nomask(base_make_gefdc_cells):
     def setup(self):
         self.triangles = False
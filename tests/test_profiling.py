@@ -0,0 +1,175 @@
+import json
+import types
+import logging
+
+import numpy as np
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from pygridtools import misc
+from pygridtools import profiling
+
+
+@profiling.traced('test.fill', count='x')
+def _fill(x, value=0):
+    y = np.empty_like(x)
+    y.fill(value)
+    return y
+
+
+class test_span(object):
+    def setup(self):
+        self.collector = profiling.MemoryCollector()
+
+    def teardown(self):
+        profiling.disable()
+
+    def test_disabled(self):
+        with profiling.span('nothing', count=5) as s:
+            s['other'] = 1
+        nt.assert_true(s is profiling.span('again'))
+        nt.assert_equal(_fill(np.ones(3), 2).tolist(), [2, 2, 2])
+        nt.assert_list_equal(self.collector.records, [])
+
+    def test_nested(self):
+        profiling.enable(self.collector)
+        with profiling.span('outer', count=2) as s:
+            with profiling.span('inner'):
+                pass
+            s['extra'] = 'x'
+
+        inner, outer = self.collector.records
+        nt.assert_equal(inner['name'], 'inner')
+        nt.assert_equal(inner['parent'], 'outer')
+        nt.assert_equal(inner['depth'], 1)
+        nt.assert_equal(outer['count'], 2)
+        nt.assert_equal(outer['extra'], 'x')
+        nt.assert_true(outer['parent'] is None)
+        nt.assert_true(outer['wall'] >= inner['wall'])
+        nt.assert_true(outer['peak_memory'] is None)
+
+    def test_traced(self):
+        profiling.enable(self.collector)
+        _fill(np.zeros((4, 5)), value=1)
+        record, = self.collector.records
+        nt.assert_equal(record['name'], 'test.fill')
+        nt.assert_equal(record['count'], 20)
+
+    def test_pipeline(self):
+        profiling.enable(self.collector)
+        misc.make_gefdc_cells(np.ones((4, 3), dtype=bool))
+        record, = self.collector.records
+        nt.assert_equal(record['name'], 'misc.make_gefdc_cells')
+        nt.assert_equal(record['count'], 12)
+
+    def test_memory(self):
+        profiling.enable(self.collector, memory=True)
+        with profiling.span('outer'):
+            _fill(np.zeros(100000))
+
+        inner, outer = self.collector.records
+        nt.assert_true(inner['peak_memory'] >= 800000)
+        nt.assert_true(outer['peak_memory'] >= inner['peak_memory'])
+
+    def test_profile_restores(self):
+        other = profiling.MemoryCollector()
+        profiling.enable(other)
+        with profiling.profile(self.collector):
+            with profiling.span('inside'):
+                pass
+        with profiling.span('after'):
+            pass
+
+        nt.assert_equal([r['name'] for r in self.collector.records],
+                        ['inside'])
+        nt.assert_equal([r['name'] for r in other.records], ['after'])
+
+    def test_memory_without_reset_peak(self):
+        # before python 3.9, tracemalloc can't reset its peak
+        profiling.enable(self.collector, memory=True)
+        tracemalloc = profiling.tracemalloc
+        old = types.ModuleType('tracemalloc')
+        for name in ('start', 'stop', 'is_tracing', 'get_traced_memory'):
+            setattr(old, name, getattr(tracemalloc, name))
+
+        profiling.tracemalloc = old
+        try:
+            _fill(np.zeros(400000))
+            with profiling.span('outer'):
+                _fill(np.zeros(100000))
+        finally:
+            profiling.tracemalloc = tracemalloc
+
+        # the earlier, larger peak doesn't leak into the later spans
+        first, inner, outer = self.collector.records
+        nt.assert_true(first['peak_memory'] >= 3200000)
+        nt.assert_true(800000 <= inner['peak_memory'] < 3200000)
+        nt.assert_true(inner['peak_memory'] <= outer['peak_memory'] < 3200000)
+
+    def test_traced_without_signature(self):
+        # python 2.7 has no inspect.signature
+        signature = profiling._signature
+        profiling._signature = None
+        try:
+            @profiling.traced('test.fill', count='x')
+            def fill(x, value=0):
+                return x + value
+        finally:
+            profiling._signature = signature
+
+        profiling.enable(self.collector)
+        fill(np.zeros((2, 3)), value=1)
+        record, = self.collector.records
+        nt.assert_equal(record['count'], 6)
+
+    @nt.raises(TypeError)
+    def test_bad_option(self):
+        profiling.enable(self.collector, memroy=True)
+
+
+class test_sinks(object):
+    def setup(self):
+        self.outputfile = 'tests/result_files/spans.jsonl'
+
+    def teardown(self):
+        profiling.disable()
+
+    def test_summary(self):
+        collector = profiling.MemoryCollector()
+        with profiling.profile(collector):
+            for n in range(3):
+                _fill(np.zeros(n + 1))
+            with profiling.span('other'):
+                pass
+
+        summary = collector.summary()
+        nptest.assert_array_equal(summary.loc['test.fill', 'calls'], 3)
+        nt.assert_equal(collector.to_dataframe().shape[0], 4)
+
+    def test_jsonlines(self):
+        with open(self.outputfile, 'w') as f:
+            with profiling.profile(profiling.JSONLinesSink(f)):
+                _fill(np.zeros(7))
+
+        with open(self.outputfile, 'r') as f:
+            record, = [json.loads(line) for line in f]
+        nt.assert_equal(record['name'], 'test.fill')
+        nt.assert_equal(record['count'], 7)
+
+    def test_logging(self):
+        messages = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+
+        logger = logging.getLogger('pygridtools.test_profiling')
+        logger.addHandler(Handler())
+        logger.setLevel(logging.INFO)
+        with profiling.profile(profiling.LoggingSink(logger)):
+            _fill(np.zeros(7))
+
+        nt.assert_equal(len(messages), 1)
+        nt.assert_true(messages[0].startswith('test.fill: '))
+        nt.assert_true(messages[0].endswith('count=7'))